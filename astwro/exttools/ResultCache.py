@@ -0,0 +1,237 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from astwro.config.logger import logger as module_logger
+from astwro.config import get_config
+
+
+class ResultCache(object):
+    """
+    On-disk, content addressed cache of external tools runs results
+
+    Key of the run is hash of: executable content, arguments, stdin commands, and names and contents
+    of input files of the commands (symlinks followed): files declared as inputs of queued commands,
+    option files and image (see :meth:`Runner._cache_inputs`). Other files of *runner directory*, e.g. outputs
+    of previous runs, do not change the key.
+    Stored are stdout, stderr and files created or changed in *runner directory* during the run.
+    Only runs finished with exit code 0 are stored. When total size exceeds ``max_size``,
+    least recently used entries are removed.
+
+    Cache is opt-in, set it for single runner or for all runners:
+        >>> Runner.cache = ResultCache()  # location and size limit from [cache] section of astwro.cfg
+        >>> dp = Daophot(image='i.fits')
+        >>> dp.cache = ResultCache('~/psf_cache', max_size=10 * 2**30)
+
+    Runs in :attr:`Runner.preserve_process` mode are not cached, because state of living process is unknown.
+
+    :param str dir: cache directory, default: ``dir`` from ``[cache]`` section of configuration
+    :param int max_size: size limit in bytes, default: ``max_size`` (MB) from ``[cache]`` section of configuration
+    """
+
+    def __init__(self, dir=None, max_size=None):
+        config = get_config()
+        if dir is None:
+            dir = config.get('cache', 'dir')
+        if max_size is None:
+            max_size = config.getint('cache', 'max_size') * 2**20
+        self.logger = module_logger.getChild(type(self).__name__)
+        self.dir = os.path.abspath(os.path.expanduser(dir))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__hashes = {}  # content hashes of files by (path, inode, size, mtime)
+        self.__size = None  # running total of cache size, measured on first store
+        self.__lock = threading.Lock()
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+
+    def file_hash(self, path):
+        """Hash of file content, remembered until file change (inode, size or mtime)"""
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        signature = (path, st.st_ino, st.st_size, st.st_mtime)
+        with self.__lock:
+            h = self.__hashes.get(signature)
+        if h is None:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    sha.update(block)
+            h = sha.hexdigest()
+            with self.__lock:
+                self.__hashes[signature] = h
+        return h
+
+    @staticmethod
+    def snapshot(dir):
+        """Signatures of regular files (symlinks followed) in directory: dict name -> (inode, size, mtime)"""
+        signatures = {}
+        for name in os.listdir(dir):
+            try:
+                st = os.stat(os.path.join(dir, name))
+            except OSError:  # broken symlink
+                signatures[name] = None
+                continue
+            if not os.path.isdir(os.path.join(dir, name)):
+                signatures[name] = (st.st_ino, st.st_size, st.st_mtime)
+        return signatures
+
+    def key(self, executable, arguments, commands, dir, inputs):
+        """
+        Computes key of run
+
+        :param inputs: names of input files in ``dir``
+        """
+        sha = hashlib.sha1()
+        exe_path = _which(executable)
+        sha.update(self.file_hash(exe_path).encode() if exe_path else str(executable).encode())
+        sha.update(json.dumps([list(arguments), commands]).encode())
+        for name in sorted(set(inputs)):
+            try:
+                content = self.file_hash(os.path.join(dir, name))
+            except (IOError, OSError):  # missing or broken symlink
+                content = 'missing'
+            sha.update('{}\0{}\0'.format(name, content).encode())
+        return sha.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.dir, key[:2], key)
+
+    def restore(self, key, dir):
+        """
+        Restores files of cached run into directory
+
+        :return: (stdout, stderr) bytes or None if key not in cache
+        """
+        entry = self._entry_path(key)
+        try:
+            with open(os.path.join(entry, 'run.json')) as f:
+                meta = json.load(f)
+            for name in meta['files']:
+                dst = os.path.join(dir, name)
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                shutil.copy(os.path.join(entry, 'files', name), dst)
+            for name in meta['removed']:
+                if os.path.lexists(os.path.join(dir, name)):
+                    os.remove(os.path.join(dir, name))
+            with open(os.path.join(entry, 'stdout'), 'rb') as f:
+                stdout = f.read()
+            with open(os.path.join(entry, 'stderr'), 'rb') as f:
+                stderr = f.read()
+            os.utime(entry, None)  # recently used
+        except (OSError, IOError, ValueError):  # missing or evicted meanwhile
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.logger.debug('Cache hit: {}'.format(key))
+        return stdout, stderr
+
+    def store(self, key, dir, snapshot, stdout, stderr):
+        """Stores results of run: stdout, stderr and files in ``dir`` changed since ``snapshot``"""
+        after = self.snapshot(dir)
+        files = [n for n, s in after.items()
+                 if s is not None and snapshot.get(n) != s and not os.path.islink(os.path.join(dir, n))]
+        removed = [n for n in snapshot if n not in after]
+        entry = self._entry_path(key)
+        if os.path.isdir(entry):
+            return
+        if not os.path.isdir(os.path.dirname(entry)):
+            try:
+                os.makedirs(os.path.dirname(entry))
+            except OSError:  # created by other thread or process
+                pass
+        tmp = tempfile.mkdtemp(prefix='.tmp', dir=os.path.dirname(entry))
+        try:
+            os.mkdir(os.path.join(tmp, 'files'))
+            for name in files:
+                shutil.copy(os.path.join(dir, name), os.path.join(tmp, 'files', name))
+            with open(os.path.join(tmp, 'stdout'), 'wb') as f:
+                f.write(stdout)
+            with open(os.path.join(tmp, 'stderr'), 'wb') as f:
+                f.write(stderr)
+            with open(os.path.join(tmp, 'run.json'), 'w') as f:
+                json.dump({'files': files, 'removed': removed}, f)
+            size = _dir_size(tmp)
+            os.rename(tmp, entry)
+        except OSError:  # stored by other process meanwhile or no space
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.logger.debug('Cache store: {} files: {}'.format(key, files))
+        with self.__lock:
+            if self.__size is None:
+                self.__size = self.size  # including stored entry
+            else:
+                self.__size += size
+            full = self.__size > self.max_size
+        if full:
+            self.evict()
+
+    def entries(self):
+        """List of (last use time, size, path) of cache entries"""
+        entries = []
+        for prefix in os.listdir(self.dir):
+            pdir = os.path.join(self.dir, prefix)
+            if not os.path.isdir(pdir):
+                continue
+            for name in os.listdir(pdir):
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(pdir, name)
+                try:
+                    entries.append((os.path.getmtime(path), _dir_size(path), path))
+                except OSError:  # removed meanwhile
+                    pass
+        return entries
+
+    @property
+    def size(self):
+        """Total size of cached results in bytes"""
+        return sum(s for _, s, _ in self.entries())
+
+    def evict(self, max_size=None):
+        """
+        Removes least recently used entries until total size is below ``max_size`` (default: cache limit)
+
+        Called by :meth:`store` when running total of cache size exceeds the limit.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self.entries())
+        total = sum(s for _, s, _ in entries)
+        for _, size, path in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        with self.__lock:
+            self.__size = total
+
+    def clear(self):
+        """Removes all cache entries"""
+        self.evict(max_size=0)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+
+def _which(executable):
+    """Absolute path of executable found in PATH, None if not found"""
+    if executable is None:
+        return None
+    if os.path.dirname(executable):
+        return executable if os.path.isfile(executable) else None
+    for d in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(d, executable)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
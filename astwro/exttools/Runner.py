@@ -3,9 +3,11 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os
-import sys
+import time
 import shutil
 import hashlib
+import tempfile
+import threading
 from copy import deepcopy
 try:
     # noinspection PyCompatibility
@@ -23,10 +25,15 @@ except ImportError:
 from astwro.config.logger import logger as module_logger
 from astwro.config import get_config
 from astwro.utils import tmpdir, TmpDir
-from .output_processors import StreamKeeper, OutputProvider
+from .output_processors import StreamKeeper, OutputProvider, ProcessOutputStream
+from .profiling import RunProfile, wait_process, file_size
+try:
+    from .coroutines import RunnerCoroutines  # python 3.5+
+except SyntaxError:
+    RunnerCoroutines = object  # python 2 - no asyncio API
 
 
-class Runner(object):
+class Runner(RunnerCoroutines):
     """
     Base class for specific runners.
 
@@ -70,19 +77,42 @@ class Runner(object):
     class RunnerTypeError(TypeError, RunnerException):
         pass
 
-    raise_on_nonzero_exitcode = True
-    preserve_process = False  # not implemented
+    class RunnerTimeoutError(RunnerException):
+        """Exceptions raised when process exceeds :attr:`timeout` or :attr:`command_timeout`,
+        process is killed and runner canceled"""
+        pass
 
-    def __init__(self, dir=None, batch=False):
+    raise_on_nonzero_exitcode = True
+    preserve_process = False
+    cache = None
+    output_max_lines = None
+    """If set, only that number of last lines of stdout is kept in :attr:`output` (memory bound for verbose runs),
+       output processors get all lines anyway"""
+    profile_report = None
+    """:class:`ProfileReport` collecting profiles of all runs"""
+    timeout = None
+    """Limit of seconds for whole run, when exceeded process is killed and :class:`RunnerTimeoutError` raised"""
+    command_timeout = None
+    """Limit of seconds of waiting for output of single command, e.g. hung PSF (not checked by :meth:`arun`)"""
+    __session = None
+
+    def __init__(self, dir=None, batch=False, preserve_process=None):
         """
         :param dir: path name or TmpDir object, in not provided new temp dir will be used
         :param bool batch:      whether Daophot have to work in batch mode.
+        :param bool preserve_process: whether to keep underlying process alive between runs (session mode),
+                                      default: class attribute `preserve_process` (False)
         """
         self.logger = module_logger.getChild(type(self).__name__)
         self.executable = None
         self.arguments = []
         self.batch_mode = batch
+        if preserve_process is not None:
+            self.preserve_process = preserve_process
         self.__stream_keeper = None
+        self.__session = None
+        self.__session_stream = None
+        self.__session_stderr = None
 
         self._prepare_dir(dir)
         self._reset()
@@ -95,8 +125,12 @@ class Runner(object):
         self.stderr = None
         self.returncode = None
         self.__process = None
+        self.__stderr_file = None
         self.__commands = ''
         self.ext_output_files = set()
+        self._pending_communication = None  # future of process started by arun()
+        self.__cache_run = None  # (key, runner dir snapshot) of run to be stored in cache
+        self.profile = RunProfile(self)  # resources used by current (or last finished) run
 
         if self.__stream_keeper is not None:
             self.__stream_keeper.stream = None # new chain containing only old StreamKeeper
@@ -111,6 +145,9 @@ class Runner(object):
         memo[id(self)] = new
 
         new.__stream_keeper = None
+        new.__session = None
+        new.__session_stream = None
+        new.__session_stderr = None
         new._reset()
         new.logger = self.logger
         new.executable = self.executable
@@ -118,6 +155,12 @@ class Runner(object):
         # new.stderr = self.stderr
         # new.returncode = self.returncode
         new.batch_mode = self.batch_mode
+        new.preserve_process = self.preserve_process
+        new.cache = self.cache
+        new.output_max_lines = self.output_max_lines
+        new.profile_report = self.profile_report
+        new.timeout = self.timeout
+        new.command_timeout = self.command_timeout
         new.arguments = self.arguments
         # new.__process = None
         # new.__commands = self.__commands
@@ -150,8 +193,38 @@ class Runner(object):
     def close(self):
         """Cleans things up."""
         self._on_exit()
+        self._close_session()
         self.dir = None
 
+    @property
+    def session_alive(self):
+        """
+        Whether process kept by :attr:`preserve_process` mode is alive and waiting for commands
+
+        :return: bool
+        """
+        return self.__session is not None and self.__session.poll() is None
+
+    def _close_session(self, kill=False):
+        """Closes stdin of process kept alive in :attr:`preserve_process` mode, and waits for its exit"""
+        session = self.__session
+        if session is None:
+            return
+        self.__session = None
+        try:
+            if kill:
+                session.kill()
+            session.stdin.close()
+        except (OSError, ValueError):  # died already, broken pipe
+            pass
+        try:
+            session.wait(timeout=5)
+        except TimeoutExpired:
+            session.kill()
+            session.wait()
+        session.stdout.close()
+        self.__session_stderr.close()
+
     @property
     def mode(self):
         """Either "normal" or "batch". In batch mode, commands are not executed but collected
@@ -177,9 +250,17 @@ class Runner(object):
             self.executable = os.path.expanduser(get_config().get('executables', exe))
 
 
+    @staticmethod
+    def _runner_dir_base():
+        """Base dir for temporary runner dirs and required free space in bytes, from [runner] section of config"""
+        config = get_config()
+        base = config.get('runner', 'dir_base')
+        return (os.path.expanduser(base) if base else None), config.getint('runner', 'dir_min_free') * 2**20
+
     def _prepare_dir(self, dir=None, init_files=True):
         if dir is None:
-            dir = tmpdir(prefix='pydaophot_tmp')
+            base, min_free = self._runner_dir_base()
+            dir = tmpdir(prefix='pydaophot_tmp', base_dir=base, min_free=min_free)
         elif isinstance(dir, str):
             dir = tmpdir(use_existing=dir)
         elif not isinstance(dir, TmpDir):
@@ -190,14 +271,20 @@ class Runner(object):
 
     def copy_to_runner_dir(self, source, filename=None):
         """Copies source file to  runner dir under name filename or the same
-        as original if filename is None. Overwrites existing file."""
-        dst = self.dir.path if filename is None else os.path.join(self.dir.path, filename)
-        shutil.copy(source, dst)
+        as original if filename is None. Overwrites existing file.
+        Files larger than ``link_min_size`` from [runner] section of config (e.g. images) are symlinked instead."""
+        if filename is None:
+            filename = os.path.basename(source)
+        if os.path.getsize(source) >= get_config().getint('runner', 'link_min_size') * 2**20:
+            self.link_to_runner_dir(source, filename)
+            return
+        self.rm_from_runner_dir(filename)  # do not write through link (symlink or hardlink of cloned dir)
+        shutil.copy(source, os.path.join(self.dir.path, filename))
 
     def link_to_runner_dir(self, source, link_filename=None):
         # type: (str, str) -> None
         """Creates symlink in  runner dir under name filename or the same
-        as original if filename is None. Overwrites existing link.
+        as original if filename is None. Overwrites existing link to other file.
         :param source: file patch  
         :param link_filename: worker dir link name, default: same as filename part of source"""
         source = self.expand_path(source)
@@ -206,6 +293,11 @@ class Runner(object):
         if link_filename is None:
             link_filename = os.path.basename(source)
         dest = os.path.join(self.dir.path, link_filename)
+        try:
+            if os.readlink(dest) == source:
+                return  # already linked, do not remove file which can be in use by other runner
+        except OSError:
+            pass
         try:
             os.remove(dest)
         except OSError:
@@ -296,6 +388,7 @@ class Runner(object):
         """ make link for non-local input files in runner dir, gen runner dir filename """
         if not path:
             return '',''
+        start = time.time()
         if os.path.dirname(os.path.abspath(path)) == self.dir.path: # path to runner dir provided, cut it
             path = os.path.basename(path)
         if os.path.basename(path) != path:  # not in runner directory
@@ -314,9 +407,13 @@ class Runner(object):
             # remove runner dir file if exist
             self.rm_from_runner_dir(local)
 
+        (self.profile.output_files if output else self.profile.input_files)[local] = None  # size measured on run
+        self.profile.prepare_time += time.time() - start
         return local, absolute
 
     def _pre_run(self, wait):
+        """Called before commands are sent to the process. In :attr:`preserve_process` mode subclasses
+        should check :attr:`session_alive` to avoid repeating process initialization commands"""
         pass
 
     def run(self, wait=True):
@@ -327,36 +424,47 @@ class Runner(object):
         executed immediately. In "batch" :meth:`mode <mode>`, commands  execution is queued and postponed
         until :meth:`.run`
 
+        If :attr:`preserve_process` is set, process is not finished after execution of queue, but kept alive
+        and reused by next runs, commands are written to its stdin and output of every command is
+        collected until the command prompt is detected by output processor.
+
+        If :attr:`cache` (:class:`ResultCache`) is set, and the same commands were run on the same
+        input files before, process is not started, results are taken from the cache.
+
         :param bool wait:
             If false,  :meth:`run` exits without waiting for finishing commands executions (asynchronous processing).
             Call :meth:`wait_for_results` before accessing results.
         :return: None
         """
         self._pre_run(wait)
+        self._profile_start()
+        if self.preserve_process:
+            self.__session_run(wait)
+            return
+        if self._cached_run():
+            return
+        self.__stderr_file = tempfile.TemporaryFile()  # not a pipe, stdout is the only one to be read
         try:
             self.__process = sp.Popen([self.executable] + self.arguments,
                                       stdin=sp.PIPE,
                                       stdout=sp.PIPE,
-                                      stderr=sp.PIPE,
-                                      cwd=self.dir.path)
+                                      stderr=self.__stderr_file,
+                                      cwd=self.dir.path,
+                                      env=self._process_env())
         except OSError as e:
+            self.__stderr_file.close()
             self.logger.error(
                 'Executable: %s is expected in PATH, configure executable name/path in ~/pydaophot.cfg e.g.',
                 self.executable)
             raise e
         self.logger.debug('STDIN:\n' + self.__commands)
+        self.input = self.__commands.encode(encoding='ascii')
+        self.__write_input(self.__process.stdin, close=True)  # closing stdin gives EOF after the last command
+        # output processors parse stdout lines as they arrive, also before wait_for_results()
+        self.__stream_keeper.stream = self.__limit_time(
+            ProcessOutputStream(self.__process.stdout, max_lines=self.output_max_lines))
         if wait:
-            self.__communicate(self.__commands)
-        else:
-            if sys.version_info[0] > 2:  # python 3 has timeout in communicate
-                try:
-                    self.__communicate(self.__commands, timeout=0.01)
-                except TimeoutExpired:
-                    pass
-            else:  # python 2 - write directly to stdin and close it to flush end generate EOF
-                self.__process.stdin.write(self.__commands)
-                self.__process.stdin.close()
-                self.__process.stdin = None
+            self.__collect()
 
     def is_ready_to_run(self):
         """
@@ -364,7 +472,7 @@ class Runner(object):
 
         :return: bool
         """
-        return self.__commands and self.__process is None
+        return self.__commands and self.__process is None and self.output is None
 
     @property
     def running(self):
@@ -392,23 +500,226 @@ class Runner(object):
     def wait_for_results(self):
         """In the "batch" mode, waits for commands completion if :meth:`run(wait=False) <run>` was called """
         if self.running:
-            self.__communicate()
+            if self._pending_communication is not None:
+                raise Runner.RunnerException('Process started by arun(), use await_for_results()', self)
+            if self.__process is self.__session:
+                self.__session_collect()
+            else:
+                self.__collect()
         if self.is_ready_to_run():
             self.run(wait=True)
 
-    def __communicate(self, inpt=None, timeout=None):
-        i = inpt.encode(encoding='ascii') if inpt else None
-        self.input = i
-        o, e = self.__process.communicate(i, timeout=timeout) if timeout else self.__process.communicate(i)
-        self.output = o.decode('ascii')
-        self.stderr = e.decode('ascii')
+    @staticmethod
+    def _process_env():
+        # output, and prompts especially, must not stay in buffers of fortran programs
+        return dict(os.environ, GFORTRAN_UNBUFFERED_PRECONNECTED='y')
+
+    def __session_run(self, wait):
+        if not self.session_alive:
+            self._close_session()  # cleanup if died
+            self.__session_stderr = tempfile.TemporaryFile()
+            try:
+                self.__session = sp.Popen([self.executable] + self.arguments,
+                                          stdin=sp.PIPE,
+                                          stdout=sp.PIPE,
+                                          stderr=self.__session_stderr,
+                                          cwd=self.dir.path,
+                                          env=self._process_env())
+            except OSError as e:
+                self.logger.error(
+                    'Executable: %s is expected in PATH, configure executable name/path in ~/pydaophot.cfg e.g.',
+                    self.executable)
+                raise e
+            self.__session_stream = ProcessOutputStream(self.__session.stdout, max_lines=self.output_max_lines)
+            self.logger.debug('Started session process {} pid={}'.format(self.executable, self.__session.pid))
+        self.__process = self.__session
+        self.logger.debug('STDIN:\n' + self.__commands)
+        self.input = self.__commands.encode(encoding='ascii')
+        self.__write_input(self.__session.stdin, close=False)
+        if wait:
+            self.__session_collect()
+
+    def __write_input(self, stdin, close):
+        # written by thread while stdout is read: input larger than pipe buffer would block the process
+        # on writing its output, and us on writing its input
+        data = self.input
+
+        def write():
+            try:
+                stdin.write(data)
+                if close:
+                    stdin.close()
+                else:
+                    stdin.flush()
+            except (OSError, IOError, ValueError):  # broken pipe, process died, let collector report it
+                pass
+
+        writer = threading.Thread(target=write, name='{} stdin'.format(self.executable))
+        writer.daemon = True
+        writer.start()
+
+    def __session_collect(self):
+        self.__stream_keeper.stream = self.__limit_time(self.__session_stream)
+        # processors consume output up to prompt after their command, the last one waits for the queue end
+        self.__processors_chain_last.get_output_stream()
+        output = self.__session_stream.pop_text()
+        stderr, returncode = '', None
+        if self.__session.poll() is not None or self.__session_stream.eof:
+            self.__session.wait()
+            self.__session_stderr.seek(0)
+            stderr = self.__session_stderr.read().decode('ascii')
+            returncode = self.__session.returncode
+            self._close_session()
+        self.profile.bytes_out = len(output)
+        self.__finish(output, stderr, returncode)
+
+    def __collect(self):
+        stream = self.__stream_keeper.stream
+        # processors consume their parts of output, then the rest is read
+        self.__processors_chain_last.get_output_stream()
+        for _ in stream:
+            pass
+        rusage = wait_process(self.__process)
+        if rusage is not None:
+            self.profile.set_rusage(rusage)
+        self.profile.bytes_out = stream.bytes_read
+        self.__process.stdout.close()
+        self.__stderr_file.seek(0)
+        stderr = self.__stderr_file.read().decode('ascii')
+        self.__stderr_file.close()
+        self.__finish(stream.pop_text(), stderr, self.__process.returncode, cacheable=not stream.truncated)
+
+    @property
+    def _commands(self):
+        """Commands queued for the process stdin"""
+        return self.__commands
+
+    def _attach_process(self, process):
+        """Registers process started outside of :meth:`run`, e.g. by asyncio"""
+        self.__process = process
+
+    def _collect_output(self, o, e, returncode):
+        """Processes stdout and stderr (bytes) of finished process"""
+        output = o.decode('ascii')
+        self.__stream_keeper.stream = StringIO(output)
+        self.__finish(output, e.decode('ascii'), returncode)
+        # fill chained processors buffers
+        self.__processors_chain_last.get_output_stream()
+
+    def __finish(self, output, stderr, returncode, cacheable=True):
+        self.__profile_finish(output, returncode)
+        self.output = output
+        self.stderr = stderr
         self.logger.debug('STDOUT:\n' + self.output)
-        self.__stream_keeper.stream = StringIO(self.output)
-        self.returncode = self.__process.returncode
-        if self.returncode != 0:
+        self.returncode = returncode
+        if self.returncode is not None and self.returncode != 0:
             self.logger.warning('{} process finished with error code {}'.format(self.executable, self.returncode))
             if self.raise_on_nonzero_exitcode:
                 raise Runner.ExitError('Execution failed, exit code {}'.format(self.returncode), self, self.returncode)
+        self.__copy_output_files()
+        if self.__cache_run is not None and self.returncode == 0 and cacheable:
+            key, snapshot = self.__cache_run
+            self.__cache_run = None
+            self.cache.store(key, self.dir.path, snapshot, output.encode('ascii'), stderr.encode('ascii'))
+
+    def _run_deadline(self):
+        """Time when current run exceeds :attr:`timeout`, or None"""
+        return None if self.timeout is None else self.profile.started + self.timeout
+
+    def __limit_time(self, stream):
+        stream.deadline = self._run_deadline()
+        stream.step_timeout = self.command_timeout
+        stream.on_timeout = self._on_timeout
+        return stream
+
+    def _on_timeout(self):
+        """Cancels run which exceeded time limit and raises :class:`RunnerTimeoutError`"""
+        self.logger.error('{} process exceeded time limit, killing it'.format(self.executable))
+        self.output = self.__stream_keeper.stream.pop_text() if self.__stream_keeper.stream else None
+        error = Runner.RunnerTimeoutError('Execution time limit exceeded', self)
+        self.cancel()
+        raise error
+
+    def cancel(self):
+        """
+        Cancels run: kills and reaps process (also one kept in :attr:`preserve_process` mode),
+        removes output files of the run from runner directory and resets runner, discarding queued commands.
+        """
+        process = self.__process
+        if process is not None and process is self.__session:
+            self._close_session(kill=True)
+        elif process is not None and self._pending_communication is not None:  # started by arun()
+            self._pending_communication.cancel()
+            try:
+                process.kill()
+            except OSError:  # finished already
+                pass
+        elif process is not None:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            self.__stderr_file.close()
+        for f in self.profile.output_files:
+            self.rm_from_runner_dir(f)
+        self._reset()
+
+    def __processors(self):
+        # chain of output processors in order of execution
+        chain = []
+        p = self.__processors_chain_last
+        while p is not self.__stream_keeper:
+            chain.append(p)
+            p = p._prev_in_chain
+        return chain[::-1]
+
+    def _profile_start(self):
+        """Starts :attr:`profile` of run, called just before process start (queue of commands complete)"""
+        p = self.profile
+        p.executable = self.executable
+        p.dir = self.dir.path
+        p.session = bool(self.preserve_process)
+        p.bytes_in = len(self.__commands)
+        p._processors = self.__processors()
+        for f in p.input_files:
+            p.input_files[f] = file_size(self.file_from_runner_dir(f))
+        p.started = time.time()
+
+    def __profile_finish(self, output, returncode):
+        p = self.profile
+        p.finished = time.time()
+        p.wall_time = p.finished - p.started
+        p.returncode = returncode
+        if not p.bytes_out:
+            p.bytes_out = len(output)
+        for f in p.output_files:
+            p.output_files[f] = file_size(self.file_from_runner_dir(f))
+        if self.profile_report is not None:
+            self.profile_report.add(p)
+
+    def _cache_inputs(self):
+        """Names of runner dir files read by queued commands, their content is part of :attr:`cache` key.
+        Subclasses add files read implicitly by the process (e.g. option files)"""
+        return list(self.profile.input_files)
+
+    def _cached_run(self):
+        """Looks for results of queued commands in :attr:`cache`, on hit processes them as output of run.
+        On miss remembers the run key, results will be stored after run. Returns True on hit"""
+        if self.cache is None or self.preserve_process:
+            return False
+        snapshot = self.cache.snapshot(self.dir.path)
+        key = self.cache.key(self.executable, self.arguments, self.__commands, self.dir.path, self._cache_inputs())
+        cached = self.cache.restore(key, self.dir.path)
+        if cached is None:
+            self.__cache_run = key, snapshot
+            return False
+        self.logger.debug('Results of run taken from cache, STDIN:\n' + self.__commands)
+        self.profile.cached = True
+        self.input = self.__commands.encode(encoding='ascii')
+        self._collect_output(cached[0], cached[1], 0)
+        return True
+
+    def __copy_output_files(self):
         # copy results - output files from runners directory to user specified path
         for f in self.ext_output_files:
             try:
@@ -419,8 +730,6 @@ class Runner(object):
                 self.logger.error(msg)
                 if self.raise_on_nonzero_exitcode:
                     raise Runner.NoFileError(msg, self, self.returncode)
-        # fill chained processors buffers
-        self.__processors_chain_last.get_output_stream()
 
 
     def _get_ready_for_commands(self):
@@ -452,5 +761,15 @@ class Runner(object):
                     self.__processors_chain_first = output_processor
         return output_processor
 
+    def _file_signature(self, filename):
+        """Identity of runner dir file: (symlink target, size, mtime), None if missing.
+        Used to detect changes of files read by process on start only, e.g. options files"""
+        path = self.file_from_runner_dir(filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return os.path.realpath(path), st.st_size, st.st_mtime
+
     def _on_exit(self):
         pass
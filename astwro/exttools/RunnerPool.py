@@ -0,0 +1,120 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from Queue import Queue  # python2
+except ImportError:
+    from queue import Queue  # python3
+
+from astwro.config.logger import logger as module_logger
+from .Runner import Runner
+
+
+class RunnerPool(object):
+    """
+    Bounded pool of workers cloned from prototype runner
+
+    Each worker is made of clone of prototype runner (with own copy of *runner directory*),
+    optionally extended by ``worker_factory`` (e.g. into dict of `Daophot` and `Allstar` sharing directory).
+    Functions submitted to pool are executed in threads, each one gets exclusive access to one free worker.
+    Underlying processes do the work, so threads run in parallel.
+
+    If function raises exception, worker is considered broken: it's runners are closed and
+    worker is recreated from prototype, with fresh copy of *runner directory*.
+    If exception is one of ``retry_on`` (by default: time limit exceeded by hung process, see
+    :attr:`Runner.timeout`), function is called again on another worker, up to ``retries`` times.
+
+    Example:
+        >>> pool = RunnerPool(Daophot(image='i.fits'))
+        >>> futures = [pool.submit(lambda d, n: d.PIck(n), n) for n in [10, 20, 30]]
+        >>> [f.result().stars for f in futures]
+
+    :param Runner runner: prototype runner, workers are made by :meth:`Runner.clone()`,
+                          should not be used by other threads while pool is working
+    :param int size: number of workers, default: number of CPUs
+    :param worker_factory: callable(cloned_runner) -> worker, objects passed to submitted functions,
+                           default: cloned runner itself
+    :param int retries: maximum number of repeated calls of failed function
+    :param retry_on: exception class or tuple of classes, which cause repeating of call
+    """
+
+    def __init__(self, runner, size=None, worker_factory=None, retries=0, retry_on=Runner.RunnerTimeoutError):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.logger = module_logger.getChild(type(self).__name__)
+        self.runner = runner
+        self.size = size
+        self.worker_factory = worker_factory
+        self.retries = retries
+        self.retry_on = retry_on
+        self.__idle = Queue()
+        for _ in range(size):
+            self.__idle.put(self._new_worker())
+        self.__executor = ThreadPoolExecutor(max_workers=size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _new_worker(self):
+        clone = self.runner.clone()
+        worker = clone if self.worker_factory is None else self.worker_factory(clone)
+        return clone, worker
+
+    @staticmethod
+    def _close_worker(clone, worker):
+        if isinstance(worker, dict):
+            worker = worker.values()
+        elif isinstance(worker, Runner):
+            worker = [worker]
+        for r in worker:
+            if isinstance(r, Runner) and r is not clone:
+                r.close()
+        clone.close()
+
+    def __execute(self, fn, args, kwargs):
+        attempt = 0
+        while True:
+            clone, worker = self.__idle.get()
+            try:
+                result = fn(worker, *args, **kwargs)
+            except Exception as e:
+                self.logger.warning('Worker in directory {} failed, recreating'.format(clone.dir))
+                self._close_worker(clone, worker)
+                self.__idle.put(self._new_worker())
+                if attempt < self.retries and isinstance(e, self.retry_on):
+                    attempt += 1
+                    self.logger.warning('Retrying, attempt {} of {}'.format(attempt, self.retries))
+                    continue
+                raise
+            self.__idle.put((clone, worker))
+            return result
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules ``fn(worker, *args, **kwargs)`` to be executed on free worker
+
+        :return: future of ``fn`` result
+        :rtype: concurrent.futures.Future
+        """
+        return self.__executor.submit(self.__execute, fn, args, kwargs)
+
+    def map(self, fn, *iterables):
+        """
+        Like :func:`map` calls ``fn(worker, *args)`` for arguments from ``iterables`` using all workers
+
+        :return: iterator of results in arguments order, raises exception of failed call
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return (f.result() for f in futures)
+
+    def close(self):
+        """Waits for submitted calls and closes all workers"""
+        self.__executor.shutdown(wait=True)
+        while not self.__idle.empty():
+            self._close_worker(*self.__idle.get())
@@ -1,2 +1,5 @@
 # coding=utf-8
 from .Runner import Runner
+from .RunnerPool import RunnerPool
+from .ResultCache import ResultCache
+from .profiling import ProfileReport
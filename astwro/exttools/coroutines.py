@@ -0,0 +1,113 @@
+# coding=utf-8
+"""asyncio API of runners, python 3.5+ only"""
+
+import time
+import asyncio
+from asyncio.subprocess import PIPE
+
+
+class RunnerCoroutines(object):
+    """
+    Coroutine variants of :class:`Runner` execution methods
+
+    Process is started by :func:`asyncio.create_subprocess_exec`, and awaiting for its results
+    does not block event loop, so many runners (each with own *runner directory*) can work
+    concurrently in single thread:
+
+        >>> async def psf(image):
+        ...     dp = Daophot(image=image)
+        ...     await dp.aFInd()
+        ...     await dp.aPHotometry(apertures=[8], IS=35, OS=50)
+        ...     return dp.PHotometry_result.photometry_starlist
+        >>> loop.run_until_complete(asyncio.gather(*[psf(f) for f in files]))
+
+    Single runner executes one queue at once, do not share runner between concurrent coroutines.
+    :attr:`Runner.preserve_process` mode is not supported by asynchronous execution.
+    """
+
+    async def arun(self, wait=True):
+        """
+        Coroutine variant of :meth:`Runner.run`
+
+        :param bool wait: if false, returns just after process start,
+                          await :meth:`await_for_results` before accessing results.
+        """
+        if self.preserve_process:
+            raise self.RunnerException('preserve_process mode is not supported by arun()', self)
+        self._pre_run(wait)
+        self._profile_start()
+        if self._cached_run():
+            return
+        try:
+            process = await asyncio.create_subprocess_exec(self.executable, *self.arguments,
+                                                           stdin=PIPE,
+                                                           stdout=PIPE,
+                                                           stderr=PIPE,
+                                                           cwd=self.dir.path,
+                                                           env=self._process_env())
+        except OSError as e:
+            self.logger.error(
+                'Executable: %s is expected in PATH, configure executable name/path in ~/pydaophot.cfg e.g.',
+                self.executable)
+            raise e
+        self._attach_process(process)
+        self.logger.debug('STDIN:\n' + self._commands)
+        self.input = self._commands.encode(encoding='ascii')
+        self._pending_communication = asyncio.ensure_future(_communicate(process, self.input))
+        if wait:
+            await self.await_for_results()
+
+    async def await_for_results(self):
+        """Coroutine variant of :meth:`Runner.wait_for_results`"""
+        if self.running and self._pending_communication is not None:
+            deadline = self._run_deadline()
+            try:
+                o, e, returncode = await asyncio.wait_for(self._pending_communication,
+                                                          None if deadline is None else max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                self._on_timeout()
+            self._collect_output(o, e, returncode)
+        elif self.running:
+            self.wait_for_results()  # started by run(wait=False)
+        if self.is_ready_to_run():
+            await self.arun(wait=True)
+
+    async def _acall(self, command, *args, **kwargs):
+        """Calls ``command`` method, in "normal" mode awaits for its execution by :meth:`arun`"""
+        if self.running:
+            await self.await_for_results()
+        if self.batch_mode:
+            return command(self, *args, **kwargs)
+        self.batch_mode = True  # just enqueue
+        try:
+            processor = command(self, *args, **kwargs)
+        finally:
+            self.batch_mode = False
+        await self.arun()
+        return processor
+
+
+async def _communicate(process, input):
+    try:
+        o, e = await process.communicate(input)
+    except asyncio.CancelledError:  # timeout, kill and reap process
+        try:
+            process.kill()
+        except OSError:
+            pass
+        await process.wait()
+        raise
+    return o, e, process.returncode
+
+
+def coroutine_variant(command):
+    """
+    Makes coroutine method from runner command method, e.g. ``aPSf = coroutine_variant(PSf)``
+
+    In "normal" mode coroutine awaits for command execution, in "batch" mode just enqueues command.
+    """
+    async def acommand(self, *args, **kwargs):
+        return await self._acall(command, *args, **kwargs)
+    acommand.__name__ = 'a' + command.__name__
+    acommand.__doc__ = 'Coroutine variant of :meth:`{}`'.format(command.__name__)
+    return acommand
@@ -1,6 +1,11 @@
 # coding=utf-8
 from __future__ import absolute_import, division, print_function
+import os
+import time
+import select
+from collections import deque
 from logging import *
+from .profiling import StepProfile
 
 __metaclass__ = type
 
@@ -30,10 +35,99 @@ class StreamKeeper(AbstractOutputProvider):
         return self.stream
 
 
+class OutputTimeout(Exception):
+    """Time limit of waiting for process output exceeded"""
+
+
+class ProcessOutputStream(object):
+    """Lines iterator over stdout of running process, lines are available as soon as process writes them
+
+    Unlike iteration over pipe object, yields also incomplete last line, when no more output is pending,
+    so the prompt of process waiting for input (like daophot's ``Command:``) reaches output processors.
+    Read text is recorded (only last ``max_lines`` lines if set) and can be collected by :meth:`pop_text`.
+
+    Waiting for output can be limited by absolute time ``deadline`` and by ``step_timeout`` seconds counted from
+    the last :meth:`start_step` call (made by output processors). When limit is exceeded, ``on_timeout`` is called,
+    or, if not set, :class:`OutputTimeout` raised.
+    """
+
+    def __init__(self, pipe, encoding='ascii', chunk_size=8192, max_lines=None):
+        self._fd = pipe.fileno()
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._lines = deque()
+        self._tail = ''
+        self._text = deque(maxlen=max_lines)
+        self.bytes_read = 0
+        self.deadline = None
+        self.step_timeout = None
+        self.on_timeout = None
+        self._step_deadline = None
+        self.eof = False
+        self.truncated = False  # some of read lines are not recorded
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._lines:
+            if self.eof:
+                raise StopIteration
+            self._read()
+        line = self._lines.popleft()
+        if len(self._text) == self._text.maxlen:
+            self.truncated = True
+        self._text.append(line)
+        return line
+
+    next = __next__  # python 2
+
+    def _read(self):
+        if self._tail and not select.select([self._fd], [], [], 0)[0]:
+            # nothing pending, process waits for input after incomplete line - prompt
+            self._lines.append(self._tail)
+            self._tail = ''
+            return
+        self._wait_for_output()
+        chunk = os.read(self._fd, self._chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self.eof = True
+            if self._tail:
+                self._lines.append(self._tail)
+                self._tail = ''
+            return
+        lines = (self._tail + chunk.decode(self._encoding)).splitlines(True)
+        self._tail = '' if lines[-1].endswith('\n') else lines.pop()
+        self._lines.extend(lines)
+
+    def start_step(self):
+        """Starts counting ``step_timeout``, called by output processor beginning to consume output of its command"""
+        self._step_deadline = None if self.step_timeout is None else time.time() + self.step_timeout
+
+    def _wait_for_output(self):
+        deadlines = [d for d in (self.deadline, self._step_deadline) if d is not None]
+        if not deadlines:
+            return
+        remaining = min(deadlines) - time.time()
+        if remaining <= 0 or not select.select([self._fd], [], [], remaining)[0]:
+            if self.on_timeout is not None:
+                self.on_timeout()
+            raise OutputTimeout('No output from process within time limit')
+
+    def pop_text(self):
+        """Returns text read since last call"""
+        text = ''.join(self._text)
+        self._text.clear()
+        return text
+
+
 class OutputProvider(AbstractOutputProvider):
     # Base class for elements of stream processors chain
     #    also can be used as dummy processor in chain
 
+    profile = None  # StepProfile, filled while output is consumed
+
     def __init__(self, prev_in_chain=None):
         self.__stream = None
         self._prev_in_chain = prev_in_chain # previous output provider
@@ -83,24 +177,38 @@ class OutputLinesProcessor(OutputProvider):
         return True
 
     def _consume(self, stream):
+        self.profile = profile = StepProfile(type(self).__name__)
+        start_step = getattr(stream, 'start_step', None)  # live process output stream
+        if start_step is not None:
+            start_step()
         counter = 0
         for line in stream:
+            t = time.time()
+            if profile.started is None:
+                profile.started = t
             counter += 1
             self.logger.debug("Output line %3d: %s", counter, line)
             last_one = self._process_line(line, counter)
+            profile.finished = t
+            profile.lines = counter
+            profile.bytes_out += len(line)
+            profile.parse_time += time.time() - t
             if last_one:
                 self.logger.debug("Was last line")
                 return
 
 
 class OutputBufferedProcessor(OutputLinesProcessor):
-    __buffer = ''
+    __lines = None
+    __buffer = None
 
     def _process_line(self, line, counter):
         """ processes line-by-line output
             return True if it's last line.
             If overridden, this base impl should be called """
-        self.__buffer += line
+        if self.__lines is None:
+            self.__lines = []
+        self.__lines.append(line)
         return self._is_last_one(line, counter)
 
     def _is_last_one(self, line, counter):
@@ -109,6 +217,9 @@ class OutputBufferedProcessor(OutputLinesProcessor):
 
     def get_buffer(self):
         self.get_output_stream()  # tigers processing
+        if self.__buffer is None:
+            self.__buffer = ''.join(self.__lines or [])
+            self.__lines = None
         self.logger.debug("Buffer of output obtained: " + self.__buffer)
         return self.__buffer
 
@@ -0,0 +1,198 @@
+# coding=utf-8
+"""Resources usage of runners: processes and processing steps (commands) profiles"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import errno
+import threading
+
+
+class StepProfile(object):
+    """
+    Profile of processing step (command), filled by output processor while consuming its part of output
+
+    Available as ``profile`` attribute of results objects, e.g. ``dp.PSf_result.profile``.
+    ``wall_time`` is measured from the end of previous step output, it reflects duration of the command
+    only if output was processed while process was running (:meth:`Runner.run`, not cache or asyncio).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None     #: time of the first line of step output
+        self.finished = None    #: time of the last line of step output
+        self.wall_time = None   #: seconds since previous step finished (or process start)
+        self.parse_time = 0.0   #: seconds spent in python processing output lines
+        self.lines = 0          #: number of output lines
+        self.bytes_out = 0      #: length of output
+
+    def __repr__(self):
+        return 'StepProfile({}: wall={}, parse={:.4f}, lines={})'.format(
+            self.name, _fmt(self.wall_time), self.parse_time, self.lines)
+
+
+class RunProfile(object):
+    """
+    Profile of runner process: single run of commands queue
+
+    Available as :attr:`Runner.profile`. CPU times and max RSS (kB on Linux) of the process are
+    obtained by ``wait4`` if it is available and process was run by :meth:`Runner.run` without
+    :attr:`Runner.preserve_process`, otherwise they are ``None``.
+    """
+
+    def __init__(self, runner):
+        self.runner = type(runner).__name__
+        self.executable = None
+        self.dir = None
+        self.started = None         #: time of process start
+        self.finished = None        #: time of output collected
+        self.wall_time = None       #: seconds from start to output collected
+        self.user_time = None       #: user CPU seconds of process
+        self.system_time = None     #: system CPU seconds of process
+        self.max_rss = None         #: maximum resident set size of process
+        self.returncode = None
+        self.bytes_in = 0           #: written to stdin
+        self.bytes_out = 0          #: read from stdout
+        self.prepare_time = 0.0     #: seconds spent on linking, removing files in runner directory
+        self.input_files = {}       #: runner directory name -> size (None if missing)
+        self.output_files = {}      #: runner directory name -> size (None if missing)
+        self.cached = False         #: results taken from :class:`ResultCache`
+        self.session = False        #: run in :attr:`Runner.preserve_process` mode
+        self._processors = []
+
+    @property
+    def steps(self):
+        """List of :class:`StepProfile` of commands in order of execution"""
+        steps = []
+        prev = self.started
+        for p in self._processors:
+            s = p.profile
+            if s is None:  # output not processed yet
+                continue
+            if s.finished is not None and prev is not None:
+                s.wall_time = s.finished - prev
+                prev = s.finished
+            steps.append(s)
+        return steps
+
+    @property
+    def parse_time(self):
+        """Seconds spent in python processing output lines by all steps"""
+        return sum(s.parse_time for s in self.steps)
+
+    def set_rusage(self, rusage):
+        self.user_time = rusage.ru_utime
+        self.system_time = rusage.ru_stime
+        self.max_rss = rusage.ru_maxrss
+
+    def __repr__(self):
+        return 'RunProfile({} {}: wall={}, user={}, sys={}, max_rss={}, in={}, out={}, steps={})'.format(
+            self.runner, self.executable, _fmt(self.wall_time), _fmt(self.user_time), _fmt(self.system_time),
+            self.max_rss, self.bytes_in, self.bytes_out, len(self._processors))
+
+
+class ProfileReport(object):
+    """
+    Collects profiles of finished runs of all runners, which :attr:`Runner.profile_report` is set to it
+
+        >>> report = ProfileReport()
+        >>> Runner.profile_report = report  # all runners, including clones
+        >>> reduce_night()
+        >>> print(report.summary())
+    """
+
+    def __init__(self):
+        self.runs = []
+        self.__lock = threading.Lock()
+
+    def add(self, profile):
+        """Adds :class:`RunProfile`, called by runners"""
+        with self.__lock:
+            self.runs.append(profile)
+
+    def clear(self):
+        with self.__lock:
+            self.runs = []
+
+    def runs_table(self):
+        """:class:`pandas.DataFrame` with row for every run"""
+        import pandas as pd
+        rows = [{'runner': r.runner, 'executable': r.executable, 'dir': r.dir, 'wall_time': r.wall_time,
+                 'user_time': r.user_time, 'system_time': r.system_time, 'max_rss': r.max_rss,
+                 'prepare_time': r.prepare_time, 'parse_time': r.parse_time,
+                 'bytes_in': r.bytes_in, 'bytes_out': r.bytes_out,
+                 'input_files_size': sum(s for s in r.input_files.values() if s),
+                 'output_files_size': sum(s for s in r.output_files.values() if s),
+                 'cached': r.cached, 'session': r.session, 'returncode': r.returncode}
+                for r in self.runs]
+        return pd.DataFrame(rows, columns=['runner', 'executable', 'dir', 'wall_time', 'user_time', 'system_time',
+                                           'max_rss', 'prepare_time', 'parse_time', 'bytes_in', 'bytes_out',
+                                           'input_files_size', 'output_files_size', 'cached', 'session',
+                                           'returncode'])
+
+    def steps_table(self):
+        """:class:`pandas.DataFrame` with row for every processing step (command) of every run"""
+        import pandas as pd
+        rows = [{'run': n, 'runner': r.runner, 'step': s.name, 'wall_time': s.wall_time,
+                 'parse_time': s.parse_time, 'lines': s.lines, 'bytes_out': s.bytes_out}
+                for n, r in enumerate(self.runs) for s in r.steps]
+        return pd.DataFrame(rows, columns=['run', 'runner', 'step', 'wall_time', 'parse_time', 'lines', 'bytes_out'])
+
+    def summary(self):
+        """
+        Totals per step (command) and per runner: count and sums of times and bytes
+
+        Rows for runners (``step`` = ``'(process)'``) contain wall and CPU times of whole processes,
+        preparing files time, and parsing time.
+
+        :rtype: pandas.DataFrame
+        """
+        import pandas as pd
+        runs = self.runs_table()
+        runs['step'] = '(process)'
+        runs['count'] = 1
+        runs['cpu_time'] = runs.user_time + runs.system_time
+        runs = runs.groupby(['runner', 'step']).agg(
+            {'count': 'sum', 'wall_time': 'sum', 'cpu_time': 'sum', 'max_rss': 'max', 'prepare_time': 'sum',
+             'parse_time': 'sum', 'bytes_in': 'sum', 'bytes_out': 'sum'})
+        steps = self.steps_table()
+        steps['count'] = 1
+        steps = steps.groupby(['runner', 'step']).agg(
+            {'count': 'sum', 'wall_time': 'sum', 'parse_time': 'sum', 'bytes_out': 'sum'})
+        return pd.concat([runs, steps], sort=False).sort_index()
+
+    def __str__(self):
+        return str(self.summary())
+
+
+def file_size(path):
+    """Size of file (symlinks followed), None if not exists"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def wait_process(process):
+    """Waits for process (:class:`subprocess.Popen`) by ``wait4``, sets its returncode, returns rusage or None"""
+    if not hasattr(os, 'wait4') or process.returncode is not None:
+        process.wait()
+        return None
+    while True:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno == errno.EINTR:  # python < 3.5
+                continue
+            process.wait()  # reaped meanwhile
+            return None
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def _fmt(seconds):
+    return 'None' if seconds is None else '{:.3f}'.format(seconds)
@@ -0,0 +1,36 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import threading
+import pytest
+from astwro.exttools import Runner, RunnerPool
+
+
+def write_thread_file(runner, n):
+    with open(runner.file_from_runner_dir('thread.txt'), 'w') as f:
+        f.write(str(threading.current_thread().ident))
+    return runner.dir.path, n
+
+
+def test_pool_workers_dirs():
+    with RunnerPool(Runner(), size=3) as pool:
+        results = list(pool.map(write_thread_file, range(10)))
+    assert [n for _, n in results] == list(range(10))
+    assert len(set(d for d, _ in results)) == 3
+
+
+def test_pool_recycles_failed_worker():
+    failed_dirs = []
+
+    def fail(runner):
+        failed_dirs.append(runner.dir.path)
+        raise ValueError('worker failure')
+
+    with RunnerPool(Runner(), size=1) as pool:
+        with pytest.raises(ValueError):
+            pool.submit(fail).result()
+        path, _ = pool.submit(write_thread_file, 0).result()
+    assert path != failed_dirs[0]
+    assert not os.path.exists(failed_dirs[0])
@@ -9,6 +9,9 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 #from functools import partial
+import os
+import warnings
+import multiprocessing
 import numpy as np
 from astropy.stats import SigmaClip
 from cached_property import cached_property
@@ -34,13 +37,20 @@ class DiffPhot(object):
         counted from the end. `None` is equivalent of `0`. There are two special
         string values `"min"` and `"max"` which chooses brightest ans faintest frame respectively. Value of chosen
         frame is available by `ref` property.
+    engine: str
+        `"nan"` (default) computes on float arrays with NaN for missing values, converted to masked arrays
+        on output, `"ma"` computes on masked arrays (slower, equal results)
        """
-    def __init__(self, data, err, comp_stars_mask=None, lazy=True, ref_obs=None):
+    def __init__(self, data, err, comp_stars_mask=None, lazy=True, ref_obs=None, engine='nan'):
         super(DiffPhot, self).__init__()
+        _check_engine(engine)
         self._data = data
         self._err = err
         self._mask_stars_comp = comp_stars_mask
         self._ref_obs = ref_obs
+        self._engine = engine
+        self._updates = 0
+        self._columns = {}
         if not lazy: # force evaluate solution
             _ = self.solution
 
@@ -88,9 +98,15 @@ class DiffPhot(object):
     @cached_property
     def obs_deltas_stddev(self):
         """std dev of observations deltas from residuals, weighted by err^-2"""
-        r2w = self.lc_residuals**2 * self.weights
-        sig2o = r2w.sum(axis=0) / self.weights.sum(axis=0) * r2w.count(axis=0) / (r2w.count(axis=0) - 1.0)
-        return np.ma.sqrt(sig2o)
+        if self._engine == 'ma':
+            r2w = self.lc_residuals**2 * self.weights
+            sig2o = r2w.sum(axis=0) / self.weights.sum(axis=0) * r2w.count(axis=0) / (r2w.count(axis=0) - 1.0)
+            return np.ma.sqrt(sig2o)
+        W = _nan_weights(self.err)
+        r2w = (_nan_filled(self.lc) - _nan_filled(self.mag)[:, np.newaxis]) ** 2 * W
+        count = (~np.isnan(r2w)).sum(axis=0)
+        sig2o = _nan_divide(_nan_divide(_nan_sum(r2w, axis=0), _nan_sum(W, axis=0)) * count, count - 1.0)
+        return _masked(_nan_sqrt(sig2o))
 
     @cached_property
     def mag(self):
@@ -151,30 +167,18 @@ class DiffPhot(object):
 
     @cached_property
     def solution(self):
+        if self._engine == 'nan':
+            return self._solution_nan()
         data = self.data[:, ~self.mask_obs_compempty]
         data_e = self.err[:, ~self.mask_obs_compempty]
         weights = self.weights[:, ~self.mask_obs_compempty]
         comp_stars_mask = self.mask_stars_comp & ~self.mask_stars_empty
         # construct equations from comparision stars
-        K = data.shape[1]  # number of (nonempty) obs
         D = data[comp_stars_mask]
         W = weights[comp_stars_mask]
         W.unshare_mask()
         W[W.mask] = 0.0  # no more mask for bad values, just zero-weights
-        A00 = np.diag(W.sum(axis=0)[1:])
-        A11 = np.diag(W.sum(axis=1))
-        A10 = W[:, 1:]
-        A01 = A10.T
-        A = np.block([[A00, A01], [A10, A11]])
-        assert not (A00.diagonal() == 0.0).any(), "Bad obs: {}".format(np.argwhere(A00.diagonal() == 0.0))
-        assert not (A11.diagonal() == 0.0).any(), "Bad star: {}".format(np.argwhere(A11.diagonal() == 0.0))
-        WD = W * D.filled(0)
-        B1 = WD.sum(axis=0, keepdims=True).T[1:]
-        B2 = WD.sum(axis=1, keepdims=True)
-        B = np.block([[B1], [B2]])
-        X = np.vstack([np.zeros((1, 1)), np.linalg.solve(A, B)])  # obs[0] set to 0, excluded from equations
-        O = X.squeeze()[:K]
-        C = X.squeeze()[K:]
+        O, C = _solve_normal_equations(W, W * D.filled(0))
         # light curves calculation
         lc = data - O
 
@@ -196,18 +200,8 @@ class DiffPhot(object):
             lc = nlc
 
         # reference frame is 0, shift to another one if requested:
-        ref_idx = 0
+        ref_idx = self._ref_index(O)
         if self._ref_obs:
-            if isinstance(self._ref_obs, str):
-                if self._ref_obs == 'min':
-                    ref_idx = O.argmin()
-                elif self._ref_obs == 'max':
-                    ref_idx = O.argmax()
-                else:
-                    raise ValueError('Allowed sting values for ref_frame are "min" nad "max". Recived "{}"'
-                                     .format(self._ref_obs))
-            else:
-                ref_idx = self._ref_obs if self._ref_obs >= 0 else len(O) + self._ref_obs
             delta = O[ref_idx]
             S  += delta
             lc += delta
@@ -215,12 +209,333 @@ class DiffPhot(object):
 
         return S, lc, O, ref_idx
 
+    def _solution_nan(self):
+        # as solution, on float arrays with NaN for missing values and zero weights
+        compempty = self.mask_obs_compempty
+        data = _nan_filled(self.data)[:, ~compempty]
+        weights = _nan_weights(self.err)[:, ~compempty]
+        comp_stars_mask = self.mask_stars_comp & ~self.mask_stars_empty
+        D = data[comp_stars_mask]
+        W = weights[comp_stars_mask]
+        W[np.isnan(W)] = 0.0
+        O, C = _solve_normal_equations(W, W * np.where(np.isnan(D), 0.0, D))
+        lc = data - O
+
+        S = np.full(self.N, np.nan)
+        S[comp_stars_mask] = C
+        nC_mask = ~self.mask_stars_comp & ~self.mask_stars_empty
+        WnC = weights[nC_mask]
+        S[nC_mask] = _nan_divide(_nan_sum(lc[nC_mask] * WnC, axis=1), _nan_sum(WnC, axis=1))
+
+        if compempty.any():
+            nO = np.full(self.M, np.nan)
+            nO[~compempty] = O
+            O = nO
+            nlc = np.full((self.N, self.M), np.nan)
+            nlc[:, ~compempty] = lc
+            lc = nlc
+
+        ref_idx = self._ref_index(_masked(O))
+        if self._ref_obs:
+            delta = O[ref_idx]
+            S  += delta
+            lc += delta
+            O  -= delta
+
+        return _masked(S), _masked(lc), _masked(O), ref_idx
+
+    def _ref_index(self, O):
+        # index of reference observation in masked array of corrections
+        if not self._ref_obs:
+            return 0
+        if isinstance(self._ref_obs, str):
+            if self._ref_obs == 'min':
+                return O.argmin()
+            elif self._ref_obs == 'max':
+                return O.argmax()
+            else:
+                raise ValueError('Allowed sting values for ref_frame are "min" nad "max". Recived "{}"'
+                                 .format(self._ref_obs))
+        return self._ref_obs if self._ref_obs >= 0 else len(O) + self._ref_obs
+
+    @cached_property
+    def _normal_stats(self):
+        """Per star sums over observations with comparision stars: sum(w), sum(w*data), sum(w*obs_delta)"""
+        lc = self.solution[1]
+        W = _nan_weights(self.err)
+        W[np.isnan(W) | np.ma.getmaskarray(lc)] = 0.0
+        return W.sum(axis=1), (W * self.data.filled(0.0)).sum(axis=1), W.dot(np.ma.filled(self.solution[2], 0.0))
+
+    resolve_every = 10
+    """Number of incremental :meth:`add_observations` updates between full solutions"""
+
+    def add_observations(self, data, err, resolve=None):
+        """
+        Appends new observations of the same stars, e.g. frames of next night
+
+        If solution is already calculated, it is updated incrementally: corrections of new observations are
+        solved against current stars magnitudes, then stars magnitudes are updated from accumulated sums;
+        corrections of previous observations are not changed. Cost is proportional to size of new data:
+        data, errors, light curves and corrections grow in buffers of doubled capacity, so appending is not
+        a copy of whole arrays (except the first update after full solution, which buffers its light curves).
+        Every `resolve_every` updates (or if `resolve` is True) solution is recalculated from all data instead,
+        bounding the drift of incremental updates. Reference observation chosen by string or negative
+        `ref_obs` is kept by index.
+
+        :param data: NxK array or MaskedArray of magnitudes of N stars in K new observations
+        :param err: NxK array or MaskedArray of `data`'s standard deviations
+        :param bool resolve: True forces full solution, False incremental update, default: every `resolve_every`
+        """
+        data = np.ma.asanyarray(data)
+        err = np.ma.asanyarray(err)
+        if data.shape[0] != self.N or err.shape != data.shape:
+            raise ValueError('Expected {}xK data and err arrays, got {} and {}'.format(self.N, data.shape, err.shape))
+        solved = 'solution' in self.__dict__
+        if solved:
+            if isinstance(self._ref_obs, str):
+                self._ref_obs = self.solution[3]
+            elif self._ref_obs is not None and self._ref_obs < 0:
+                self._ref_obs += self.M
+        if resolve is None:
+            resolve = self._updates + 1 >= self.resolve_every
+        if not solved or resolve:
+            self._updates = 0
+            self._append(data, err)
+            return
+        S, lc, O, ref_idx = self.solution
+        b, B2, WO = self._normal_stats
+
+        # corrections of new observations for fixed comparision stars magnitudes
+        W = np.ma.filled(err ** -2, 0.0) * ~np.ma.getmaskarray(data)
+        D = data.filled(0.0)
+        comp = self.mask_stars_comp & ~np.ma.getmaskarray(S)
+        Wc = W[comp]
+        a = Wc.sum(axis=0)
+        nO = np.ma.masked_array((Wc * (D[comp] - S.filled(0.0)[comp, np.newaxis])).sum(axis=0), mask=a == 0.0)
+        nO /= np.where(a == 0.0, 1.0, a)
+        W[:, a == 0.0] = 0.0  # observations without comparision stars
+
+        # stars magnitudes from accumulated sums
+        b = b + W.sum(axis=1)
+        B2 = B2 + (W * D).sum(axis=1)
+        WO = WO + W.dot(nO.filled(0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nS = np.ma.masked_invalid((B2 - WO) / b)
+        nlc = self._extend('lc', lc, data - nO)
+        nO = self._extend('obs_deltas', O, nO)
+
+        self._append(data, err)
+        self._updates += 1
+        self.__dict__['solution'] = nS, nlc, nO, ref_idx
+        self.__dict__['_normal_stats'] = b, B2, WO
+
+    def _append(self, data, err):
+        self._data = self._extend('data', self.data, data)
+        self._err = self._extend('err', self.err, err)
+        for name in ['data', 'err', 'weights', 'lc', 'lc_residuals', 'lc_e', 'obs_deltas', 'obs_deltas_stddev',
+                     'mag', 'mag_v2', 'mag_e', 'mask_stars_empty', 'mask_obs_empty', 'mask_obs_compempty', 'ref',
+                     'solution', '_normal_stats']:
+            self.__dict__.pop(name, None)
+
+    def _extend(self, name, current, new):
+        # current array with new columns, current one is copied into buffer if it is not the last one returned
+        columns = self._columns.get(name)
+        if columns is None or columns.array is not current:
+            columns = self._columns[name] = _Columns(current)
+        return columns.append(new)
+
     @property
     def _notimplemented(self):
         raise NotImplementedError('Not implemented yet')
 
 
-def dphot(data, stddevs, comp_stars_mask=None):
+class ChunkedDiffPhot(object):
+    """Differential photometry as :class:`DiffPhot`, for data not fitting in memory
+
+    Magnitudes and errors are read in blocks of stars (rows) from array-like stores, e.g. ``np.memmap``,
+    ``.npy`` file opened with ``mmap_mode`` or HDF5 dataset. Normal equations are accumulated block by block
+    with star unknowns eliminated (Schur complement), so only MxM matrix of observations is kept in memory.
+    Light curves are written into ``lc`` and ``lc_e`` stores block by block.
+
+    Missing values are masked or NaN in input stores and NaN in output stores. Vectors (`mag`, `obs_deltas`
+    etc.) are masked arrays as in :class:`DiffPhot`.
+
+    Parameters
+    ----------
+    data : array-like or str
+        NxM array of N stars magnitudes in M observations, supporting row slicing, or `.npy` filename
+        (memory-mapped)
+    err: array-like or str
+        NxM array (or `.npy` filename) of `data`'s standard deviations. Used for weighting.
+    comp_stars_mask: array of bool, (optional)
+        comparision stars, default: all
+    ref_obs: None or str or int:
+        Reference observation, see :class:`DiffPhot`
+    lc, lc_e: None or str or array-like
+        Output stores for NxM light curves and their errors: `.npy` filename (created, memory-mapped),
+        writable array-like, or None for in-memory arrays
+    chunk_size: int
+        Number of stars in block, default: blocks of about 2**22 values
+    """
+    def __init__(self, data, err, comp_stars_mask=None, ref_obs=None, lc=None, lc_e=None, chunk_size=None):
+        super(ChunkedDiffPhot, self).__init__()
+        self._data = _open_store(data)
+        self._err = _open_store(err)
+        self._mask_stars_comp = comp_stars_mask
+        self._ref_obs = ref_obs
+        self._lc = lc
+        self._lc_e = lc_e
+        self.chunk_size = chunk_size or max(1, 2**22 // max(self.M, 1))
+
+    @property
+    def N(self):
+        """Number of stars"""
+        return self._data.shape[0]
+
+    @property
+    def M(self):
+        """Number of observations"""
+        return self._data.shape[1]
+
+    @cached_property
+    def mask_stars_comp(self):
+        if self._mask_stars_comp is None:
+            return np.ones(self.N, dtype=bool)
+        else:
+            return np.asanyarray(self._mask_stars_comp, dtype=bool)
+
+    @cached_property
+    def lc(self):
+        """NxM light curves store"""
+        return self.solution[1]
+
+    @cached_property
+    def lc_e(self):
+        """NxM store of sqrt( err^2 + obs_deltas^2 ), computed on first access"""
+        sig2o = self.obs_deltas_stddev.filled(np.nan) ** 2
+        store = _create_store(self._lc_e, (self.N, self.M), self._dtype)
+        for i0, i1, _, e in self._blocks(data=False):
+            store[i0:i1] = np.sqrt(e ** 2 + sig2o)
+        _flush_store(store)
+        return store
+
+    @cached_property
+    def obs_deltas(self):
+        return self.solution[2]
+
+    @cached_property
+    def obs_deltas_stddev(self):
+        """std dev of observations deltas from residuals, weighted by err^-2"""
+        return self.solution[4]
+
+    @cached_property
+    def mag(self):
+        return self.solution[0]
+
+    @cached_property
+    def mag_e(self):
+        return self.solution[5]
+
+    @cached_property
+    def ref(self):
+        return self.solution[3]
+
+    @property
+    def _dtype(self):
+        return np.result_type(self._data.dtype, np.float32)
+
+    def _blocks(self, data=True):
+        # (i0, i1, data, err) blocks of stars, NaN for missing values
+        for i0 in range(0, self.N, self.chunk_size):
+            i1 = min(i0 + self.chunk_size, self.N)
+            d = _read_block(self._data, i0, i1) if data else None
+            e = _read_block(self._err, i0, i1)
+            if data:
+                e[np.isnan(d)] = np.nan
+                d[np.isnan(e)] = np.nan
+            yield i0, i1, d, e
+
+    @staticmethod
+    def _weights(e):
+        with np.errstate(divide='ignore'):
+            w = e ** -2
+        w[~np.isfinite(w)] = 0.0
+        return w
+
+    def _normal_equations(self):
+        # pass 1: sums of normal equations with stars eliminated, for all M observations
+        a = np.zeros(self.M)
+        G = np.zeros((self.M, self.M))
+        r = np.zeros(self.M)
+        comp = self.mask_stars_comp
+        for i0, i1, d, e in self._blocks():
+            c = comp[i0:i1]
+            if not c.any():
+                continue
+            W = self._weights(e[c])
+            WD = W * np.where(W > 0, d[c], 0.0)
+            b = W.sum(axis=1)
+            W, WD, b = W[b > 0], WD[b > 0], b[b > 0]
+            Wb = W / b[:, np.newaxis]
+            a += W.sum(axis=0)
+            G += Wb.T.dot(W)
+            r += WD.sum(axis=0) - Wb.T.dot(WD.sum(axis=1))
+        return a, G, r
+
+    @cached_property
+    def solution(self):
+        a, G, r = self._normal_equations()
+        obs = np.flatnonzero(a > 0)  # observations with comparison stars
+        if obs.size == 0:
+            raise ValueError('No observations with comparison stars')
+        unknown = obs[1:]  # first one is 0.0 by definition
+        O = np.full(self.M, np.nan)
+        O[obs[0]] = 0.0
+        O[unknown] = np.linalg.solve(np.diag(a[unknown]) - G[np.ix_(unknown, unknown)], r[unknown])
+
+        # reference frame shift
+        ref_idx = obs[0]
+        if self._ref_obs:
+            if isinstance(self._ref_obs, str):
+                if self._ref_obs == 'min':
+                    ref_idx = np.nanargmin(O)
+                elif self._ref_obs == 'max':
+                    ref_idx = np.nanargmax(O)
+                else:
+                    raise ValueError('Allowed sting values for ref_frame are "min" nad "max". Recived "{}"'
+                                     .format(self._ref_obs))
+            else:
+                ref_idx = self._ref_obs if self._ref_obs >= 0 else self.M + self._ref_obs
+            O -= O[ref_idx]
+
+        # pass 2: light curves and stars magnitudes
+        lc = _create_store(self._lc, (self.N, self.M), self._dtype)
+        S = np.full(self.N, np.nan)
+        Se = np.full(self.N, np.nan)
+        r2w = np.zeros(self.M)
+        sw = np.zeros(self.M)
+        count = np.zeros(self.M)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i0, i1, d, e in self._blocks():
+                W = self._weights(e)
+                l = d - O
+                lc[i0:i1] = l
+                Wl = np.where(np.isnan(l), 0.0, W)
+                S[i0:i1] = (Wl * np.where(Wl > 0, l, 0.0)).sum(axis=1) / Wl.sum(axis=1)
+                Se[i0:i1] = W.sum(axis=1) ** -0.5
+                resid = l - S[i0:i1, np.newaxis]
+                valid = ~np.isnan(resid)
+                r2w += (np.where(valid, resid, 0.0) ** 2 * W).sum(axis=0)
+                sw += W.sum(axis=0)
+                count += valid.sum(axis=0)
+            sig2o = r2w / sw * count / (count - 1.0)
+        _flush_store(lc)
+        O = np.ma.masked_invalid(O)
+        return (np.ma.masked_invalid(S), lc, O, ref_idx,
+                np.ma.masked_array(np.sqrt(sig2o), mask=O.mask | ~np.isfinite(sig2o)), np.ma.masked_invalid(Se))
+
+
+def dphot(data, stddevs, comp_stars_mask=None, engine='nan'):
     """
     Calculates differential photometry as in Honeycutt 1992PASP..104..435H.
 
@@ -233,6 +548,7 @@ def dphot(data, stddevs, comp_stars_mask=None):
     :type  stddevs: np.ndarray or np.ma.MaskedArray
     :param comp_stars_mask: stars which variance will be minimized, default: all
     :type  comp_stars_mask: None or array-like(bool)
+    :param str engine:      `"nan"` computes on float arrays with NaN for missing values, `"ma"` on masked arrays
     :returns:       tuple(S, L, O, sigS, sigL, sigO)
                         N-element array of stars diff photometry
                         NxK-element array of light curves
@@ -282,6 +598,15 @@ def dphot(data, stddevs, comp_stars_mask=None):
        fill_value = 1e+20)
     """
 
+    _check_engine(engine)
+    inputs = _dphot_inputs(data, stddevs, comp_stars_mask)
+    if engine == 'ma':
+        return _dphot_ma(*inputs)
+    return tuple(_masked(a) for a in _dphot_nan(*inputs))
+
+
+def _dphot_inputs(data, stddevs, comp_stars_mask):
+    # masked data and stddevs of nonempty observations, comparision stars mask, empty stars and observations
     if comp_stars_mask is None:  # all stars equal
         comp_stars_mask = np.ones(data.shape[0], dtype=bool)
     else:
@@ -301,27 +626,17 @@ def dphot(data, stddevs, comp_stars_mask=None):
             data = data[:, ~empty_obs]
             stddevs = stddevs[:, ~empty_obs]
             comp_stars_mask &= ~empty_str
+    return data, stddevs, comp_stars_mask, empty_str, empty_obs
+
+
+def _dphot_ma(data, stddevs, comp_stars_mask, empty_str, empty_obs):
     # construct equations from comparision stars
-    K = data.shape[1]  # number of (nonempty) obs
     D = data[comp_stars_mask]
     Wall = stddevs ** -2
     W = Wall[comp_stars_mask]
     W.unshare_mask()
     W[W.mask] = 0.0  # no more mask for bad values, just zero-weights
-    A00 = np.diag(W.sum(axis=0)[1:])
-    A11 = np.diag(W.sum(axis=1))
-    A10 = W[:, 1:]
-    A01 = A10.T
-    A = np.block([[A00, A01], [A10, A11]])
-    assert not (A00.diagonal() == 0.0).any(), "Bad obs: {}".format(np.argwhere(A00.diagonal() == 0.0))
-    assert not (A11.diagonal() == 0.0).any(), "Bad star: {}".format(np.argwhere(A11.diagonal() == 0.0))
-    WD = W * D.filled(0)
-    B1 = WD.sum(axis=0, keepdims=True).T[1:]
-    B2 = WD.sum(axis=1, keepdims=True)
-    B = np.block([[B1], [B2]])
-    X = np.vstack([np.zeros((1, 1)), np.linalg.solve(A, B)])  # obs[0] set to 0, excluded from equations
-    O = X.squeeze()[:K]
-    C = X.squeeze()[K:]
+    O, C = _solve_normal_equations(W, W * D.filled(0))
     # light curves calculation
     lc = data - O
 
@@ -361,7 +676,101 @@ def dphot(data, stddevs, comp_stars_mask=None):
     return S, lc, O, np.ma.sqrt(sig2s), np.ma.sqrt(sig2lc), np.ma.sqrt(sig2o)
 
 
-def dphot_filters(data, stddevs, filters_masks, comp_stars_mask=None):
+def _dphot_nan(data, stddevs, comp_stars_mask, empty_str, empty_obs):
+    # as _dphot_ma, on float arrays with NaN for missing values and zero weights, returns arrays with NaNs
+    D = _nan_filled(data)
+    E = _nan_filled(stddevs)
+    Wall = _nan_weights(E)
+    W = Wall[comp_stars_mask]
+    W[np.isnan(W)] = 0.0
+    Dc = D[comp_stars_mask]
+    O, C = _solve_normal_equations(W, W * np.where(np.isnan(Dc), 0.0, Dc))
+    lc = D - O
+
+    S = np.full(empty_str.size, np.nan)
+    S[comp_stars_mask] = C
+    nC_mask = ~comp_stars_mask & ~empty_str
+    WnC = Wall[nC_mask]
+    S[nC_mask] = _nan_divide(_nan_sum(lc[nC_mask] * WnC, axis=1), _nan_sum(WnC, axis=1))
+
+    resid = lc - S.reshape(S.size, 1)
+    r2w = resid ** 2 * Wall
+    sig2o = _nan_divide(_nan_sum(r2w[comp_stars_mask], axis=0), W.sum(axis=0)) * C.size / (C.size - 1.0)
+    sig2s = _nan_divide(_nan_sum(r2w, axis=1), _nan_sum(Wall, axis=1)) * O.size / (O.size - 1.0)
+    sig2mean = _nan_divide(sig2o, np.ma.getmaskarray(data).sum(axis=0))
+    sig2lc = E ** 2 + sig2mean
+
+    nO = np.full(empty_obs.size, np.nan)
+    nO[~empty_obs] = O
+    nsig2o = np.full(empty_obs.size, np.nan)
+    nsig2o[~empty_obs] = sig2o
+    nlc = np.full((empty_str.size, empty_obs.size), np.nan)
+    nlc[:, ~empty_obs] = lc
+    # sigL is not expanded to empty observations, as in _dphot_ma
+    return S, nlc, nO, _nan_sqrt(sig2s), _nan_sqrt(sig2lc), _nan_sqrt(nsig2o)
+
+
+def _solve_normal_equations(W, WD):
+    """
+    Solves Honeycutt normal equations for observations corrections O (with O[0] = 0) and comparison stars
+    magnitudes C
+
+    Diagonal blocks of equations matrix (sums of weights of observations and of stars) are diagonal, so
+    the system is reduced to the Schur complement of the larger one, and only dense matrix of size
+    min(N, K-1) is factorized.
+    :param W:  NxK weights of comparison stars, zero for missing data
+    :param WD: NxK weights multiplied by magnitudes, zero for missing data
+    :return: (O, C) K and N element arrays
+    """
+    W = np.ma.filled(W, 0.0)
+    WD = np.ma.filled(WD, 0.0)
+    W1 = W[:, 1:]  # obs[0] set to 0, excluded from equations
+    a = W1.sum(axis=0)
+    b = W.sum(axis=1)
+    assert not (a == 0.0).any(), "Bad obs: {}".format(np.argwhere(a == 0.0))
+    assert not (b == 0.0).any(), "Bad star: {}".format(np.argwhere(b == 0.0))
+    B1 = WD[:, 1:].sum(axis=0)
+    B2 = WD.sum(axis=1)
+    if W1.shape[1] <= W1.shape[0]:  # less observations than stars, eliminate stars
+        Wb = W1 / b[:, np.newaxis]
+        O = np.linalg.solve(np.diag(a) - W1.T.dot(Wb), B1 - Wb.T.dot(B2))
+        C = (B2 - W1.dot(O)) / b
+    else:  # eliminate observations
+        Wa = W1 / a
+        C = np.linalg.solve(np.diag(b) - Wa.dot(W1.T), B2 - Wa.dot(B1))
+        O = (B1 - W1.T.dot(C)) / a
+    return np.concatenate([[0.0], O]), C
+
+
+def _open_store(store):
+    if isinstance(store, str):
+        return np.load(os.path.expanduser(store), mmap_mode='r')
+    return store
+
+
+def _create_store(store, shape, dtype):
+    if store is None:
+        return np.full(shape, np.nan, dtype=dtype)
+    if isinstance(store, str):
+        return np.lib.format.open_memmap(os.path.expanduser(store), mode='w+', dtype=dtype, shape=shape)
+    if tuple(store.shape) != shape:
+        raise ValueError('Output store shape {} differs from data shape {}'.format(store.shape, shape))
+    return store
+
+
+def _flush_store(store):
+    if isinstance(store, np.memmap):
+        store.flush()
+
+
+def _read_block(store, i0, i1):
+    block = store[i0:i1]
+    if isinstance(block, np.ma.MaskedArray):
+        return block.astype(float).filled(np.nan)
+    return np.array(block, dtype=float)
+
+
+def dphot_filters(data, stddevs, filters_masks, comp_stars_mask=None, engine='nan', parallel=1):
     """ Calculates differential photometry as in Honeycutt 1992PASP..104..435H, for sets of observations
      The ``filters_masks`` parameter should be a list of boolean masks choosing subsets of K observations
      e.g. for different filters. Differential photometry will be calculated for each set independently by
@@ -378,6 +787,9 @@ def dphot_filters(data, stddevs, filters_masks, comp_stars_mask=None):
                                 which indicates common set for all filters, or 2D FxN array-like with masks
                                 for each filter.
     :type  comp_stars_mask: None or array-like(bool) or list(array-like(bool)
+    :param str engine:      `"nan"` computes on float arrays with NaN for missing values, `"ma"` on masked arrays
+    :param int parallel:    number of processes solving filters simultaneously, with input and output arrays in
+                                shared memory (python 3.8+), None for number of CPUs, default: 1, serial
     :returns:               tuple(S, L, O, sigS, sigL, sigO):
                                 list of N-element arrays of stars diff photometry in filters,
                                 NxK-element array of light curves
@@ -389,6 +801,7 @@ def dphot_filters(data, stddevs, filters_masks, comp_stars_mask=None):
                              list(np.ma.MaskedArray), np.ma.MaskedArray, np.ma.MaskedArray)
 
     """
+    _check_engine(engine)
     filters_masks = np.array(filters_masks, dtype=bool)
     if comp_stars_mask is not None:
         comp_stars_mask = np.array(comp_stars_mask, dtype=bool)
@@ -396,26 +809,152 @@ def dphot_filters(data, stddevs, filters_masks, comp_stars_mask=None):
         cmasks = comp_stars_mask
     else:
         cmasks = [comp_stars_mask] * filters_masks.shape[0]
+    if parallel is None:
+        parallel = multiprocessing.cpu_count()
+    if parallel > 1 and filters_masks.shape[0] > 1:
+        return _dphot_filters_parallel(data, stddevs, filters_masks, cmasks, engine, parallel)
 
-    O = np.ma.masked_all(data.shape[1])
-    sigO = np.ma.masked_all(data.shape[1])
+    if engine == 'ma':
+        empty, solve = np.ma.masked_all, _dphot_ma
+    else:
+        empty, solve = lambda shape: np.full(shape, np.nan), _dphot_nan
+    O = empty(data.shape[1])
+    sigO = empty(data.shape[1])
     S = []
     sigS = []
-    L = np.ma.masked_all(data.shape)
-    sigL = np.ma.masked_all(data.shape)
+    L = empty(data.shape)
+    sigL = empty(data.shape)
 
     for i, mask in enumerate(filters_masks):
-        vS, lc, vO, sS, slc, sO = dphot(data[:, mask], stddevs[:, mask], cmasks[i])
+        vS, lc, vO, sS, slc, sO = solve(*_dphot_inputs(data[:, mask], stddevs[:, mask], cmasks[i]))
         O[mask] = vO
         sigO[mask] = sO
         S.append(vS)
         sigS.append(sS)
         L[:, mask] = lc
         sigL[:, mask] = slc
-    return np.ma.array(S), L, O, np.ma.array(sigS), sigL, sigO
+    if engine == 'ma':
+        return np.ma.array(S), L, O, np.ma.array(sigS), sigL, sigO
+    return _masked(np.array(S)), _masked(L), _masked(O), _masked(np.array(sigS)), _masked(sigL), _masked(sigO)
+
+
+def _dphot_filters_parallel(data, stddevs, filters_masks, cmasks, engine, parallel):
+    # dphot_filters on process pool, inputs shared once, workers write own columns of shared outputs
+    from concurrent.futures import ProcessPoolExecutor
+    N, K = data.shape
+    F = filters_masks.shape[0]
+    shared = []
+    try:
+        inputs = []
+        for a in [data, stddevs]:
+            values = _SharedArray.copy(np.ma.getdata(a))
+            shared.append(values)
+            mask = None
+            if isinstance(a, np.ma.MaskedArray):
+                mask = _SharedArray.copy(np.ma.getmaskarray(a))
+                shared.append(mask)
+            inputs.append((values, mask))
+        outputs = [_SharedArray.full(shape) for shape in [(F, N), (N, K), (K,), (F, N), (N, K), (K,)]]
+        shared.extend(outputs)
+        with ProcessPoolExecutor(max_workers=min(parallel, F)) as executor:
+            futures = [executor.submit(_dphot_filter_worker, inputs, outputs, i, mask, cmasks[i], engine)
+                       for i, mask in enumerate(filters_masks)]
+            for f in futures:
+                f.result()
+        return tuple(_masked(o.array.copy()) for o in outputs)
+    finally:
+        for a in shared:
+            a.unlink()
+
+
+def _dphot_filter_worker(inputs, outputs, i, mask, comp_stars_mask, engine):
+    try:
+        args = []
+        for values, vmask in inputs:
+            a = values.array[:, mask]  # copy
+            if vmask is not None:
+                a = np.ma.masked_array(a, mask=vmask.array[:, mask])
+            args.append(a)
+        solve = _dphot_ma if engine == 'ma' else _dphot_nan
+        results = solve(*_dphot_inputs(args[0], args[1], comp_stars_mask))
+        for o, index, r in zip(outputs, [i, (slice(None), mask), mask] * 2, results):
+            o.array[index] = np.ma.filled(r, np.nan)
+    finally:
+        for a in [a for pair in inputs for a in pair if a is not None] + outputs:
+            a.close()
+
+
+class _Columns(object):
+    """Masked array growing along last axis, in buffer reallocated with doubled capacity when full"""
+
+    def __init__(self, array):
+        array = np.ma.asanyarray(array)
+        self._buffer = np.ma.masked_all(array.shape[:-1] + (max(2 * array.shape[-1], 1),), dtype=array.dtype)
+        self._size = 0
+        self.array = None
+        self.append(array)
+
+    def append(self, columns):
+        """Appends columns, returns view of all columns in buffer"""
+        columns = np.ma.asanyarray(columns)
+        size = self._size + columns.shape[-1]
+        if size > self._buffer.shape[-1]:
+            buffer = np.ma.masked_all(self._buffer.shape[:-1] + (2 * size,),
+                                      dtype=np.result_type(self._buffer.dtype, columns.dtype))
+            buffer[..., :self._size] = self._buffer[..., :self._size]
+            self._buffer = buffer
+        self._buffer[..., self._size:size] = columns
+        self._size = size
+        self.array = self._buffer[..., :size]
+        return self.array
+
+
+class _SharedArray(object):
+    """Float or bool array in `multiprocessing.shared_memory`, attached by unpickling in worker processes"""
+
+    def __init__(self, shape, dtype):
+        from multiprocessing.shared_memory import SharedMemory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._shm = SharedMemory(create=True, size=max(int(np.prod(self.shape)) * self.dtype.itemsize, 1))
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def copy(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def full(cls, shape, value=np.nan):
+        shared = cls(shape, float)
+        shared.array[...] = value
+        return shared
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype, 'name': self.name}
+
+    def __setstate__(self, state):
+        from multiprocessing.shared_memory import SharedMemory
+        self.__dict__.update(state)
+        try:
+            self._shm = SharedMemory(name=self.name, track=False)  # python 3.13+
+        except TypeError:  # registered in resource tracker shared with parent process
+            self._shm = SharedMemory(name=self.name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
 
+    def close(self):
+        self.array = None
+        self._shm.close()
 
-def mean_phot(lc, lc_stddev, lc_clip_sigma=1.0, stdev_clip_sigma=1.7, lc_clip_iters=2, stdev_clip_iter=2):
+    def unlink(self):
+        self.close()
+        self._shm.unlink()
+
+
+def mean_phot(lc, lc_stddev, lc_clip_sigma=1.0, stdev_clip_sigma=1.7, lc_clip_iters=2, stdev_clip_iter=2,
+              engine='nan'):
     """ Calculates stars mean magnitude and error from light curves
 
      Calculates stars mean magnitude with standard deviation from light curves using:
@@ -424,12 +963,16 @@ def mean_phot(lc, lc_stddev, lc_clip_sigma=1.0, stdev_clip_sigma=1.7, lc_clip_it
      - sigma clipping on data points
     :param lc:            NxK array of N  star magnitudes in K observations
     :param lc_stddev:     NxK array of  lc stddevs
+    :param str engine:    `"nan"` computes on float arrays with NaN for missing values, `"ma"` on masked arrays
     """
+    _check_engine(engine)
+    if engine == 'nan':
+        return _mean_phot_nan(lc, lc_stddev, lc_clip_sigma, stdev_clip_sigma, lc_clip_iters, stdev_clip_iter)
     p = np.ma.array(lc, copy=True)
     pe = np.ma.array(lc_stddev, copy=True)
 
-    lc_clip = SigmaClip(sigma=lc_clip_sigma, iters=lc_clip_iters)  # , cenfunc=partial(np.ma.average, weights=pe**-1))
-    err_clip = SigmaClip(sigma_lower=10.0, sigma_upper=stdev_clip_sigma, iters=stdev_clip_iter)
+    lc_clip = _sigma_clip(lc_clip_iters, sigma=lc_clip_sigma)  # , cenfunc=partial(np.ma.average, weights=pe**-1))
+    err_clip = _sigma_clip(stdev_clip_iter, sigma_lower=10.0, sigma_upper=stdev_clip_sigma)
     pmask1 = err_clip(pe, axis=1, copy=False).mask
     pmask2 = pmask1 | lc_clip(p, axis=1, copy=False).mask
     #    print(f, p.mask.sum(), pmask1.sum(), pmask2.sum())
@@ -440,3 +983,82 @@ def mean_phot(lc, lc_stddev, lc_clip_sigma=1.0, stdev_clip_sigma=1.7, lc_clip_it
     resid = lc - mean[:, np.newaxis]
     stddev = np.ma.sqrt(np.ma.average(resid ** 2, axis=1))  # , weights=pw)
     return mean, stddev
+
+
+def _mean_phot_nan(lc, lc_stddev, lc_clip_sigma, stdev_clip_sigma, lc_clip_iters, stdev_clip_iter):
+    # as mean_phot, on float arrays with NaN for missing values
+    p = _nan_filled(lc)
+    pe = _nan_filled(lc_stddev)
+    clipped = _clip_mask(pe, 10.0, stdev_clip_sigma, stdev_clip_iter)
+    clipped |= _clip_mask(p, lc_clip_sigma, lc_clip_sigma, lc_clip_iters)
+    pw = _nan_weights(pe, copy=False)
+    pw[clipped] = np.nan
+    mean = _nan_divide(_nan_sum(p * pw, axis=1), _nan_sum(pw, axis=1))
+    r2 = (p - mean[:, np.newaxis]) ** 2
+    stddev = _nan_sqrt(_nan_divide(_nan_sum(r2, axis=1), (~np.isnan(r2)).sum(axis=1)))
+    return _masked(mean), _masked(stddev)
+
+
+def _sigma_clip(iters, **kwargs):
+    try:
+        return SigmaClip(maxiters=iters, **kwargs)
+    except TypeError:  # astropy < 3.1
+        return SigmaClip(iters=iters, **kwargs)
+
+
+def _clip_mask(a, sigma_lower, sigma_upper, iters):
+    # mask of missing and sigma clipped values along axis 1, the same as of SigmaClip on masked array
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # NaN values
+        clip = _sigma_clip(iters, sigma_lower=sigma_lower, sigma_upper=sigma_upper)
+        return np.isnan(clip(a, axis=1, masked=False, copy=True))
+
+
+def _check_engine(engine):
+    if engine not in ('nan', 'ma'):
+        raise ValueError('Allowed engines are "nan" and "ma". Received "{}"'.format(engine))
+
+
+def _nan_filled(a):
+    # float array copy with NaN for masked values
+    filled = np.array(np.ma.getdata(a), dtype=float)
+    mask = np.ma.getmask(a)
+    if mask is not np.ma.nomask:
+        filled[mask] = np.nan
+    return filled
+
+
+def _nan_weights(err, copy=True):
+    # err^-2 with NaN for missing and invalid values, computed in place of float array if not copy
+    w = _nan_filled(err) if copy else err
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.multiply(w, w, out=w)
+        np.divide(1.0, w, out=w)
+    w[np.isinf(w)] = np.nan
+    return w
+
+
+def _nan_sum(a, axis):
+    # sum of not NaN values, NaN if all values are NaN
+    valid = ~np.isnan(a)
+    s = np.where(valid, a, 0.0).sum(axis=axis)
+    s[~valid.any(axis=axis)] = np.nan
+    return s
+
+
+def _nan_divide(a, b):
+    # NaN where result is not finite, as masked division
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.true_divide(a, b)
+    r[~np.isfinite(r)] = np.nan
+    return r
+
+
+def _nan_sqrt(a):
+    with np.errstate(invalid='ignore'):
+        return np.sqrt(a)
+
+
+def _masked(a):
+    # API boundary: NaN as masked values
+    return np.ma.masked_invalid(a, copy=False)
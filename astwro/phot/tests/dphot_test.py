@@ -36,6 +36,15 @@ def prepare_testset_masked():
     c = [False, True, True, False, True, False]
     return d, e, c
 
+def prepare_testset_random(n, m):
+    s = np.random.uniform(11.0, 14.0, size=(n, 1))  # n stars magnitudes
+    o = np.random.normal(scale=0.3, size=(1, m))  # m observations deviations
+    d = np.ma.masked_array(s + o + np.random.normal(scale=0.01, size=(n, m)))
+    e = np.ma.masked_array(np.full(d.shape, 0.01))
+    d[np.random.uniform(size=d.shape) < 0.1] = np.ma.masked  # 10% missing measurements
+    e.mask = d.mask.copy()
+    return d, e
+
 def prepare_testset_real():
     import os
     import pickle
@@ -77,6 +86,92 @@ def test_masked_object():
 
 
 
+def test_schur_solver():
+    from astwro.phot.dphot import _solve_normal_equations
+    for n, k in [(30, 8), (8, 30)]:
+        w = np.random.uniform(1.0, 2.0, size=(n, k))
+        w[np.random.uniform(size=(n, k)) < 0.2] = 0.0
+        wd = w * np.random.uniform(10.0, 15.0, size=(n, k))
+        # dense system of obs[1:] and stars
+        a = np.block([[np.diag(w.sum(axis=0)[1:]), w[:, 1:].T], [w[:, 1:], np.diag(w.sum(axis=1))]])
+        x = np.linalg.solve(a, np.concatenate([wd.sum(axis=0)[1:], wd.sum(axis=1)]))
+        o, c = _solve_normal_equations(w, wd)
+        assert o[0] == 0.0
+        assert np.allclose(o[1:], x[:k - 1])
+        assert np.allclose(c, x[k - 1:])
+
+
+def test_chunked_object():
+    d, e, c = prepare_testset_masked()
+    for ref_obs in [None, 'max']:
+        dp = DiffPhot(d, e, c, ref_obs=ref_obs)
+        with TmpDir() as td:
+            np.save(join(td.path, 'd.npy'), d.filled(np.nan))
+            np.save(join(td.path, 'e.npy'), e.filled(np.nan))
+            ch = ChunkedDiffPhot(join(td.path, 'd.npy'), join(td.path, 'e.npy'), c, ref_obs=ref_obs,
+                                 lc=join(td.path, 'lc.npy'), chunk_size=2)
+            assert np.ma.allclose(dp.mag, ch.mag)
+            assert np.ma.allclose(dp.obs_deltas, ch.obs_deltas)
+            assert np.ma.allclose(dp.obs_deltas_stddev, ch.obs_deltas_stddev)
+            assert np.ma.allclose(dp.lc, np.ma.masked_invalid(np.load(join(td.path, 'lc.npy'))))
+            assert np.ma.allclose(dp.lc_e, np.ma.masked_invalid(ch.lc_e))
+            assert (np.isnan(ch.lc) == np.ma.getmaskarray(dp.lc)).all()
+            del ch
+
+
+def test_add_observations():
+    d, e = prepare_testset_random(50, 30)
+    full = DiffPhot(d, e)
+    dp = DiffPhot(d[:, :20], e[:, :20], lazy=False)
+    dp.add_observations(d[:, 20:25], e[:, 20:25])
+    dp.add_observations(d[:, 25:], e[:, 25:])
+    assert dp.M == 30
+    assert np.ma.allclose(dp.obs_deltas, full.obs_deltas, atol=0.005)
+    assert np.ma.allclose(dp.mag, full.mag, atol=0.005)
+    assert (dp.lc.mask == full.lc.mask).all()
+    dp.add_observations(d[:, :0], e[:, :0], resolve=True)  # full solution
+    assert np.ma.allclose(dp.obs_deltas, full.obs_deltas)
+    assert np.ma.allclose(dp.lc, full.lc)
+    # arrays grow in buffers, not copied on every update
+    dp = DiffPhot(d[:, :10], e[:, :10], lazy=False)
+    dp.add_observations(d[:, 10:12], e[:, 10:12], resolve=False)
+    lc = dp.lc
+    for i in range(12, 20, 2):
+        dp.add_observations(d[:, i:i + 2], e[:, i:i + 2], resolve=False)
+        assert np.shares_memory(dp.lc, lc)
+    assert (dp.data == d[:, :20]).all() and (dp.data.mask == d.mask[:, :20]).all()
+    assert (dp.lc.mask == full.lc.mask[:, :20]).all()
+
+
+def test_nan_engine():
+    d, e, c = prepare_testset_masked()
+    for a, b in zip(dphot(d, e, c, engine='ma'), dphot(d, e, c, engine='nan')):
+        assert (np.ma.getmaskarray(a) == np.ma.getmaskarray(b)).all()
+        assert np.ma.allclose(a, b)
+    for ref_obs in [None, 'max']:
+        a = DiffPhot(d, e, c, ref_obs=ref_obs, engine='ma')
+        b = DiffPhot(d, e, c, ref_obs=ref_obs, engine='nan')
+        for name in ['mag', 'lc', 'obs_deltas', 'obs_deltas_stddev', 'lc_e']:
+            assert (np.ma.getmaskarray(getattr(a, name)) == np.ma.getmaskarray(getattr(b, name))).all()
+            assert np.ma.allclose(getattr(a, name), getattr(b, name))
+    lc = np.ma.masked_array(np.random.normal(12.0, 0.1, size=(10, 30)), mask=np.random.uniform(size=(10, 30)) < 0.2)
+    lc_e = np.ma.masked_array(np.random.uniform(0.01, 0.05, size=lc.shape), mask=lc.mask.copy())
+    for a, b in zip(mean_phot(lc, lc_e, engine='ma'), mean_phot(lc, lc_e, engine='nan')):
+        assert (np.ma.getmaskarray(a) == np.ma.getmaskarray(b)).all()
+        assert np.ma.allclose(a, b)
+
+
+def test_filters_parallel():
+    d, e = prepare_testset_random(40, 12)
+    f = [np.arange(12) % 3 == i for i in range(3)]
+    for engine in ['nan', 'ma']:
+        serial = dphot_filters(d, e, f, engine=engine)
+        parallel = dphot_filters(d, e, f, engine=engine, parallel=2)
+        for a, b in zip(serial, parallel):
+            assert (np.ma.getmaskarray(a) == np.ma.getmaskarray(b)).all()
+            assert np.ma.allclose(a, b)
+
+
 def test_write_lc():
     #TODO: Limit numer of stars in some_stars_data.pkl
     with TmpDir() as td:
@@ -1,10 +1,15 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 # see https://wiki.python.org/moin/PortingToPy3k/BilingualQuickRef
+from copy import deepcopy
 from .DAORunner import DAORunner
 from .OutputProviders import *
 from astwro.config import find_opt_file
 import astwro.starlist
+try:
+    from astwro.exttools.coroutines import coroutine_variant  # python 3.5+
+except SyntaxError:
+    coroutine_variant = None
 
 
 class Allstar(DAORunner):
@@ -26,8 +31,8 @@ class Allstar(DAORunner):
                                                         >>> dp.options = [('PR', 5.0), ('FITTING RADIUS', 6.0)]
     """
 
-    def __init__(self, dir=None, image=None, allstaropt=None, options=None, batch=False):
-        # type: ([str,object], [str], [str], [list,dict], bool) -> Allstar
+    def __init__(self, dir=None, image=None, allstaropt=None, options=None, batch=False, preserve_process=False):
+        # type: ([str,object], [str], [str], [list,dict], bool, bool) -> Allstar
         """
         :param [str] dir:          pathname or TmpDir object - working directory for daophot,
                                    if None temp dir will be used and deleted on `Allstar.close()`
@@ -38,6 +43,8 @@ class Allstar(DAORunner):
         :param [list,dict] options: if provided options will be set on beginning of each process
                                    list of tuples or dict
         :param bool batch:         whether Allstar have to work in batch mode. 
+        :param bool preserve_process: whether to keep single allstar process alive between runs (session mode),
+                                   allstar takes options on start only, so process is restarted when options change.
         """
         if allstaropt is not None:
             self.allstaropt = allstaropt
@@ -50,7 +57,11 @@ class Allstar(DAORunner):
         if options:
             self.options.update(dict(options))
 
-        super(Allstar, self).__init__(dir=dir, batch=batch)
+        # options of living allstar process in preserve_process mode
+        self._session_options = None
+        self._session_optfile = None
+
+        super(Allstar, self).__init__(dir=dir, batch=batch, preserve_process=preserve_process)
         # base implementation of __init__ calls `_reset` also
         self._update_executable('allstar')
 
@@ -61,7 +72,6 @@ class Allstar(DAORunner):
 
 
     def __deepcopy__(self, memo):
-        from copy import deepcopy
         new = super(Allstar, self).__deepcopy__(memo)
 
         new.allstaropt = deepcopy(self.allstaropt, memo)
@@ -71,12 +81,21 @@ class Allstar(DAORunner):
 
         new.image = deepcopy(self.image, memo)
         new.options = deepcopy(self.options, memo)
+        new._session_options = None
+        new._session_optfile = None
         return new
 
     def _pre_run(self, wait):
         if not self.ALlstars_result:
             raise Allstar.RunnerException('Add ALlstar command before run.', self)
         super(Allstar, self)._pre_run(wait)
+        optfile = self._file_signature('allstar.opt')
+        if self.session_alive:
+            if self.options == self._session_options and optfile == self._session_optfile:
+                return  # options already set in living process
+            self._close_session()  # allstar takes options on start only
+        self._session_options = deepcopy(self.options)
+        self._session_optfile = optfile
         # set options, and prepare options parser
         commands = ''
         if self.options:  # set options before
@@ -90,6 +109,9 @@ class Allstar(DAORunner):
         self.OPtion_result = processor
         self._insert_processing_step(commands, output_processor=processor, on_beginning=True)
 
+    def _cache_inputs(self):
+        return super(Allstar, self)._cache_inputs() + ['allstar.opt']
+
     def _init_workdir_files(self, dir):
         super(Allstar, self)._init_workdir_files(dir)
         self.link_to_runner_dir(self.allstaropt, 'allstar.opt')
@@ -148,6 +170,9 @@ class Allstar(DAORunner):
         commands = '{}\n{}\n{}\n{}\n{}'.format(l_img, l_psf, l_pht, l_als, l_sub)
         if l_sub:
             commands += '\n'  # if subtracted image not needed, EOF (without new line) should be answer for it (allstar)
+        elif self.preserve_process:
+            # EOF can not be sent to living process, allstar reads EOF as 'END OF FILE' name, so answer that
+            commands += 'END OF FILE\n'
 
         processor = AsOp_result(profile_photometry_file=a_als, subtracted_image_file=a_sub)
         self._insert_processing_step(commands, output_processor=processor)
@@ -155,3 +180,7 @@ class Allstar(DAORunner):
         if not self.batch_mode:
             self.run()
         return processor
+
+    # asyncio variant of command: ``await als.aALlstar()``
+    if coroutine_variant is not None:
+        aALlstar = coroutine_variant(ALlstar)
@@ -4,7 +4,11 @@ __metaclass__ = type
 
 import os
 import random
-from collections import namedtuple
+import hashlib
+import weakref
+import threading
+from collections import namedtuple, OrderedDict, Counter
+import pandas as pd
 from astwro.exttools import Runner
 import astwro.starlist as sl
 
@@ -13,11 +17,40 @@ import astwro.starlist as sl
 class DAORunner(Runner):
     """base for daophot package runners runner"""
 
-    def __init__(self, dir=None, batch=False):
-        super(DAORunner, self).__init__(dir=dir, batch=batch)
+    starlist_files_max = 10  #: number of files with StarLists passed to commands kept in runner dir for reuse
 
     def __deepcopy__(self, memo):
-        return super(DAORunner, self).__deepcopy__(memo)
+        new = super(DAORunner, self).__deepcopy__(memo)
+        files, new_files = self._starlist_files, new._starlist_files
+        if new_files is not files:  # files are in cloned dir
+            with new_files.lock:
+                for digest, filename in files.files.items():
+                    new_files.files.setdefault(digest, filename)
+        return new
+
+    def _reset(self):
+        super(DAORunner, self)._reset()
+        self._release_starlist_files()
+
+    def _on_exit(self):
+        super(DAORunner, self)._on_exit()
+        self._release_starlist_files()
+
+    @property
+    def _starlist_files(self):
+        """Registry of StarList files in runner dir, shared by all runners working in that dir"""
+        registry = getattr(self, '_starlist_registry', None)
+        if registry is None or registry.path != self.dir.path:
+            registry = self._starlist_registry = _StarlistFiles.of(self.dir.path)
+        return registry
+
+    def _release_starlist_files(self):
+        # StarList files used by current commands sequence can be collected by any runner of the dir
+        used = getattr(self, '_starlist_files_used', None)
+        if used:
+            self._starlist_files_holder.release(used)
+        self._starlist_files_used = set()
+        self._starlist_files_holder = None
 
     # dao files management
     def apertures_file_push(self, src_path):
@@ -75,6 +108,7 @@ class DAORunner(Runner):
         if filename is None:
             ext = dao_file_type.extension if dao_file_type else '.stars'
             filename = self._runner_dir_file_name(signature=random.random(), suffix=ext)
+        self.rm_from_runner_dir(filename)  # do not write through link (symlink or hardlink of cloned dir)
         sl.write_dao_file(stars, os.path.join(str(self.dir), filename), dao_type=dao_file_type)
         return filename
 
@@ -83,9 +117,86 @@ class DAORunner(Runner):
         # check if input has a form of StarList
         if isinstance(data, sl.StarList):
             dao_type = default_dao_file_type if data.DAO_type is None else data.DAO_type
-            data = self.write_starlist(data, dao_file_type=dao_type)
+            data = self._starlist_file(data, dao_type)
         return super(DAORunner, self)._prepare_input_file(data)
 
+    def _starlist_file(self, stars, dao_type):
+        """File in runner dir with StarList content, written only if the same content is not already there"""
+        digest = starlist_digest(stars, dao_type)
+        ext = dao_type.extension if dao_type else '.stars'
+        filename = 'sl_' + digest[:16] + ext
+        registry = self._starlist_files
+        with registry.lock:
+            registry.files.pop(digest, None)
+            registry.files[digest] = filename
+            if self._starlist_files_holder is not registry:
+                self._release_starlist_files()
+                self._starlist_files_holder = registry
+            if filename not in self._starlist_files_used:
+                self._starlist_files_used.add(filename)
+                registry.holders[filename] += 1
+            exists = self.exists_in_runner_dir(filename)
+        if exists:
+            self.logger.debug('Reusing {} for StarList'.format(filename))
+        else:
+            # other runner of the dir can read the file: written under temporary name, then replaced
+            tmp = self.write_starlist(stars, dao_file_type=dao_type)
+            os.replace(self.absolute_path(tmp), self.absolute_path(filename))
+        self._collect_starlist_files()
+        return filename
+
+    def _collect_starlist_files(self):
+        # removes least recently used StarList files over starlist_files_max, except used by queued commands
+        # of any runner of the dir
+        registry = self._starlist_files
+        with registry.lock:
+            stale = [d for d, f in registry.files.items() if not registry.holders[f]]
+            for digest in stale[:max(len(registry.files) - self.starlist_files_max, 0)]:
+                self.rm_from_runner_dir(registry.files.pop(digest))
+
     def _process_starlist(self, s, **kwargs):
         return s
 
+
+class _StarlistFiles(object):
+    """StarList files in runner dir, one registry for all runners working in the dir"""
+    _registries = weakref.WeakValueDictionary()  # runner dir path -> registry
+    _registries_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = OrderedDict()  # content digest -> file in runner dir, least recently used first
+        self.holders = Counter()  # file -> number of runners using it in queued commands
+
+    @classmethod
+    def of(cls, path):
+        with cls._registries_lock:
+            registry = cls._registries.get(path)
+            if registry is None:
+                registry = cls._registries[path] = cls(path)
+            return registry
+
+    def release(self, filenames):
+        with self.lock:
+            for f in filenames:
+                self.holders[f] -= 1
+                if self.holders[f] <= 0:
+                    del self.holders[f]
+
+
+def starlist_digest(stars, dao_type=None):
+    """
+    Hash of StarList content (values, index, columns, DAO header) and DAO file type it would be written as
+
+    :param sl.StarList stars: star list
+    :param dao_type: DAO file type, default: `stars.DAO_type`
+    :rtype: str
+    """
+    if dao_type is None:
+        dao_type = stars.DAO_type
+    sha = hashlib.sha1()
+    sha.update(repr((list(stars.columns), sorted((k, str(v)) for k, v in (stars.DAO_hdr or {}).items()),
+                     dao_type.extension if dao_type else None, dao_type.columns if dao_type else None)).encode())
+    sha.update(pd.util.hash_pandas_object(stars, index=True).values.tobytes())
+    return sha.hexdigest()
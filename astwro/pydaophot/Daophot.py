@@ -3,10 +3,15 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os
+from copy import deepcopy
 from .DAORunner import DAORunner
 from .OutputProviders import *
 from astwro.config import find_opt_file
 import astwro.starlist as sl
+try:
+    from astwro.exttools.coroutines import coroutine_variant  # python 3.5+
+except SyntaxError:
+    coroutine_variant = None
 
 class Daophot(DAORunner):
     """ **daophot** runner
@@ -50,8 +55,8 @@ class Daophot(DAORunner):
     PSF_PENNY1 = 6    # type: int
     PSF_PENNY2 = 7    # type: int
 
-    def __init__(self, dir=None, image=None, daophotopt=None, options=None, batch=False):
-        # type: ([str,object], [str], [str], [list,dict], bool) -> Daophot
+    def __init__(self, dir=None, image=None, daophotopt=None, options=None, batch=False, preserve_process=False):
+        # type: ([str,object], [str], [str], [list,dict], bool, bool) -> Daophot
         """
         :param str dir:          pathname or TmpDir object - working directory for daophot,
                                    if None temp dir will be used and deleted on `Daophot.close()`
@@ -64,6 +69,9 @@ class Daophot(DAORunner):
                                    setting options property has same effect; list of tuples or dict.
                                    Do not set WATCH PROGRESS to sth else than -2
         :param bool batch:         whether Daophot have to work in batch mode.
+        :param bool preserve_process: whether to keep single daophot process alive between runs (session mode),
+                                   image stays attached and options stay set between runs, ATTACH and OPTION
+                                   commands are repeated only when :attr:`image` or options changes.
 
 
         .. attribute:: dir
@@ -81,7 +89,13 @@ class Daophot(DAORunner):
         if options:
             self.options.update(dict(options))
 
-        super(Daophot, self).__init__(dir=dir, batch=batch)
+        # state of living daophot process in preserve_process mode
+        self._attached_image = None
+        self._session_options = None
+        self._session_optfile = None
+        self._session_opt_result = None
+
+        super(Daophot, self).__init__(dir=dir, batch=batch, preserve_process=preserve_process)
         # base implementation of __init__ calls `_reset` also
         self._update_executable('daophot')
 
@@ -99,6 +113,7 @@ class Daophot(DAORunner):
         self.SUbstar_result = None
         self.GRoup_result = None
         self.NEda_result = None
+        self._queued_attach = None
 
 
     def __deepcopy__(self, memo):
@@ -109,27 +124,61 @@ class Daophot(DAORunner):
 
         new.image = deepcopy(self.image, memo)
         new.options = deepcopy(self.options, memo)
+        new._attached_image = None
+        new._session_options = None
+        new._session_optfile = None
+        new._session_opt_result = None
         return new
 
     def _pre_run(self, wait):
         super(Daophot, self)._pre_run(wait)
-        if self.options:
-            self._enqueueOPtions(self.options, on_beginning=True)
-        if self.image:
-            self._enqueueATtach(self.expand_path(self.image), on_beginning=True)
-
-        # just for consume options daophot presents on the beginning
-        opt_processor = DPOP_OPtion()
-        if self.OPtion_result is None:
-            self.OPtion_result = opt_processor
-        self._insert_processing_step('', output_processor=opt_processor, on_beginning=True)
-        # Empty lines to unhang daophot after error (otherwise it waits for corrected input)
-        self._insert_processing_step('\n\n\n')
+        image = self.expand_path(self.image) if self.image else None
+        optfile = self._file_signature('daophot.opt')
+        if self.session_alive:
+            # living daophot keeps options and attached image, repeat OPTION and ATTACH only if changed
+            optfile_changed = optfile != self._session_optfile
+            if self.options and (optfile_changed or self.options != self._session_options):
+                self._enqueueOPtions(self.options, on_beginning=True)
+            if optfile_changed:
+                self._enqueueOPtions('daophot.opt', on_beginning=True)
+            if image and image != self._attached_image:
+                self._enqueueATtach(image, on_beginning=True)
+            if self.OPtion_result is None:
+                self.OPtion_result = self._session_opt_result
+        else:
+            if self.options:
+                self._enqueueOPtions(self.options, on_beginning=True)
+            if image:
+                self._enqueueATtach(image, on_beginning=True)
+
+            # just for consume options daophot presents on the beginning
+            opt_processor = DPOP_OPtion()
+            if self.OPtion_result is None:
+                self.OPtion_result = opt_processor
+            self._insert_processing_step('', output_processor=opt_processor, on_beginning=True)
+            if not self.preserve_process:
+                # Empty lines to unhang daophot after error (otherwise it waits for corrected input)
+                # (not for living process, where every line is answered by extra prompt)
+                self._insert_processing_step('\n\n\n')
+            self._attached_image = None
+        self._session_options = deepcopy(self.options)
+        self._session_optfile = optfile
+        self._session_opt_result = self.OPtion_result
+        if self._queued_attach is not None:
+            self._attached_image = self._queued_attach
+        elif image:
+            self._attached_image = image
 
     def _on_exit(self):
-        pass
+        super(Daophot, self)._on_exit()
 
 
+    def _cache_inputs(self):
+        inputs = super(Daophot, self)._cache_inputs()
+        # option files, and PSF file named after attached image, found by daophot automatically
+        psfs = [os.path.splitext(f)[0] + '.psf' for f in inputs if f.endswith('.fits')]
+        return inputs + ['daophot.opt', 'photo.opt'] + psfs
+
     def _init_workdir_files(self, dir):
         super(Daophot, self)._init_workdir_files(dir)
         self.link_to_runner_dir(self.daophotopt, 'daophot.opt')
@@ -137,7 +186,9 @@ class Daophot(DAORunner):
 
     def _enqueueATtach(self, image_file, on_beginning=False):
         # type: (str, bool) -> DPOP_ATtach
-        image_file, _ = self._prepare_input_file(image_file)
+        image_file, a_image_file = self._prepare_input_file(image_file)
+        if not on_beginning:
+            self._queued_attach = a_image_file
         processor = DPOP_ATtach()
         self._insert_processing_step('ATTACH {}\n'.format(image_file),
                                      output_processor=processor,
@@ -559,6 +610,17 @@ class Daophot(DAORunner):
             self.run()
         return processor
 
+    def map(self, images, script, allstar_kwargs=None, parallel=None, keep_runners=False, ordered=False):
+        """
+        Runs ``script(daophot, allstar)`` for every image in parallel on clones of this runner,
+        see :func:`astwro.pydaophot.batch.map_frames`
+
+        :return: iterator of :class:`astwro.pydaophot.batch.FrameResult` in order of completion
+        """
+        from .batch import map_frames
+        return map_frames(images, script, daophot=self, allstar_kwargs=allstar_kwargs, parallel=parallel,
+                          keep_runners=keep_runners, ordered=ordered)
+
     def _check_apertures(self, IS, OS, apertures, photoopt):
         if photoopt is None and (apertures is None or IS == 0 or OS == 0):
             raise Daophot.RunnerValueError('Apertures and IS and OS must be provided, explicitly or as photoopt file',
@@ -581,6 +643,18 @@ class Daophot(DAORunner):
             s = new
         return s
 
+    # asyncio variants of commands, e.g. ``await dp.aPSf()``
+    if coroutine_variant is not None:
+        aSKy = coroutine_variant(SKy)
+        aFInd = coroutine_variant(FInd)
+        aPHotometry = coroutine_variant(PHotometry)
+        aPIck = coroutine_variant(PIck)
+        aPSf = coroutine_variant(PSf)
+        aSOrt = coroutine_variant(SOrt)
+        aSUbstar = coroutine_variant(SUbstar)
+        aGRoup = coroutine_variant(GRoup)
+        aNEda = coroutine_variant(NEda)
+
 
 
 
@@ -409,7 +409,8 @@ class AsOp_result(OutputBufferedProcessor):
         super(AsOp_result, self).__init__(prev_in_chain=prev_in_chain)
 
     def _is_last_one(self, line, counter):
-        return False
+        # allstar asks for next image after finishing
+        return r_alls_separator.search(line) is not None
 
     @property
     def als_stars(self):
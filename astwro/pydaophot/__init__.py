@@ -1,5 +1,7 @@
 from .Daophot import Daophot
 from .Allstar import Allstar
+from .batch import map_frames, FrameResult
+from .pipeline import Pipeline, Step
 #from .ASRunner import ASRunner
 #from .dao import allstar, daophot, daophot_cfg
 from ._version import __version__, __version_info__
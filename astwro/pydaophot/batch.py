@@ -0,0 +1,110 @@
+# coding=utf-8
+"""Processing of many frames by the same daophot/allstar recipe in parallel"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from astwro.config.logger import logger as module_logger
+from .Daophot import Daophot
+from .Allstar import Allstar
+
+logger = module_logger.getChild('batch')
+
+
+class FrameResult(object):
+    """
+    Result of recipe for single frame
+
+    :var str image: frame file
+    :var result: value returned by recipe, e.g. `StarList` of ALLSTAR photometry
+    :var Exception error: exception raised by recipe or ``None``
+    :var str traceback: formatted traceback of ``error``
+    :var Daophot daophot: runner used for the frame, if ``keep_runners`` was set, otherwise ``None``
+    :var Allstar allstar: runner used for the frame, if ``keep_runners`` was set, otherwise ``None``
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.daophot = None
+        self.allstar = None
+
+    @property
+    def success(self):
+        """True if recipe finished without exception"""
+        return self.error is None
+
+    def __repr__(self):
+        return 'FrameResult({}: {})'.format(self.image, 'ok' if self.success else repr(self.error))
+
+
+def map_frames(images, script, daophot=None, allstar_kwargs=None, parallel=None, keep_runners=False, ordered=False):
+    """
+    Runs ``script(daophot, allstar)`` for every image in parallel, yields :class:`FrameResult` as frames complete
+
+    Every frame gets fresh clone of ``daophot`` prototype (with own copy of *runner directory*, options, opt files),
+    with frame set as :attr:`Daophot.image`, and :class:`Allstar` working in the same directory on that frame.
+    Exception raised by ``script`` does not stop other frames, it's reported in :attr:`FrameResult.error`.
+
+    Example:
+        >>> def recipe(dp, als):
+        ...     dp.FInd()
+        ...     dp.PHotometry(apertures=[8], IS=35, OS=50)
+        ...     dp.PIck()
+        ...     dp.PSf()
+        ...     als.ALlstar(stars='i.ap')
+        ...     return als.ALlstars_result.als_stars
+        >>> for frame in map_frames(glob.glob('night/*.fits'), recipe):
+        ...     if frame.success:
+        ...         write_dao_file(frame.result, frame.image + '.als')
+
+    :param images: list of FITS files
+    :param script: callable(daophot, allstar) -> result, should return data (e.g. `StarList`), not result objects,
+                   because runners are closed after script unless ``keep_runners`` is set
+    :param Daophot daophot: prototype runner, default: ``Daophot()`` with standard options
+    :param dict allstar_kwargs: arguments for :class:`Allstar` constructor (e.g. ``allstaropt``, ``options``)
+    :param int parallel: number of frames processed simultaneously, default: number of CPUs
+    :param bool keep_runners: do not close runners after script, make them available in :class:`FrameResult`
+    :param bool ordered: yield results in ``images`` order instead of order of completion
+    :rtype: collections.Iterable[FrameResult]
+    """
+    if daophot is None:
+        daophot = Daophot()
+    if parallel is None:
+        parallel = multiprocessing.cpu_count()
+    executor = ThreadPoolExecutor(max_workers=parallel)
+    futures = [executor.submit(_process_frame, daophot, image, script, allstar_kwargs, keep_runners)
+               for image in images]
+    try:
+        for f in (futures if ordered else as_completed(futures)):
+            yield f.result()
+    finally:  # also when iteration abandoned
+        for f in futures:
+            f.cancel()
+        executor.shutdown(wait=True)
+
+
+def _process_frame(prototype, image, script, allstar_kwargs, keep_runners):
+    frame = FrameResult(image)
+    dp = als = None
+    try:
+        dp = prototype.clone()
+        dp.image = image
+        als = Allstar(dir=dp.dir, image=image, **(allstar_kwargs or {}))
+        frame.result = script(dp, als)
+    except Exception as e:
+        logger.warning('Processing of frame {} failed: {!r}'.format(image, e))
+        frame.error = e
+        frame.traceback = traceback.format_exc()
+    if keep_runners:
+        frame.daophot, frame.allstar = dp, als
+    else:
+        for r in (als, dp):
+            if r is not None:
+                r.close()
+    return frame
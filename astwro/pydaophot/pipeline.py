@@ -0,0 +1,338 @@
+# coding=utf-8
+"""Incremental photometry pipeline: daophot/allstar steps as dependency graph over files"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from astwro.config.logger import logger as module_logger
+from astwro.config import find_opt_file
+from astwro.utils import tmpdir, TmpDir
+from astwro.exttools import Runner
+from .Daophot import Daophot
+from .Allstar import Allstar
+
+
+class Step(object):
+    """
+    Step of :class:`Pipeline`: function producing ``outputs`` files from ``inputs`` files
+
+    :var str name: unique name of step
+    :var func: callable(daophot, allstar, **options)
+    :var list inputs: names of input files (artefacts)
+    :var list outputs: names of output files (artefacts)
+    :var dict options: keyword arguments for ``func``, part of step fingerprint
+    """
+
+    def __init__(self, name, func, inputs, outputs, options=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.options = dict(options or {})
+
+    def __repr__(self):
+        return 'Step({}: {} -> {})'.format(self.name, self.inputs, self.outputs)
+
+
+class Pipeline(object):
+    """
+    Photometry pipeline described as steps over named artefacts: files in pipeline directory
+
+    Every step declares input and output files, step producing an input of other step is its dependency.
+    Inputs which are not produced by any step (source files) must exist. On :meth:`run` steps are executed in
+    dependencies order, independent ones in parallel, each one with own :class:`Daophot` and :class:`Allstar`
+    working on pipeline image in own step directory (inside pipeline directory), where files of pipeline directory
+    are linked. Side files of commands (like ``i.err`` of PSF) of parallel steps do not collide, and only declared
+    outputs are moved into pipeline directory when step succeeds.
+
+    Run is incremental: fingerprint of step (its name, code, options, contents of input files, image and opt files)
+    is stored in ``pipeline.json`` of pipeline directory, and step is executed only if fingerprint changed or some
+    of its outputs is missing. Changed output of step changes fingerprints of dependant steps.
+
+    Example (part of Bialkow workflow)::
+
+        p = Pipeline('reduction/frame1', image='frame1.fits', daophotopt='daophot.opt')
+
+        @p.step(inputs=['i.coo'], outputs=['i.ap'], IS=35, OS=50, apertures=[8])
+        def phot(dp, als, **apertures):
+            dp.PHotometry(stars='i.coo', photometry_file='i.ap', **apertures)
+
+        @p.step(inputs=['i.ap', 'i.lst'], outputs=['i.psf', 'i.nei'])
+        def psf(dp, als):
+            dp.PSf(photometry='i.ap', psf_stars='i.lst', psf_file='i.psf')
+
+        @p.step(inputs=['i.psf', 'i.nei'], outputs=['i.als'])
+        def allstar(dp, als):
+            als.ALlstar(psf_file='i.psf', stars='i.nei', profile_photometry_file='i.als')
+
+        p.run()                          # everything
+        p.set_options('phot', IS=30)
+        p.run()                          # phot, psf and allstar only if i.ap content changed
+
+    Artefact names without directory are files in pipeline directory, others are paths relative to
+    current working directory.
+
+    :param dir: pipeline directory, should be persistent for runs in many sessions, default: temp dir
+    :param str image: FITS image attached by daophot and allstar of every step
+    :param str daophotopt: daophot.opt file, default: from config
+    :param str allstaropt: allstar.opt file, default: from config
+    :param dict daophot_options: options for every :class:`Daophot`
+    :param dict allstar_options: options for every :class:`Allstar`
+
+    :var str image_file: path of image link in pipeline directory, used by runners of steps
+    """
+
+    state_file = 'pipeline.json'
+    step_dir_prefix = '.step_'
+
+    def __init__(self, dir=None, image=None, daophotopt=None, allstaropt=None,
+                 daophot_options=None, allstar_options=None):
+        if dir is None:
+            dir = tmpdir(prefix='pipeline_')
+        elif not isinstance(dir, TmpDir):
+            dir = os.path.abspath(os.path.expanduser(dir))
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            dir = tmpdir(use_existing=dir)
+        self.dir = dir
+        self.image = os.path.abspath(os.path.expanduser(image)) if image else None
+        self.daophotopt = find_opt_file('daophot.opt', package='pydaophot') if daophotopt is None else daophotopt
+        self.allstaropt = find_opt_file('allstar.opt', package='pydaophot') if allstaropt is None else allstaropt
+        self.daophot_options = daophot_options
+        self.allstar_options = allstar_options
+        self.steps = {}
+        self.logger = module_logger.getChild(type(self).__name__)
+        self.__producers = {}
+        self.__hashes = {}
+        self.image_file = None
+        if self.image:
+            self.image_file = self.path(Runner._runner_dir_file_name(self.image))
+            _link(self.image, self.image_file)
+        _link(self.daophotopt, self.path('daophot.opt'))
+        _link(self.allstaropt, self.path('allstar.opt'))
+
+    def add_step(self, name, func, inputs, outputs, **options):
+        """
+        Adds step, see :class:`Step`
+
+        :return: new step
+        :rtype: Step
+        """
+        if name in self.steps:
+            raise ValueError('Step {} already defined'.format(name))
+        step = Step(name, func, inputs, outputs, options)
+        for o in step.outputs:
+            if o in self.__producers:
+                raise ValueError('Artefact {} produced by both {} and {} steps'.format(o, self.__producers[o], name))
+        for o in step.outputs:
+            self.__producers[o] = name
+        self.steps[name] = step
+        return step
+
+    def step(self, inputs, outputs, name=None, **options):
+        """Decorator version of :meth:`add_step`, function name is the default step name"""
+        def decorator(func):
+            self.add_step(name or func.__name__, func, inputs, outputs, **options)
+            return func
+        return decorator
+
+    def set_options(self, step, **options):
+        """Updates options of step"""
+        self.steps[step].options.update(options)
+
+    def path(self, artefact):
+        """Absolute path of artefact"""
+        if os.path.basename(artefact) == artefact:
+            return os.path.join(self.dir.path, artefact)
+        return os.path.abspath(os.path.expanduser(artefact))
+
+    def dependencies(self, step):
+        """Names of steps producing inputs of step"""
+        return set(self.__producers[i] for i in self.steps[step].inputs if i in self.__producers)
+
+    def _needed(self, targets):
+        # steps needed for targets, with their dependencies
+        needed = set()
+        todo = list(targets)
+        while todo:
+            s = todo.pop()
+            if s not in needed:
+                if s not in self.steps:
+                    raise ValueError('Unknown step {}'.format(s))
+                needed.add(s)
+                todo.extend(self.dependencies(s))
+        return needed
+
+    def fingerprint(self, step):
+        """Hash of step name, code, options and contents of its inputs, image and opt files"""
+        step = self.steps[step]
+        sha = hashlib.sha1()
+        sha.update(json.dumps([step.name, step.options, self.daophot_options, self.allstar_options],
+                              sort_keys=True, default=repr).encode())
+        code = getattr(step.func, '__code__', None)
+        if code is not None:
+            sha.update(code.co_code)
+            sha.update(repr([c for c in code.co_consts if not hasattr(c, 'co_code')]).encode())
+        for f in [self.image, self.daophotopt, self.allstaropt] + [self.path(i) for i in step.inputs]:
+            sha.update('{}\0{}\0'.format(os.path.basename(str(f)), self._file_hash(f)).encode())
+        return sha.hexdigest()
+
+    def _file_hash(self, path):
+        # hashes of files reused while their size and modification time does not change
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 'missing'
+        key = (path, st.st_size, st.st_mtime_ns)
+        h = self.__hashes.get(key)
+        if h is None:
+            h = self.__hashes[key] = _file_hash(path)
+        return h
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.dir.path, self.state_file)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        path = os.path.join(self.dir.path, self.state_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def is_up_to_date(self, step, state=None, fingerprint=None):
+        """Whether step outputs exist and were made from current inputs and options
+
+        :param dict state: loaded state of pipeline, default: read from :attr:`state_file`
+        :param str fingerprint: already computed :meth:`fingerprint` of step
+        """
+        if state is None:
+            state = self._load_state()
+        if fingerprint is None:
+            fingerprint = self.fingerprint(step)
+        return (state.get(step) == fingerprint
+                and all(os.path.exists(self.path(o)) for o in self.steps[step].outputs))
+
+    def run(self, targets=None, parallel=None, force=False):
+        """
+        Executes steps which are not up to date
+
+        :param targets: names of steps to be brought up to date (with dependencies), default: all steps
+        :param int parallel: maximum number of steps executed simultaneously, default: number of CPUs
+        :param bool force: execute steps even if they are up to date
+        :return: names of executed steps in order of completion
+        """
+        needed = self._needed(self.steps if targets is None else targets)
+        for s in needed:
+            for i in self.steps[s].inputs:
+                if i not in self.__producers and not os.path.exists(self.path(i)):
+                    raise ValueError('Input {} of step {} is not produced by any step and does not exist'
+                                     .format(i, s))
+        if parallel is None:
+            parallel = multiprocessing.cpu_count()
+        state = self._load_state()
+        executed = []
+        done = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            while needed or running:
+                ready = [s for s in sorted(needed) if self.dependencies(s) <= done] if error is None else []
+                for s in ready:
+                    needed.remove(s)
+                    fingerprint = self.fingerprint(s)  # inputs are ready
+                    if not force and self.is_up_to_date(s, state, fingerprint):
+                        self.logger.debug('Step {} is up to date'.format(s))
+                        done.add(s)
+                        continue
+                    self.logger.info('Executing step {}'.format(s))
+                    running[executor.submit(self._execute, s)] = (s, fingerprint)
+                if not running:
+                    if error is not None or not needed:
+                        break
+                    if not ready:
+                        raise ValueError('Cyclic dependencies between steps: {}'.format(sorted(needed)))
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    s, fingerprint = running.pop(f)
+                    try:
+                        f.result()
+                    except Exception as e:
+                        self.logger.error('Step {} failed: {!r}'.format(s, e))
+                        state.pop(s, None)
+                        if error is None:
+                            error = e
+                        continue
+                    state[s] = fingerprint
+                    self._save_state(state)
+                    done.add(s)
+                    executed.append(s)
+        if error is not None:
+            raise error
+        return executed
+
+    def _runners(self, dir):
+        # image and opt files are linked in step dir as in pipeline dir, runners use them without relinking
+        image = os.path.join(dir.path, os.path.basename(self.image_file)) if self.image_file else None
+        dp = Daophot(dir=dir, image=image, daophotopt=self.daophotopt, options=self.daophot_options)
+        als = Allstar(dir=dir, image=image, allstaropt=self.allstaropt, options=self.allstar_options)
+        return dp, als
+
+    def _execute(self, step):
+        step = self.steps[step]
+        with tmpdir(prefix=self.step_dir_prefix + step.name + '_', base_dir=self.dir.path) as dir:
+            self._link_files(dir, exclude=step.outputs)
+            dp, als = self._runners(dir)
+            try:
+                step.func(dp, als, **step.options)
+                local = [o for o in step.outputs if os.path.basename(o) == o]
+                missing = [o for o in step.outputs
+                           if not os.path.exists(os.path.join(dir.path, o) if o in local else self.path(o))]
+                if missing:
+                    raise IOError('Step {} does not produce declared outputs: {}'.format(step.name, missing))
+                for o in local:
+                    os.replace(os.path.join(dir.path, o), self.path(o))
+            finally:
+                als.close()
+                dp.close()
+    def _link_files(self, dir, exclude):
+        # files of pipeline dir linked into step dir, except outputs of step which can be written in place
+        for name in os.listdir(self.dir.path):
+            if name in exclude or name.startswith((self.step_dir_prefix, self.state_file)):
+                continue
+            path = self.path(name)
+            source = os.readlink(path) if os.path.islink(path) else path
+            os.symlink(source if os.path.isabs(source) else path, os.path.join(dir.path, name))
+
+
+def _link(source, dest):
+    # symlink created only if not already there
+    source = Runner.expand_path(source)
+    try:
+        if os.readlink(dest) == source:
+            return
+        os.remove(dest)
+    except OSError:
+        pass
+    os.symlink(source, dest)
+
+
+def _file_hash(path):
+    sha = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                sha.update(block)
+    except (IOError, OSError):
+        return 'missing'
+    return sha.hexdigest()
@@ -0,0 +1,35 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from .session_test import fake_daophot, fake_daophot_log
+
+
+def test_map_frames_isolates_failures():
+    images = ['/nonexisting/img{}.fits'.format(i) for i in range(5)]
+
+    def recipe(dp, als):
+        if dp.image.endswith('img3.fits'):
+            raise ValueError('bad frame')
+        return dp.SKy().sky, fake_daophot_log(dp), als.image
+
+    frames = list(fake_daophot().map(images, recipe, parallel=3))
+    assert sorted(f.image for f in frames) == images
+    failed = [f for f in frames if not f.success]
+    assert len(failed) == 1 and failed[0].image.endswith('img3.fits')
+    assert isinstance(failed[0].error, ValueError)
+    for f in frames:
+        if f.success:
+            sky, log, als_image = f.result
+            assert sky == 102.451
+            assert log == ['start', f.image.split('/')[-1]]
+            assert als_image == f.image
+        assert f.daophot is None
+
+
+def test_map_frames_ordered():
+    images = ['/nonexisting/img{}.fits'.format(i) for i in range(4)]
+    frames = list(fake_daophot().map(images, lambda dp, als: dp.SKy().pixels, ordered=True, keep_runners=True))
+    assert [f.image for f in frames] == images
+    assert all(f.result == 10215 for f in frames)
+    assert len(set(f.daophot.dir.path for f in frames)) == 4
@@ -0,0 +1,71 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import time
+from astwro.exttools import ResultCache
+from astwro.utils import tmpdir
+from .session_test import fake_daophot, fake_daophot_log
+
+
+def test_cache_hit():
+    d = tmpdir()
+    cache = ResultCache(d.path, max_size=2**20)
+    d1 = fake_daophot(image='/nonexisting/img.fits')
+    d1.cache = cache
+    s1 = d1.SKy()
+    assert s1.sky == 102.451
+    d2 = fake_daophot(image='/nonexisting/img.fits')
+    d2.cache = cache
+    s2 = d2.SKy()
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert s2.sky == 102.451 and s2.pixels == 10215
+    assert fake_daophot_log(d2) == ['start', 'img.fits']  # files restored
+    d3 = fake_daophot(image='/nonexisting/img2.fits')
+    d3.cache = cache
+    d3.SKy()
+    assert cache.hits == 1
+    assert fake_daophot_log(d3) == ['start', 'img2.fits']
+
+
+def test_cache_key_inputs_only():
+    d = tmpdir()
+    cache = ResultCache(d.path, max_size=2**20)
+    d1 = fake_daophot(image='/nonexisting/img.fits')
+    d1.cache = cache
+    d1.SKy()
+    d2 = fake_daophot(image='/nonexisting/img.fits')
+    d2.cache = cache
+    for name in ['old.als', 'sl_0123456789abcdef.coo']:  # left by previous runs
+        with open(d2.file_from_runner_dir(name), 'w') as f:
+            f.write('history')
+    d2.SKy()
+    assert cache.hits == 1
+    d3 = fake_daophot(image='/nonexisting/img.fits')
+    d3.cache = cache
+    d3.rm_from_runner_dir('daophot.opt')
+    with open(d3.file_from_runner_dir('daophot.opt'), 'w') as f:
+        f.write('FI=3\n')
+    d3.SKy()
+    assert cache.hits == 1
+
+
+def test_cache_lru_eviction():
+    d = tmpdir()
+    cache = ResultCache(os.path.join(d.path, 'cache'), max_size=2500)
+    work = os.path.join(d.path, 'work')
+    os.mkdir(work)
+    for i, key in enumerate(['a1', 'b2', 'c3']):
+        snapshot = cache.snapshot(work)
+        with open(os.path.join(work, 'out'), 'wb') as f:
+            f.write(b'x' * 1000)
+        cache.store(key, work, snapshot, b'', b'')
+        os.remove(os.path.join(work, 'out'))
+        time.sleep(0.01)
+        if i == 1:
+            cache.restore('a1', work)  # a1 recently used
+    assert cache.restore('b2', work) is None
+    assert cache.restore('a1', work) is not None
+    assert cache.restore('c3', work) is not None
+    assert cache.size <= 2500
@@ -0,0 +1,80 @@
+# coding=utf-8
+import asyncio
+from .session_test import fake_daophot, fake_daophot_log
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_acommand():
+    async def sky(image):
+        d = fake_daophot(image=image)
+        r = await d.aSKy()
+        return d, r
+
+    async def both():
+        return await asyncio.gather(sky('/nonexisting/img.fits'), sky('/nonexisting/img2.fits'))
+    (d1, r1), (d2, r2) = run(both())
+    assert r1.sky == r2.sky == 102.451
+    assert fake_daophot_log(d1) == ['start', 'img.fits']
+    assert fake_daophot_log(d2) == ['start', 'img2.fits']
+
+
+def test_arun_batch():
+    async def batch(d):
+        d.SKy()
+        await d.arun(wait=False)
+        assert d.running
+        await d.await_for_results()
+        await d.aSKy()  # batch mode: just enqueued
+        assert d.is_ready_to_run()
+        await d.arun()
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    run(batch(d))
+    assert d.SKy_result.pixels == 10215
+    assert fake_daophot_log(d) == ['start', 'img.fits'] * 2
+
+
+def test_sync_wait_for_arun():
+    async def start(d):
+        d.SKy()
+        await d.arun(wait=False)
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start(d))
+    try:
+        d.wait_for_results()
+        assert False, 'RunnerException expected'
+    except d.RunnerException:
+        pass
+    loop.run_until_complete(d.await_for_results())
+    loop.close()
+    assert d.SKy_result.skydev == 4.283
+
+
+def test_arun_timeout():
+    async def hung(d):
+        d.SKy()
+        d._insert_processing_step('SLEEP 30\n')
+        try:
+            await d.arun()
+            assert False, 'RunnerTimeoutError expected'
+        except d.RunnerTimeoutError:
+            pass
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d.timeout = 0.5
+    run(hung(d))
+    assert not d.running
+
+
+def test_arun_unbuffered_env():
+    d = fake_daophot(batch=True)
+    d.arguments = ['-c', 'import os; print(os.environ.get("GFORTRAN_UNBUFFERED_PRECONNECTED"))']
+    d.SKy()
+    run(d.arun())
+    assert d.output.strip() == 'y'
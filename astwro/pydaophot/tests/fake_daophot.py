@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Minimal imitation of interactive daophot dialogue (OPTION, ATTACH, SKY, EXIT) for runners tests
+
+Additional command SLEEP n simulates long computation.
+
+Every start and ATTACH is recorded in `fake_daophot.log` of working directory.
+"""
+from __future__ import absolute_import, division, print_function
+import sys
+import time
+
+OPTIONS = (
+    ' READ NOISE (ADU; 1 frame) =    2.55    GAIN (e-/ADU; 1 frame) =    1.00\n'
+    ' LOW GOOD DATUM (in sigmas) =    7.00   HIGH GOOD DATUM (in ADU) =32766.50\n'
+    ' FWHM OF OBJECT =    3.00   THRESHOLD (in sigmas) =    4.00\n'
+    ' WATCH PROGRESS =   -2.00   PSF RADIUS =   11.00\n'
+)
+
+SKY = (
+    '\n Sky mode and standard deviation =  102.451    4.283\n\n'
+    '  Clipped mean and median =  102.733  102.587\n'
+    '  Number of pixels used (after clip) = 10,215\n'
+)
+
+
+def log(msg):
+    with open('fake_daophot.log', 'a') as f:
+        f.write(msg + '\n')
+
+
+def out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def ask(prompt):
+    out(prompt)
+    line = sys.stdin.readline()
+    if not line:
+        sys.exit(0)
+    return line.strip()
+
+
+def main():
+    log('start')
+    out(OPTIONS)
+    while True:
+        command = ask('\n Command: ')
+        keyword = command[:2].upper()
+        if keyword == '':
+            continue
+        elif keyword == 'AT':
+            name = command.split()[1] if len(command.split()) > 1 else ask('Enter file name: ')
+            log('attach ' + name)
+            out('\n\n    Picture size:   1250  1150\n')
+        elif keyword == 'OP':
+            ask('File with parameters (default KEYBOARD INPUT): ')
+            while ask('OPT> '):
+                pass
+            out('\n\n' + OPTIONS)
+        elif keyword == 'SK':
+            out(SKY)
+        elif keyword == 'SL':
+            time.sleep(float(command.split()[1]))
+        elif keyword == 'EX':
+            sys.exit(0)
+        else:
+            out(' ERROR: unrecognized command\n')
+
+
+if __name__ == '__main__':
+    main()
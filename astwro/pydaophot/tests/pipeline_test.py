@@ -0,0 +1,144 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import time
+import threading
+from astwro.pydaophot import Pipeline
+from astwro.utils import tmpdir
+
+
+class FakePipeline(Pipeline):
+    def _runners(self, dir):
+        dp, als = super(FakePipeline, self)._runners(dir)
+        dp.executable = sys.executable
+        dp.arguments = [os.path.join(os.path.dirname(__file__), 'fake_daophot.py')]
+        return dp, als
+
+
+def _write(dp, name, text):
+    with open(os.path.join(dp.dir.path, name), 'w') as f:
+        f.write(text)
+
+
+def _read(dp, name):
+    with open(os.path.join(dp.dir.path, name)) as f:
+        return f.read()
+
+
+def _bialkow_like(dir, log):
+    p = FakePipeline(dir, image='/nonexisting/img.fits')
+
+    @p.step(inputs=[], outputs=['i.ap'], threshold=4)
+    def phot(dp, als, threshold):
+        log.append('phot')
+        _write(dp, 'i.ap', 'sky={} th={}'.format(dp.SKy().sky, threshold))
+
+    @p.step(inputs=['i.ap'], outputs=['i.psf'])
+    def psf(dp, als):
+        log.append('psf')
+        _write(dp, 'i.psf', 'psf of ' + _read(dp, 'i.ap'))
+
+    @p.step(inputs=['i.psf'], outputs=['i.als'])
+    def allstar(dp, als):
+        log.append('allstar')
+        _write(dp, 'i.als', 'als of ' + _read(dp, 'i.psf'))
+
+    @p.step(inputs=['i.ap'], outputs=['i.lst'], name='pick')
+    def pick_stars(dp, als, n=10):
+        log.append('pick')
+        _write(dp, 'i.lst', 'stars {}'.format(n))
+
+    return p
+
+
+def test_pipeline_incremental():
+    d = tmpdir()
+    log = []
+    p = _bialkow_like(d.path, log)
+    executed = p.run()
+    assert sorted(executed) == ['allstar', 'phot', 'pick', 'psf']
+    assert executed.index('phot') < executed.index('psf') < executed.index('allstar')
+    assert p.run() == []
+    # new pipeline object on the same directory (next session)
+    p = _bialkow_like(d.path, log)
+    assert p.run() == []
+    # option of leaf step
+    p.set_options('pick', n=20)
+    assert p.run() == ['pick']
+    # option of root step changing its output
+    p.set_options('phot', threshold=5)
+    assert sorted(p.run()) == ['allstar', 'phot', 'pick', 'psf']
+    # missing output
+    os.remove(p.path('i.psf'))
+    assert p.run() == ['psf']  # same content of i.psf, allstar up to date
+    with open(p.path('i.als')) as f:
+        assert f.read() == 'als of psf of sky=102.451 th=5'
+    assert p.run(targets=['psf'], force=True) == ['phot', 'psf']
+
+
+def test_pipeline_parallel_branches():
+    p = FakePipeline(image='/nonexisting/img.fits')
+    barrier = threading.Barrier(2, timeout=10)
+
+    def branch(dp, als, out):
+        barrier.wait()  # both branches must run simultaneously
+        _write(dp, out, out)
+
+    p.add_step('neda', branch, inputs=[], outputs=['i.nei'], out='i.nei')
+    p.add_step('final', branch, inputs=[], outputs=['i.als'], out='i.als')
+    assert sorted(p.run(parallel=2)) == ['final', 'neda']
+
+
+def test_pipeline_links_once():
+    p = FakePipeline(image='/nonexisting/img.fits')
+    links = [p.image_file, p.path('daophot.opt'), p.path('allstar.opt')]
+    before = [os.lstat(l).st_ino for l in links]
+    p.add_step('a', lambda dp, als: _write(dp, 'a.out', str(dp.SKy().sky)), inputs=[], outputs=['a.out'])
+    p.add_step('b', lambda dp, als: _write(dp, 'b.out', ''), inputs=[], outputs=['b.out'])
+    assert sorted(p.run(parallel=2)) == ['a', 'b']
+    assert [os.lstat(l).st_ino for l in links] == before  # runners of steps did not relink
+    assert os.readlink(p.image_file) == '/nonexisting/img.fits'
+
+
+def test_pipeline_parallel_psf():
+    p = FakePipeline(image='/nonexisting/img.fits')
+    barrier = threading.Barrier(2, timeout=10)
+
+    def psf(dp, als, label):
+        dp.batch_mode = True
+        dp.PSf(photometry='i.ap', psf_stars='i.lst', psf_file=label + '.psf')  # removes i.err
+        _write(dp, 'i.err', label)  # as written by daophot
+        barrier.wait()  # both steps wrote their i.err
+        _write(dp, label + '.psf', _read(dp, 'i.err'))
+
+    p.add_step('psf1', psf, inputs=[], outputs=['a.psf'], label='a')
+    p.add_step('psf2', psf, inputs=[], outputs=['b.psf'], label='b')
+    assert sorted(p.run(parallel=2)) == ['psf1', 'psf2']
+    assert _read(p, 'a.psf') == 'a' and _read(p, 'b.psf') == 'b'
+    assert not os.path.exists(p.path('i.err'))  # undeclared side file stays in step dir
+    assert [f for f in os.listdir(p.dir.path) if f.startswith(p.step_dir_prefix)] == []
+
+
+def test_pipeline_errors():
+    p = FakePipeline()
+    p.add_step('a', lambda dp, als: None, inputs=['b.out'], outputs=['a.out'])
+    try:
+        p.run()
+        assert False
+    except ValueError:  # missing source input
+        pass
+    _write(p, 'b.out', '')
+    try:
+        p.run()
+        assert False
+    except IOError:  # declared output not produced
+        pass
+    p.add_step('b', lambda dp, als: None, inputs=['a.out'], outputs=['b.out'])
+    try:
+        p.run()
+        assert False
+    except ValueError:  # cycle
+        pass
@@ -0,0 +1,28 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from astwro.exttools import ProfileReport
+from .session_test import fake_daophot
+
+
+def test_run_profile():
+    report = ProfileReport()
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d.profile_report = report
+    d.SKy()
+    d._insert_processing_step('SLEEP 0.3\n')
+    d.SKy()
+    d.run()
+    p = d.profile
+    assert p.wall_time >= 0.3
+    assert p.user_time is not None and p.max_rss > 0
+    assert p.bytes_in == len(d.input)
+    assert p.bytes_out == len(d.output)
+    # daophot start options, ATTACH, OPTION (default options), 2 x SKY
+    assert [s.name for s in p.steps] == ['DPOP_OPtion', 'DPOP_ATtach', 'DPOP_OPtion', 'DpOp_SKy', 'DpOp_SKy']
+    assert d.SKy_result.profile.wall_time >= 0.3  # the second SKY waits for SLEEP
+    assert d.SKy_result.profile.lines > 0
+    summary = report.summary()
+    assert summary.loc[('Daophot', 'DpOp_SKy'), 'count'] == 2
+    assert summary.loc[('Daophot', '(process)'), 'count'] == 1
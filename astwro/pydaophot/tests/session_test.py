@@ -0,0 +1,62 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+from astwro.pydaophot import Daophot
+
+
+def fake_daophot(**kwargs):
+    d = Daophot(**kwargs)
+    d.executable = sys.executable
+    d.arguments = [os.path.join(os.path.dirname(__file__), 'fake_daophot.py')]
+    return d
+
+
+def fake_daophot_log(d):
+    # local names of linked files are prefixed by path hash, cut it
+    with open(d.file_from_runner_dir('fake_daophot.log')) as f:
+        return [l.split('_', 1)[-1] if l.startswith('attach') else l for l in f.read().splitlines()]
+
+
+def test_session_keeps_process_and_image():
+    d = fake_daophot(image='/nonexisting/img.fits', preserve_process=True)
+    s1 = d.SKy()
+    assert d.session_alive
+    s2 = d.SKy()
+    assert s1.sky == s2.sky == 102.451
+    assert s2.pixels == 10215
+    assert fake_daophot_log(d) == ['start', 'img.fits']
+    d.close()
+
+
+def test_session_reattach_on_image_change():
+    d = fake_daophot(image='/nonexisting/img.fits', preserve_process=True)
+    d.SKy()
+    d.image = '/nonexisting/img2.fits'
+    d.SKy()
+    d.SKy()
+    assert fake_daophot_log(d) == ['start', 'img.fits', 'img2.fits']
+    d.close()
+
+
+def test_session_batch_async():
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True, preserve_process=True)
+    d.SKy()
+    d.run(wait=False)
+    d.wait_for_results()
+    assert d.SKy_result.skydev == 4.283
+    d.SKy()
+    d.run()
+    assert d.OPtion_result.get_option('FWHM') == 3.0
+    assert fake_daophot_log(d) == ['start', 'img.fits']
+    d.close()
+
+
+def test_no_session():
+    d = fake_daophot(image='/nonexisting/img.fits')
+    d.SKy()
+    d.SKy()
+    assert not d.session_alive
+    assert fake_daophot_log(d) == ['start', 'img.fits'] * 2
@@ -0,0 +1,85 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import astwro.starlist as sl
+import astwro.sampledata as data
+from astwro.pydaophot import Daophot, Allstar
+from astwro.exttools import ResultCache
+from astwro.utils import tmpdir
+
+
+def test_starlist_written_once():
+    dp = Daophot()
+    stars = sl.read_dao_file(data.ap_file())
+    f1, a1 = dp._prepare_input_file(stars)
+    mtime = os.stat(a1).st_mtime_ns
+    f2, a2 = dp._prepare_input_file(stars.copy())
+    assert f1 == f2
+    assert os.stat(a2).st_mtime_ns == mtime
+    assert sl.read_dao_file(a1).equals(stars)
+    f3, _ = dp._prepare_input_file(stars[:10])
+    assert f3 != f1
+    # written again if removed
+    dp.rm_from_runner_dir(f1)
+    assert dp._prepare_input_file(stars)[0] == f1
+    assert dp.exists_in_runner_dir(f1)
+    # reused by clone
+    clone = dp.clone()
+    assert clone._prepare_input_file(stars)[0] == f1
+    dp.close()
+    clone.close()
+
+
+def test_starlist_files_collected():
+    dp = Daophot()
+    dp.starlist_files_max = 2
+    stars = sl.read_dao_file(data.ap_file())
+    files = []
+    for n in range(4):
+        dp._reset()  # new commands sequence
+        files.append(dp._prepare_input_file(stars[:n + 1])[0])
+    assert [dp.exists_in_runner_dir(f) for f in files] == [False, False, True, True]
+    # files used by queued commands are kept
+    dp._reset()
+    for n in range(4):
+        dp._prepare_input_file(stars[:n + 5])
+    assert len(dp._starlist_files.files) == 4
+    dp.close()
+
+
+def test_starlist_files_shared_dir():
+    dp = Daophot()
+    als = Allstar(dir=dp.dir)
+    stars = sl.read_dao_file(data.ap_file())
+    f, _ = dp._prepare_input_file(stars)  # queued by dp
+    als.starlist_files_max = 0
+    als._prepare_input_file(stars[:10])
+    als._reset()
+    als._prepare_input_file(stars[:20])  # collects files not used by any runner of the dir
+    assert dp.exists_in_runner_dir(f)
+    assert len(als._starlist_files.files) == 2
+    dp._reset()
+    als._reset()
+    als._prepare_input_file(stars[:30])
+    assert not dp.exists_in_runner_dir(f)
+    # written under temporary name, replaced
+    assert [n for n in os.listdir(dp.dir.path) if n.endswith('.ap')] == [als._prepare_input_file(stars[:30])[0]]
+    als.close()
+    dp.close()
+
+
+def test_stale_starlist_files_not_in_cache_key():
+    cache = ResultCache(tmpdir().path)
+    stars = sl.read_dao_file(data.ap_file())
+    keys = []
+    for history in [[], [stars[:10], stars[:20]]]:
+        dp = Daophot()
+        for h in history:  # files left by previous command sequences
+            dp._prepare_input_file(h)
+            dp._reset()
+        f, _ = dp._prepare_input_file(stars)
+        keys.append(cache.key('daophot', [], 'SKY\n' + f, dp.dir.path, dp._cache_inputs()))
+        dp.close()
+    assert keys[0] == keys[1]
@@ -0,0 +1,40 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import time
+from .session_test import fake_daophot
+
+
+def test_result_ready_before_process_ends():
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d.SKy()
+    d._insert_processing_step('SLEEP 3\n')
+    start = time.time()
+    d.run(wait=False)
+    assert d.SKy_result.sky == 102.451
+    assert time.time() - start < 2.5
+    assert d.running
+    d.wait_for_results()
+    assert 'Sky mode' in d.output
+
+
+def test_output_max_lines():
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d.output_max_lines = 2
+    d.SKy()
+    d.SKy()
+    d.run()
+    assert d.SKy_result.pixels == 10215
+    assert len(d.output.splitlines()) == 2
+
+
+def test_input_over_pipe_buffer():
+    # stdin larger than pipe buffer, while echoed prompts fill stdout pipe
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d._insert_processing_step('SKY\n' * 20000)
+    d.SKy()
+    assert len(d._commands) > 2 ** 16
+    d.run()
+    assert d.SKy_result.sky == 102.451
+    assert d.output.count('Sky mode') == 20001
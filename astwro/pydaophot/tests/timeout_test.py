@@ -0,0 +1,60 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import time
+from astwro.exttools import RunnerPool
+from .session_test import fake_daophot, fake_daophot_log
+
+
+def _hung_run(d):
+    d.SKy()
+    d._insert_processing_step('SLEEP 30\n')
+    d.SKy()
+    start = time.time()
+    try:
+        d.run()
+        assert False, 'RunnerTimeoutError expected'
+    except d.RunnerTimeoutError as e:
+        assert 'Sky mode' in e.stdout
+    assert time.time() - start < 5
+
+
+def test_command_timeout():
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True)
+    d.command_timeout = 0.5
+    _hung_run(d)
+    assert not d.running and not d.is_ready_to_run()
+    d.SKy()
+    d.run()
+    assert d.SKy_result.sky == 102.451
+
+
+def test_session_run_timeout():
+    d = fake_daophot(image='/nonexisting/img.fits', batch=True, preserve_process=True)
+    d.timeout = 1
+    _hung_run(d)
+    assert not d.session_alive
+    d.SKy()
+    d.run()
+    assert d.SKy_result.sky == 102.451
+    assert fake_daophot_log(d) == ['start', 'img.fits'] * 2
+    d.close()
+
+
+def test_pool_retries_on_timeout():
+    calls = []
+
+    def sky(d):
+        calls.append(d.dir.path)
+        if len(calls) == 1:
+            d.command_timeout = 0.5
+            d._insert_processing_step('SLEEP 30\n')
+        d.SKy()
+        d.run()
+        return d.SKy_result.sky
+
+    pool = RunnerPool(fake_daophot(image='/nonexisting/img.fits', batch=True), size=1, retries=1)
+    assert pool.submit(sky).result() == 102.451
+    assert len(calls) == 2 and calls[0] != calls[1]
+    pool.close()
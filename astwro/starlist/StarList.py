@@ -1,3 +1,4 @@
+import re
 import pandas as pd
 import numpy as np
 from astropy.table import Table
@@ -15,6 +16,10 @@ class StarList(pd.DataFrame):
     _DAO_hdr = None
     _DAO_type = None
 
+    _shared = None  # SharedStarList which memory is viewed by this instance
+
+    compact_default = True  #: whether `read_dao_file` and `as_starlist` call :meth:`compact` by default
+
     @staticmethod
     def new():
         """Returns empty StarList instance with columns id,x,y"""
@@ -24,6 +29,29 @@ class StarList(pd.DataFrame):
         y = pd.Series(dtype='float64')
         return StarList({'id': id, 'x': x, 'y': y}, index=idx)
 
+    def __getitem__(self, key):
+        if isinstance(key, str) and self._lazy_column(key):
+            return self._sexagesimal(key)
+        return super(StarList, self).__getitem__(key)
+
+    def __getattr__(self, name):
+        if name in _lazy_columns and self._lazy_column(name):
+            return self._sexagesimal(name)
+        return super(StarList, self).__getattr__(name)
+
+    def _lazy_column(self, name):
+        # sexagesimal coordinates not stored by compact StarList, generated from ra_deg, dec_deg
+        return name in _lazy_columns and name not in self.columns \
+            and 'ra_deg' in self.columns and 'dec_deg' in self.columns
+
+    def _sexagesimal(self, name):
+        sky = SkyCoord(self['ra_deg'].values, self['dec_deg'].values, unit=u.deg)
+        if name == 'ra':
+            strings = sky.ra.to_string(sep=':', unit=u.hourangle, pad=True)
+        else:
+            strings = sky.dec.to_string(sep=':', unit=u.deg, pad=True, alwayssign=True)
+        return pd.Series(strings, index=self.index, name=name)
+
     @property
     def _constructor(self):
 
@@ -55,6 +83,44 @@ class StarList(pd.DataFrame):
         self.DAO_type = src.DAO_type
         self.DAO_hdr = src.DAO_hdr
 
+    def compact(self, inplace=False):
+        """
+        Reduces memory used by StarList:
+            - float columns of DAO formats are stored as float32 if values have no more decimals than DAO format
+              and are small enough to be written into DAO files with the same digits,
+            - `id` column as int32,
+            - object columns with few distinct values (e.g. flags) as categorical,
+            - sexagesimal `ra`, `dec` strings are dropped if they can be generated from `ra_deg`, `dec_deg`,
+              and generated when accessed.
+
+        :param bool inplace: modify this StarList instead of returning compacted copy
+        :rtype: StarList
+        """
+        s = self if inplace else self.copy()
+        ext = s.DAO_type.extension if s.DAO_type is not None else None
+        dao_columns = s.DAO_type.columns if s.DAO_type is not None else _dao_columns
+        for col in s.columns:
+            values = s[col]
+            kind = values.dtype.kind
+            if col == 'id' and kind in 'iu' and len(values) \
+                    and np.iinfo(np.int32).min <= values.min() and values.max() <= np.iinfo(np.int32).max:
+                s[col] = values.astype(np.int32)
+            elif kind == 'f' and values.dtype.itemsize > 4 and col in dao_columns:
+                # float32 relative precision is 2**-24, enough to restore all decimals of values < 2**23 / 10**decimals
+                decimals = _column_decimals(ext, col)
+                v = values.values
+                if decimals is not None and np.nanmax(np.abs(v), initial=0) < 2**23 * 10**-decimals \
+                        and np.array_equal(np.round(v, decimals), v, equal_nan=True):
+                    s[col] = values.astype(np.float32)
+            elif kind == 'O' and col not in _lazy_columns and len(values):
+                distinct = values.nunique(dropna=True)
+                if distinct <= 256 and distinct * 2 < len(values):
+                    s[col] = values.astype('category')
+        if all(c in s.columns for c in _lazy_columns + ('ra_deg', 'dec_deg')) \
+                and all(s._sexagesimal(c).equals(s[c]) for c in _lazy_columns):
+            s.drop(columns=list(_lazy_columns), inplace=True)
+        return s
+
     def stars_number(self):
         """returns number of stars in list"""
         return self.shape[0]
@@ -78,6 +144,88 @@ class StarList(pd.DataFrame):
         self.index = self['id']
 
 
+    def save(self, file):
+        """
+        Saves StarList with metadata (DAO type, DAO hdr) into binary numpy `.npz` file, much faster to
+        load than text formats, see :meth:`load`
+
+        :param file: filename or writable binary stream
+        """
+        from .npzfiles import write_npz_file
+        write_npz_file(self, file)
+
+    @classmethod
+    def load(cls, file, columns=None):
+        """
+        Loads StarList saved by :meth:`save`
+
+        :param file: filename or binary stream
+        :param columns: list of columns to load, default: all columns
+        :rtype: StarList
+        """
+        from .npzfiles import read_npz_file
+        return read_npz_file(file, columns=columns)
+
+    def kdtree(self, sky=False):
+        """
+        KD-tree of `x`, `y` (or of `ra_deg`, `dec_deg` on unit sphere if `sky`), built lazily, cached
+        and rebuilt when coordinates change, see :mod:`astwro.starlist.spatial`. Pass it as `tree`
+        to query methods to skip the check for changes on many queries
+
+        :rtype: scipy.spatial.cKDTree
+        """
+        from .spatial import kdtree
+        return kdtree(self, sky=sky)
+
+    def neighbours(self, radius, sky=False, tree=None):
+        """
+        Pairs of stars closer than radius (pixels, or angle if `sky`)
+
+        :return: DataFrame with columns `id`, `neighbour_id`, `distance`, every pair in both directions
+        """
+        from .spatial import neighbours
+        return neighbours(self, radius, sky=sky, tree=tree)
+
+    def isolated(self, radius, dmag=None, sky=False, tree=None):
+        """
+        Mask of stars without neighbours closer than radius (pixels, or angle if `sky`),
+        neighbours fainter than `mag + dmag` are ignored if `dmag` is provided
+
+        :rtype: pd.Series
+        """
+        from .spatial import isolated
+        return isolated(self, radius, dmag=dmag, sky=sky, tree=tree)
+
+    def nearest(self, other, max_distance=None, sky=False, tree=None):
+        """
+        Nearest star of `other` StarList for every star, `tree` is prebuilt `other.kdtree()`
+
+        :return: DataFrame indexed as this StarList, with columns `nearest_id` (-1 if farther than
+                 `max_distance`) and `distance`
+        """
+        from .spatial import nearest
+        return nearest(self, other, max_distance=max_distance, sky=sky, tree=tree)
+
+    def within(self, box, tree=None):
+        """
+        Stars inside rectangle `box` = (xmin, xmax, ymin, ymax)
+
+        :rtype: StarList
+        """
+        from .spatial import within
+        return within(self, box, tree=tree)
+
+    def share(self, file=None):
+        """
+        Publishes StarList in shared memory for worker processes, see :class:`SharedStarList`
+
+        :param str file: use memory-mapped file instead of `multiprocessing.shared_memory`
+        :return: picklable handle, workers get read-only StarList by its `attach()`
+        :rtype: SharedStarList
+        """
+        from .shared import SharedStarList
+        return SharedStarList(self, file=file)
+
     def to_table(self):
         """
         Return a :class:`astropy.table.Table` instance
@@ -177,3 +325,14 @@ class StarList(pd.DataFrame):
         existing = self.columns.values.tolist()
         columns = [c for c in columns if c in existing]
         return self[columns].to_numpy()
+
+
+_lazy_columns = ('ra', 'dec')
+_dao_columns = set(c for t in DAO.file_types.values() for c in t.columns)
+
+
+def _column_decimals(ext, column):
+    # number of decimal digits of column in DAO file format, None for non-fixed point formats
+    coltype = DAO.columns.get((ext, column)) or DAO.columns.get(column) or DAO.columns['_default']
+    match = re.search(r'\.(\d+)f', coltype.format)
+    return int(match.group(1)) if match else None
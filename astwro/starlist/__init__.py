@@ -1,4 +1,6 @@
 from .daofiles import *
 from .fileformats import *
 from .ds9 import *
+from .npzfiles import *
+from .shared import SharedStarList
 from ._version import __version__, __version_info__
@@ -1,9 +1,20 @@
 from .StarList import StarList
 from .file_helpers import *
+from .file_helpers import compact_starlist
 import pandas as pd
+import re
+import numpy as np
+from io import StringIO
+from collections import OrderedDict
+import hashlib
+from itertools import chain, islice
 from .fileformats import *
+from .npzfiles import read_npz_file, write_npz_file
+from astwro.config.logger import logger as module_logger
 
 
+logger = module_logger.getChild('starlist')
+
 DAO_file_firstline = ' NL    NX    NY  LOWBAD HIGHBAD  THRESH     AP1  PH/ADU  RNOISE    FRAD'
 
 def convert_dao_type(starlist, new_daotype, update_daotype=True):
@@ -24,7 +35,7 @@ def convert_dao_type(starlist, new_daotype, update_daotype=True):
     return True
 
 
-def read_dao_file(file, dao_type = None):
+def read_dao_file(file, dao_type = None, columns=None, sidecar=None, compact=None):
     """
     Construct StarList from daophot output file.
     The header lines in file may be missing.
@@ -38,12 +49,92 @@ def read_dao_file(file, dao_type = None):
                     - DAO.ALS_FILE
                 If missing filename extension will be used to determine file type
                 if file is provided as filename
+    :param columns: list of columns to read, e.g. ['x', 'y', 'mag', 'mag_err'], 'id' is always read,
+                    default: all columns
+    :param sidecar: if provided, parsed table is kept in binary sidecar file and loaded instead of parsing
+                    until file changes (size or modification time); True - sidecar in the same directory
+                    (`file.npz`), str - directory for sidecar files. Used only if file is provided as filename
+    :param compact: whether to reduce memory used by StarList, see `StarList.compact`,
+                    default: `StarList.compact_default`
     :return: StarList instance
     """
-    ret = _parse_file(file, dao_type)
+    if sidecar and isinstance(file, str):
+        ret = _read_with_sidecar(file, dao_type, columns, sidecar, compact)
+    else:
+        ret = _parse_file(file, dao_type, columns)
+        compact_starlist(ret, compact)
     return ret
 
 
+def sidecar_file(file, sidecar=True):
+    """
+    Returns filename of binary sidecar for DAO file, see `read_dao_file`
+    :param str file: DAO file
+    :param sidecar: True - sidecar in the same directory, str - directory for sidecar files
+    """
+    path = os.path.abspath(os.path.expanduser(file))
+    if sidecar is True:
+        return path + '.npz'
+    return os.path.join(os.path.expanduser(sidecar), hashlib.sha1(path.encode()).hexdigest() + '.npz')
+
+
+def _read_with_sidecar(file, dao_type, columns, sidecar, compact):
+    path = os.path.abspath(os.path.expanduser(file))
+    stat = os.stat(path)
+    key = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+           'dao_type': dao_type.extension if dao_type is not None else None}
+    side = sidecar_file(path, sidecar)
+    try:
+        ret, stored_key = read_npz_file(side, columns=columns, with_meta=True)
+        if stored_key == key:
+            return compact_starlist(ret, compact)
+    except (IOError, OSError, ValueError, KeyError):  # no sidecar or damaged
+        pass
+    ret = _parse_file(path, dao_type)
+    try:  # sidecar stores full precision list, compacted after loading
+        if not os.path.isdir(os.path.dirname(side)):
+            os.makedirs(os.path.dirname(side))
+        tmp = '{}.{}.tmp'.format(side, os.getpid())
+        write_npz_file(ret, tmp, extra_meta=key)
+        os.rename(tmp, side)
+    except (IOError, OSError) as e:  # e.g. read only directory
+        logger.debug('Can not write sidecar file %s: %s', side, e)
+    if columns is not None:
+        ret = ret[[c for c in ret.columns if c == 'id' or c in columns]]
+    return compact_starlist(ret, compact)
+
+
+def iter_dao_file(file, chunksize=100000, dao_type=None, columns=None, compact=None):
+    """
+    Reads daophot file in chunks, for files too large to be loaded at once.
+    :param file: open stream or filename, if stream dao_type must be specified
+    :param int chunksize: number of stars in chunk
+    :param dao_type: file format, see `read_dao_file`
+    :param columns: list of columns to read, 'id' is always read, default: all columns
+    :param compact: whether to reduce memory used by chunks, see `read_dao_file`
+    :return: iterator of StarList instances with DAO_hdr and DAO_type set
+    """
+    dao_type = _dao_type_of_file(file, dao_type)
+    f, to_close = get_stream(file, 'r')
+    try:
+        hdr, stolen_chars = read_dao_header(f)
+        lines = (l for l in chain([(stolen_chars or '') + f.readline()], f) if l.strip())
+        chunk_lines = chunksize * _lines_per_star(hdr, dao_type)
+        layout = None
+        while True:
+            text = ''.join(islice(lines, chunk_lines))
+            if not text:
+                break
+            if layout is None:
+                layout = _table_layout(text, hdr, dao_type)
+            chunk = _parse_rows(text, *layout, columns=columns)
+            chunk.DAO_hdr = hdr
+            compact_starlist(chunk, compact)
+            yield chunk
+    finally:
+        close_files(to_close)
+
+
 def write_dao_file(starlist, file, dao_type=None, with_header=None):
     """
     Write StarList object into daophot  file.
@@ -70,6 +161,34 @@ def write_dao_file(starlist, file, dao_type=None, with_header=None):
             raise Exception('Can not convert columns {} into {} '.format(starlist.columns, dao_type.columns))
     _write_file(starlist, file, dao_type, with_header=with_header)
 
+def write_dao_chunks(chunks, file, dao_type=None, with_header=None):
+    """
+    Writes StarList chunks (e.g. from `iter_dao_file`) one after another into single daophot file,
+    header is taken from the first chunk.
+    :param chunks: iterable of StarList instances
+    :param file: writable stream or filename, if stream dao_type must be specified
+    :param dao_type: file format, see `write_dao_file`, default: dao type of the first chunk
+    :param with_header: True, False or None. If None header will be written if not None in the first chunk
+    :return: number of written stars
+    """
+    f, to_close = get_stream(file, 'w')
+    stars = 0
+    try:
+        for n, starlist in enumerate(chunks):
+            if dao_type is None:
+                if starlist.DAO_type is None:
+                    raise Exception('Can not determine file format')
+                dao_type = starlist.DAO_type
+            elif dao_type != starlist.DAO_type:
+                if not convert_dao_type(starlist, dao_type, update_daotype=False):
+                    raise Exception('Can not convert columns {} into {} '.format(starlist.columns, dao_type.columns))
+            _write_file(starlist, f, dao_type, with_header=with_header if n == 0 else False)
+            stars += starlist.stars_number()
+    finally:
+        close_files(to_close)
+    return stars
+
+
 def _get_col_type(file_ext, column):
     # type: (str, str) -> DAO.CType
     coltype = DAO.columns.get((file_ext, column))  # lookup for (filetype,col)
@@ -134,26 +253,60 @@ def write_dao_header(hdr, stream, line_prefix=''):
 def _write_table(starlist, file, dao_type):
     # preapre columns (from daotype in order but only existing in starlist)
     pd.options.mode.chained_assignment = None  # default='warn'
-    columns = [c for c in dao_type.columns if c in starlist.columns]
+    columns = [c for c in dao_type.columns if c in starlist.columns or starlist._lazy_column(c)]
     coltypes = [_get_col_type(dao_type.extension, c) for c in columns]
-    towrite = starlist[columns]
+    # whole columns with NaN sentinels substituted, then single format call per row
+    # ('\n' in AP columns formats interleaves two lines per star)
+    values = [_column_to_write(starlist[col], coltype) for col, coltype in zip(columns, coltypes)]
+    formats = [_percent_format(coltype.format) for coltype in coltypes]
+    if None not in formats:  # printf-style formatting of row tuple is the fastest
+        row_format = ''.join(formats) + '\n'
+        fmt = row_format.__mod__
+    else:
+        row_format = ''.join(_indexed_format(coltype.format, n) for n, coltype in enumerate(coltypes)) + '\n'
+        fmt = lambda row: row_format.format(*row)
+    for start in range(0, len(starlist), _write_chunk_rows):
+        rows = zip(*[v[start:start + _write_chunk_rows] for v in values])
+        file.write(''.join([fmt(row) for row in rows]))
+
+
+_write_chunk_rows = 10000
+
+_percent_spec = re.compile(r'{:([-+ 0]*\d*(?:\.\d+)?[fFeEgGs])}')
+
+
+def _column_to_write(column, coltype):
+    if coltype.NaN and column.isnull().any():
+        column = column.where(column.notnull(), coltype.NaN[0])
+    return column.tolist()
 
-    for i, row in towrite.iterrows():
-        for col, coltype, val in zip(columns, coltypes, row):
-            if pd.isnull(val):
-                val = coltype.NaN[0]
-            file.write(coltype.format.format(val))
-        file.write('\n')
 
-def _parse_file(file, dao_type):
+def _percent_format(format):
+    # ' {:8.3f}' -> ' %8.3f', None if format spec has no printf-style equivalent
+    parts = _percent_spec.split(format)
+    if len(parts) != 3 or '{' in parts[0] + parts[2] or '}' in parts[0] + parts[2]:
+        return None
+    return parts[0].replace('%', '%%') + '%' + parts[1] + parts[2].replace('%', '%%')
+
+
+def _indexed_format(format, n):
+    # ' {:8.3f}' -> ' {n:8.3f}'
+    return re.sub(r'{(?=[:}])', '{{{}'.format(n), format, count=1)
+
+
+def _dao_type_of_file(file, dao_type):
     if dao_type is None and isinstance(file, str):
         _, ext = os.path.splitext(file)
         dao_type = DAO.file_types.get(ext)
+    return dao_type
 
+
+def _parse_file(file, dao_type, columns=None):
+    dao_type = _dao_type_of_file(file, dao_type)
     f, to_close = get_stream(file, 'r')
     try:
-        hdr, _ = read_dao_header(f)
-        fl = _parse_table(f, hdr, dao_type)
+        hdr, stolen_chars = read_dao_header(f)
+        fl = _parse_table(f, hdr, dao_type, columns, stolen_chars)
     finally:
         close_files(to_close)
     fl.DAO_hdr = hdr
@@ -199,44 +352,131 @@ def parse_dao_hdr(hdr, val, line_prefix=''):
     return dict(zip(hdr.split(), val.split()))
 
 
-def _parse_table(f, hdr, dao_type):
-    if dao_type is not None and dao_type.read_cols is not None:  # limit number of read cols
-        df = pd.read_table(f, header=None, sep='\s+', usecols=range(dao_type.read_cols))
-    else:
-        df = pd.read_table(f, header=None, sep='\s+')
+def _parse_table(f, hdr, dao_type, columns=None, stolen_chars=None):
+    text = (stolen_chars or '') + f.read()
+    dao_type, width, names = _table_layout(text, hdr, dao_type)
+    ret = _parse_rows(text, dao_type, width, names, columns)
+    return ret
 
-    #df.insert(0, 'id', df.index.to_series())
-    if dao_type is None:
-        dao_type = _guess_filetype(hdr, df)
-    if dao_type == DAO.AP_FILE:  # two row per star format correction
-        odd = df.iloc[0::2]
-        odd.columns = DAO.AP_FILE_ODD.columns[:odd.columns.size]
-        even = df.iloc[1::2]
-        even.columns = DAO.AP_FILE_EVEN.columns[:even.columns.size]
-        even.index = odd.index
-        df = odd.join(even, rsuffix='foo')
+
+def _lines_per_star(hdr, dao_type):
+    if dao_type == DAO.AP_FILE or dao_type is None and hdr and int(hdr['NL']) == 2:
+        return 2
+    return 1
+
+
+def _table_layout(text, hdr, dao_type):
+    # returns file type, number of values per star and names of columns to be read
+    if dao_type is None and _lines_per_star(hdr, dao_type) == 2:
+        dao_type = DAO.AP_FILE
+    rows_sizes = _first_rows_sizes(text, 2)
+    if dao_type == DAO.AP_FILE:  # two lines per star format, parsed as single row
+        width = sum(rows_sizes)
+        names = DAO.AP_FILE_ODD.columns[:rows_sizes[0]] + DAO.AP_FILE_EVEN.columns[:rows_sizes[1]]
     else:
-        df.columns = dao_type.columns[:df.columns.size]
+        width = rows_sizes[0]
+        if dao_type is None:
+            dao_type = _guess_filetype(hdr, width)
+        names = dao_type.columns[:width]
+        if dao_type.read_cols is not None:  # limit number of read cols
+            names = names[:dao_type.read_cols]
+    return dao_type, width, names
 
 
-    df.id = df.id.astype(int)
-    df.index = df.id
+def _parse_rows(text, dao_type, width, names, columns=None):
+    selected = [n for n, col in enumerate(names) if columns is None or col == 'id' or col in columns]
 
-    # find NaN
-    for col in df.columns:
-        coltype = _get_col_type(dao_type.extension, col)
-        if coltype.NaN:
-            df[col].replace(coltype.NaN, pd.np.nan, inplace=True)
+    df = None
+    if _is_numeric(dao_type):
+        df = _parse_numeric(text, width, names, selected, dao_type)
+    if df is None:
+        df = _parse_generic(text, names, selected, dao_type)
 
+    df.index = df.id
+    df['id'] = _nan_sentinels(df.id.values, _get_col_type(dao_type.extension, 'id').NaN)
     ret = StarList(df)
     ret.DAO_type = dao_type
     return ret
 
 
-def _guess_filetype(header, table):
+def _parse_numeric(text, width, names, selected, dao_type):
+    # fast path: numpy parser, None if table is not regular or not numeric
+    ap = dao_type == DAO.AP_FILE
+    if ap:  # both lines of star must have the same number of values to be parsed as 2D array
+        if width % 2:
+            return None
+        usecols = None
+    else:
+        usecols = selected
+    try:
+        values = np.loadtxt(text.splitlines(), usecols=usecols, ndmin=2)
+    except ValueError:
+        return None
+    if ap:
+        if values.shape[0] % 2:
+            return None
+        values = values.reshape(-1, width)[:, selected]
+    data = OrderedDict()
+    for n, col in zip(selected, values.T):
+        if names[n] == 'id':
+            data['id'] = col.astype(int)
+        else:
+            data[names[n]] = _nan_sentinels(col, _get_col_type(dao_type.extension, names[n]).NaN)
+    return pd.DataFrame(data)
+
+
+def _parse_generic(text, names, selected, dao_type):
+    if dao_type == DAO.AP_FILE:
+        text = _join_ap_lines(text)
+    df = pd.read_csv(StringIO(text), header=None, delim_whitespace=True, usecols=selected)
+    df.columns = [names[n] for n in df.columns]
+    df.id = df.id.astype(int)
+    for col in df.columns:
+        if col != 'id':
+            df[col] = _nan_sentinels(df[col].values, _get_col_type(dao_type.extension, col).NaN)
+    return df
+
+
+def _nan_sentinels(values, sentinels):
+    # replaces NaN sentinels by np.nan, like Series.replace does
+    if sentinels and values.dtype.kind in 'iuf':
+        isnan = np.isin(values, sentinels)
+        if isnan.any():
+            values = values.astype(float)
+            values[isnan] = np.nan
+    return values
+
+
+def _join_ap_lines(text):
+    lines = [l for l in text.splitlines() if l.strip()]
+    if len(lines) % 2:  # truncated file, missing second line of last star
+        lines.append('')
+    return '\n'.join([o + ' ' + e for o, e in zip(lines[0::2], lines[1::2])])
+
+
+def _first_rows_sizes(text, n):
+    # does not split whole (possibly huge) text
+    sizes = []
+    start = 0
+    while len(sizes) < n and start < len(text):
+        end = text.find('\n', start)
+        if end < 0:
+            end = len(text)
+        line = text[start:end]
+        if line.strip():
+            sizes.append(len(line.split()))
+        start = end + 1
+    return sizes + [0] * (n - len(sizes))
+
+
+def _is_numeric(dao_type):
+    return dao_type in DAO.file_types.values() and \
+        all('s}' not in _get_col_type(dao_type.extension, c).format for c in dao_type.columns)
+
+
+def _guess_filetype(header, colno):
     type = DAO.UNKNOWN_FILE
     if header:
-        colno = table.columns.size
         NL = int(header['NL'])
         type = DAO.UNKNOWN_FILE
         if NL == 1:
@@ -1,18 +1,20 @@
 from .StarList import StarList
 from .file_helpers import *
-from .daofiles import parse_dao_hdr, write_dao_header, DAO_file_firstline, DAO
+from .daofiles import parse_dao_hdr, write_dao_header, DAO_file_firstline, DAO, _percent_spec, _write_chunk_rows
 from .file_helpers import as_starlist
 import pandas as pd
+import numpy as np
 import re
+from string import Formatter
 
+_ds9_xy = r'[+-]?\d+[.]?\d*'
+_ds9_wcs = r'[+-]?\d+:\d+:\d+[.]?\d*'
+# first circle of not comment line, groups: x, y or ra, dec, then optional id
 _ds9_regexp = re.compile(
-    r'[+-]? *circle[( ] *([+-]?\d+[.]?\d*) *[, ] *([+-]?\d+[.]?\d*).+#.*id *= *(\d+)')
-_ds9_wcs_regexp = re.compile(
-    r'[+-]? *circle[( ] *([+-]?\d+:\d+:\d+[.]?\d*) *[, ] *([+-]?\d+:\d+:\d+[.]?\d*).+#.*id *= *(\d+)')
-_ds9_no_id_regexp = re.compile(
-    r'[+-]? *circle[( ] *([+-]?\d+[.]?\d*) *[, ] *([+-]?\d+[.]?\d*)')
-_ds9_no_id_wcs_regexp = re.compile(
-    r'[+-]? *circle[( ] *([+-]?\d+:\d+:\d+[.]?\d*) *[, ] *([+-]?\d+:\d+:\d+[.]?\d*)')
+    r'^(?!#).*?[+-]? *circle[( ] *(?:({0}) *[, ] *({0})|({1}) *[, ] *({1}))(?:.+#.*id *= *(\d+))?'
+    .format(_ds9_xy, _ds9_wcs), re.MULTILINE)
+_ds9_comment_regexp = re.compile(r'\n(#.*)')  # of text prefixed by new line
+_ds9_not_comment_regexp = re.compile(r'^(?!#).+', re.MULTILINE)
 _ds9_system_wcs = re.compile('fk4|fk5|J2000|B1950|ICRS', re.IGNORECASE)
 _ds9_system_xy = re.compile('PHYSICAL|IMAGE', re.IGNORECASE)
 
@@ -31,51 +33,35 @@ def read_ds9_regions(file):
     """
 
     f, to_close = get_stream(file, 'rt')
-    # s = StarList.new()
-    data = []
-    data_noid = []
-    dao_hdr1 = None
+    text = f.read()
+    close_files(to_close)
     hdr = None
     sys_wcs, sys_xy = (1,2)
     system = None
-    for line in f:
-        if line[0] == '#':
-            if line[1:11] == DAO_file_firstline[:10]:  # dao header found in comment
-                dao_hdr1 = line
-                continue
-            if dao_hdr1 is not None:  # second line of dao header
-                hdr = parse_dao_hdr(dao_hdr1, line, '#')
-        else:
-            if system is None:
-                if _ds9_system_wcs.search(line):
-                    system = sys_wcs
-                elif _ds9_system_xy.search(line):
-                    system = sys_xy
-                pass
-            m = _ds9_regexp.search(line)
-            if m is not None:  # s[id] = (id, x, y)
-                data.append([int(m.group(3)), float(m.group(1)), float(m.group(2))])
-            else:
-                m = _ds9_wcs_regexp.search(line)
-                if m is not None:  # s[id] = (id, ra, dec)
-                    data.append([int(m.group(3)), str(m.group(1)), str(m.group(2))])
-                else:
-                    m = _ds9_no_id_regexp.search(line)  # s[?] = (x, y)
-                    if m is not None:
-                        data_noid.append([float(m.group(1)), float(m.group(2))])
-                    else:
-                        m = _ds9_no_id_wcs_regexp.search(line)  # s[?] = (ra, dec)
-                        if m is not None:
-                            data_noid.append([str(m.group(1)), str(m.group(2))])
-
-        dao_hdr1 = None
-    close_files(to_close)
-    if system == sys_wcs:
-        s = StarList(data, columns = ['id', 'ra', 'dec'])
-        s_noid = StarList(data_noid, columns=['ra', 'dec'])
-    else:
-        s = StarList(data, columns = ['id', 'x', 'y'])
-        s_noid = StarList(data_noid, columns = ['x', 'y'])
+    previous = None
+    for m in _ds9_comment_regexp.finditer('\n' + text):
+        line = m.group(1)
+        if previous is not None and previous.end() == m.start():  # second line of dao header
+            hdr = parse_dao_hdr(previous.group(1), line, '#')
+        previous = m if line[1:11] == DAO_file_firstline[:10] else None  # dao header found in comment
+    for m in _ds9_not_comment_regexp.finditer(text):
+        line = m.group()
+        if _ds9_system_wcs.search(line):
+            system = sys_wcs
+            break
+        elif _ds9_system_xy.search(line):
+            system = sys_xy
+            break
+    regions = _ds9_regexp.findall(text)
+    x, y, ra, dec, ids = [[r[n] for r in regions] for n in range(5)]
+    xy = np.array(list(map(bool, x)), dtype=bool)
+    with_id = np.array(list(map(bool, ids)), dtype=bool)
+    coo1 = _ds9_coordinates(x, ra, xy)
+    coo2 = _ds9_coordinates(y, dec, xy)
+    ids = np.fromiter(map(int, filter(None, ids)), dtype=np.int64, count=with_id.sum())
+    names = ['ra', 'dec'] if system == sys_wcs else ['x', 'y']
+    s = _ds9_starlist(['id'] + names, [ids, coo1[with_id], coo2[with_id]])
+    s_noid = _ds9_starlist(names, [coo1[~with_id], coo2[~with_id]])
     s.index = s['id']
     s['auto_id'] = False
     if not s_noid.empty:
@@ -87,13 +73,28 @@ def read_ds9_regions(file):
         if s.empty:
             s = s_noid
         else:
-            s = s.append(s_noid)
+            s = pd.concat([s, s_noid])
 
     s.DAO_hdr = hdr
     s.DAO_type = DAO.RADEC_FILE if system == sys_wcs else DAO.XY_FILE
     return s
 
 
+def _ds9_coordinates(xy_values, wcs_values, xy):
+    # floats for x, y, strings for ra, dec
+    if xy.all():
+        return np.fromiter(map(float, xy_values), dtype=float, count=len(xy_values))
+    coo = np.array(wcs_values, dtype=object)
+    coo[xy] = [float(v) for v in xy_values if v]
+    return coo
+
+
+def _ds9_starlist(columns, values):
+    if len(values[0]) == 0:
+        return StarList([], columns=columns)
+    return StarList(dict(zip(columns, values)), columns=columns)
+
+
 def write_ds9_regions(starlist, filename,
                       color='green', width=1, size=None, font=None, label='{id:.0f}',
                       exclude=None, indexes=None, colors=None, sizes=None, labels=None,
@@ -164,27 +165,85 @@ def write_ds9_regions(starlist, filename,
     else:
         system = WCS if isinstance(WCS, str) else 'icrs'
         f.write(system+'\n')
-    for i, row in starlist.iterrows():
-        if exclude is not None and i in exclude:
-            f.write('-')
-        if size is not None:
-            s = size
-        else:
-            s = '2"' if WCS else 8
-        text = label.format(**row)
-        c = ''
-        if size_column is not None:
-            s = row[size_column]
-        if color_column is not None:
-            c = ' color=' + row[color_column]
-        if indexes is not None:
-            for n in range(len(indexes)):
-                if i in indexes[n]:
-                    if sizes and sizes[n] is not None:
-                        s = sizes[n]
-                    if colors and colors[n] is not None:
-                        c = ' color=' + colors[n]
-                    if labels and labels[n] is not None:
-                        text = labels[n].format(**row)
-        f.write('circle({},{},{}) #{} text="{}" id={:d}\n'.format(row[xcol], row[ycol], s, c, text, i))
+    default_size = size if size is not None else '2"' if WCS else 8
+    lines = _region_lines(starlist, xcol, ycol, default_size, label, exclude, indexes, colors, sizes, labels,
+                          color_column, size_column)
+    for chunk in range(0, len(lines), _write_chunk_rows):
+        f.write(''.join(lines[chunk:chunk + _write_chunk_rows]))
     close_files(to_close)
+
+
+def _region_lines(starlist, xcol, ycol, default_size, label, exclude, indexes, colors, sizes, labels,
+                  color_column, size_column):
+    # region file lines of all stars, built column by column
+    n = starlist.stars_number()
+    columns = _row_values(starlist)
+
+    def column(name):
+        return columns[name] if name in columns else starlist[name].values  # lazy ra, dec
+
+    excluded = _members(starlist.index, exclude) if exclude is not None else np.zeros(n, dtype=bool)
+    minus = np.where(excluded, '-', '').tolist()
+    x = list(map('{}'.format, column(xcol)))
+    y = list(map('{}'.format, column(ycol)))
+    if size_column is not None:
+        s = list(map('{}'.format, column(size_column)))
+    else:
+        s = ['{}'.format(default_size)] * n
+    if color_column is not None:
+        c = [' color=' + v for v in column(color_column)]
+    else:
+        c = [''] * n
+    text = _format_labels(label, columns, n)
+    for k, index in enumerate(indexes or []):
+        rows = np.flatnonzero(_members(starlist.index, index))
+        if sizes and sizes[k] is not None:
+            _set_rows(s, rows, '{}'.format(sizes[k]))
+        if colors and colors[k] is not None:
+            _set_rows(c, rows, ' color=' + colors[k])
+        if labels and labels[k] is not None:
+            selected = {name: values[rows] for name, values in columns.items()}
+            for r, t in zip(rows, _format_labels(labels[k], selected, len(rows))):
+                text[r] = t
+    ids = list(map('{:d}'.format, starlist.index))
+    return ['%scircle(%s,%s,%s) #%s text="%s" id=%s\n' % row for row in zip(minus, x, y, s, c, text, ids)]
+
+
+def _row_values(starlist):
+    # columns values as in rows of `starlist.iterrows()`, which are converted to common dtype;
+    # float32 columns (compact StarList) widened by their shortest representation to be written like float64
+    frame = pd.DataFrame({n: starlist.iloc[:, n] if starlist.dtypes.iloc[n] != np.float32
+                         else starlist.iloc[:, n].values.astype(str).astype(np.float64)
+                          for n in range(len(starlist.columns))}, index=starlist.index)
+    values = frame.values
+    return {name: values[:, n] for n, name in enumerate(starlist.columns)}
+
+
+def _members(index, selection):
+    # mask of index labels present in selection, like `label in selection` for every label
+    if isinstance(selection, pd.Series):
+        selection = selection.index
+    return index.isin(selection)
+
+
+def _set_rows(values, rows, value):
+    for r in rows:
+        values[r] = value
+
+
+def _format_labels(label, columns, n):
+    # label.format(**row) for all rows, by printf-style formatting where possible
+    template = ''
+    names = []
+    for literal, name, spec, conversion in Formatter().parse(label):
+        template += literal.replace('%', '%%')
+        if name is None:
+            continue
+        if name not in columns or conversion is not None \
+                or spec and ('-' in spec or not _percent_spec.match('{:' + spec + '}')):  # '-' differs
+            return [label.format(**{k: v[r] for k, v in columns.items()}) for r in range(n)]
+        template += '%' + spec if spec else '%s'
+        names.append(name)
+    if not names:
+        return [template % ()] * n
+    return [template % row for row in zip(*[columns[name] for name in names])]
@@ -55,7 +55,7 @@ def extract_SkyCoord(starlist):
     return SkyCoord(ra_col, dec_col, unit=(ra_unit, dec_unit))
 
 
-def as_starlist(input, read_files=True, raise_exceptions=True, updateskycoord=True):
+def as_starlist(input, read_files=True, raise_exceptions=True, updateskycoord=True, compact=None):
     if isinstance(input, StarList):
         return input
 
@@ -94,5 +94,12 @@ def as_starlist(input, read_files=True, raise_exceptions=True, updateskycoord=Tr
         if coo:
             input.radec_hmsdms_from_skycoord(coo)
             input.radec_deg_from_hmsdms()
-    return input
+    return compact_starlist(input, compact)
+
+
+def compact_starlist(starlist, compact=None):
+    """Applies `StarList.compact` in place if `compact` is True, or is None and `StarList.compact_default` is set"""
+    if compact or compact is None and StarList.compact_default:
+        starlist.compact(inplace=True)
+    return starlist
 
@@ -0,0 +1,106 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from .StarList import StarList
+from .fileformats import DAO
+
+
+def write_npz_file(starlist, file, extra_meta=None):
+    """
+    Writes StarList into binary numpy `.npz` file, with metadata (DAO_hdr, DAO_type, index)
+
+    Numeric, boolean and categorical columns are stored losslessly, other (object) columns as strings.
+    :param StarList starlist: StarList instance to be written
+    :param file: writable binary stream or filename (written as is, `.npz` extension is not added)
+    :param dict extra_meta: additional json-serializable metadata, returned by `read_npz_file` with `with_meta`
+    """
+    arrays = {}
+    columns = []
+    for n, col in enumerate(starlist.columns):
+        arrays['c{}'.format(n)], kind = _to_array(starlist[col])
+        columns.append([col, kind])
+    arrays['index'], index_kind = _to_array(starlist.index.to_series())
+    meta = {
+        'columns': columns,
+        'index': [starlist.index.name, index_kind],
+        'DAO_hdr': starlist.DAO_hdr,
+        'DAO_type': starlist.DAO_type._asdict() if starlist.DAO_type is not None else None,
+        'extra': extra_meta,
+    }
+    arrays['meta'] = np.array(json.dumps(meta, default=_json_scalar))
+    if isinstance(file, str):
+        file = os.path.expanduser(file)
+        with open(file, 'wb') as f:
+            np.savez(f, **arrays)
+    else:
+        np.savez(file, **arrays)
+
+
+def read_npz_file(file, columns=None, with_meta=False):
+    """
+    Reads StarList saved by `write_npz_file`
+    :param file: binary stream or filename
+    :param columns: list of columns to read, default: all columns
+    :param bool with_meta: return also `extra_meta` dict provided to `write_npz_file`
+    :return: StarList instance or tuple (StarList, extra_meta) if with_meta
+    """
+    if isinstance(file, str):
+        file = os.path.expanduser(file)
+    with np.load(file, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['meta']))
+        data = {}
+        names = []
+        for n, (col, kind) in enumerate(meta['columns']):
+            if columns is None or col == 'id' or col in columns:
+                data[col] = _from_array(npz['c{}'.format(n)], kind)
+                names.append(col)
+        index_name, index_kind = meta['index']
+        index = pd.Index(_from_array(npz['index'], index_kind), name=index_name)
+    s = StarList(data, columns=names, index=index)
+    s.DAO_hdr = meta['DAO_hdr']
+    s.DAO_type = _dao_type(meta['DAO_type'])
+    if with_meta:
+        return s, meta['extra']
+    return s
+
+
+def _to_array(column):
+    values = column.values
+    if values.dtype.kind in 'biufcmM':
+        return values, 'native'
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # codes (-1 for null), categories stored in metadata
+        return column.cat.codes.values, ['category', column.cat.categories.tolist()]
+    isnull = column.isnull().values
+    strings = np.where(isnull, '', column.astype(str).values).astype('U')
+    return np.stack([strings, np.where(isnull, 'n', '').astype('U')]), 'str'
+
+
+def _from_array(array, kind):
+    if kind == 'native':
+        return array
+    if isinstance(kind, list):  # category
+        return pd.Categorical.from_codes(array, kind[1])
+    strings, isnull = array
+    values = strings.astype(object)
+    values[isnull == 'n'] = np.nan
+    return values
+
+
+def _json_scalar(o):
+    # numpy scalars, e.g. int64 column names
+    if hasattr(o, 'item'):
+        return o.item()
+    raise TypeError('{!r} is not JSON serializable'.format(o))
+
+
+def _dao_type(fields):
+    if fields is None:
+        return None
+    fields['columns'] = list(fields['columns'])
+    dao_type = DAO.FType(**fields)
+    for known in list(DAO.file_types.values()) + [DAO.UNKNOWN_FILE]:
+        if known == dao_type:
+            return known
+    return dao_type
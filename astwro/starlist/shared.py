@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+from .StarList import StarList
+from .npzfiles import _to_array, _from_array, _dao_type
+
+
+class SharedStarList(object):
+    """
+    StarList published in shared memory (or memory-mapped file), for multiprocess workers
+
+    Columns are stored as fields of single structured array record, every column contiguous.
+    The handle is small and picklable, pass it to worker processes instead of StarList, and call :meth:`attach`
+    there to get read-only StarList which numeric, boolean and categorical columns are views of shared memory
+    (other columns, e.g. strings, are copied on attach).
+
+        >>> with SharedStarList(stars) as shared:
+        ...     with multiprocessing.Pool() as pool:
+        ...         scores = pool.map(score_star, [(shared, i) for i in stars.id])
+        >>> def score_star(args):
+        ...     shared, i = args
+        ...     s = shared.attach()
+        ...     ...
+
+    Process which published StarList should keep the handle and call :meth:`unlink` (or use it as context manager)
+    when workers are done. StarLists attached before unlinking stay valid.
+
+    :param StarList starlist: StarList to publish
+    :param str file: if provided, memory-mapped file is used instead of `multiprocessing.shared_memory`
+                     (python 3.8+), required for workers which are not child processes of publishing one
+                     (before python 3.13)
+    """
+
+    def __init__(self, starlist, file=None):
+        arrays = []
+        columns = []
+        for col in starlist.columns:
+            array, kind = _to_array(starlist[col])
+            arrays.append(array)
+            columns.append([col, kind])
+        index, index_kind = _to_array(starlist.index.to_series())
+        arrays.append(index)
+        self.dtype = np.dtype([('c{}'.format(n), a.dtype, a.shape) for n, a in enumerate(arrays)], align=True)
+        self.meta = {
+            'columns': columns,
+            'index': [starlist.index.name, index_kind],
+            'DAO_hdr': starlist.DAO_hdr,
+            'DAO_type': starlist.DAO_type._asdict() if starlist.DAO_type is not None else None,
+        }
+        self.file = os.path.abspath(os.path.expanduser(file)) if file is not None else None
+        self.name = None
+        self._shm = None
+        self._owner = True
+        record = self._open(create=True)
+        for name, array in zip(self.dtype.names, arrays):
+            record[name][0] = array
+        if isinstance(record, np.memmap):
+            record.flush()
+        record.flags.writeable = False
+        self._record = record
+
+    def attach(self):
+        """
+        Read-only StarList view of shared data, with `DAO_hdr` and `DAO_type`
+
+        :rtype: StarList
+        """
+        if self._record is None:
+            self._record = self._open(create=False)
+        data = {}
+        names = []
+        for n, (col, kind) in enumerate(self.meta['columns']):
+            data[col] = _from_array(self._record['c{}'.format(n)][0], kind)
+            names.append(col)
+        index_name, index_kind = self.meta['index']
+        index = pd.Index(_from_array(self._record['c{}'.format(len(names))][0], index_kind), name=index_name)
+        s = StarList(data, columns=names, index=index, copy=False)
+        s.DAO_hdr = self.meta['DAO_hdr']
+        s.DAO_type = _dao_type(dict(self.meta['DAO_type'])) if self.meta['DAO_type'] is not None else None
+        s._shared = self  # keeps memory mapped
+        return s
+
+    def close(self):
+        """
+        Detaches shared memory in this process
+
+        Memory stays mapped while StarLists returned by :meth:`attach` (or their columns) are in use.
+        """
+        self._record = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+                self._shm = None
+            except BufferError:  # exported to attached StarLists
+                pass
+
+    def unlink(self):
+        """Frees shared memory (or removes file), should be called once, by publishing process"""
+        self.close()
+        if self.file is not None:
+            if os.path.exists(self.file):
+                os.remove(self.file)
+        elif self._shm is not None:
+            self._shm.unlink()
+        else:
+            shm = _attach_shm(self.name)
+            shm.close()
+            shm.unlink()
+
+    def _open(self, create):
+        if self.file is not None:
+            return np.memmap(self.file, dtype=self.dtype, mode='w+' if create else 'r', shape=(1,))
+        if create:
+            from multiprocessing.shared_memory import SharedMemory
+            self._shm = SharedMemory(create=True, size=max(self.dtype.itemsize, 1))
+            self.name = self._shm.name
+        elif self._shm is None:
+            self._shm = _attach_shm(self.name)
+        record = np.ndarray((1,), dtype=self.dtype, buffer=self._shm.buf)
+        record.flags.writeable = create
+        return record
+
+    def __getstate__(self):
+        return {'dtype': self.dtype, 'meta': self.meta, 'file': self.file, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        self._record = None
+        self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
+
+    def __repr__(self):
+        return 'SharedStarList({}: {} bytes)'.format(self.file or self.name, self.dtype.itemsize)
+
+
+def _attach_shm(name):
+    from multiprocessing.shared_memory import SharedMemory
+    try:
+        return SharedMemory(name=name, track=False)  # python 3.13+
+    except TypeError:
+        # registered in resource tracker shared with publishing process (idempotent), but resource tracker
+        # of unrelated process would unlink memory at its exit, use `file` for sharing between such processes
+        return SharedMemory(name=name)
@@ -0,0 +1,151 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import astropy.units as u
+
+
+def kdtree(starlist, sky=False):
+    """
+    KD-tree (`scipy.spatial.cKDTree`) of star positions, built lazily and cached on starlist
+
+    Tree is rebuilt when coordinates change (checked by hash of coordinate columns on every call).
+    Query functions accept tree returned by this function as `tree` parameter, to skip the check
+    when many queries are made on unchanged starlist.
+    :param StarList starlist: stars
+    :param bool sky: tree of `ra_deg`, `dec_deg` as points of unit sphere instead of `x`, `y`
+    :rtype: scipy.spatial.cKDTree
+    """
+    from scipy.spatial import cKDTree
+    coords = _coords(starlist, sky)
+    key = hashlib.sha1(coords).hexdigest()
+    cache = starlist.__dict__.setdefault('_spatial_cache', {})
+    cached = cache.get(sky)
+    if cached is None or cached[0] != key:
+        cached = key, cKDTree(_points(starlist, sky, coords))
+        cache[sky] = cached
+    return cached[1]
+
+
+def neighbours(starlist, radius, sky=False, tree=None):
+    """
+    Pairs of stars closer than radius
+
+    :param StarList starlist: stars
+    :param radius: distance in pixels, or angle (`astropy.units.Quantity` or degrees) if `sky`
+    :param bool sky: use `ra_deg`, `dec_deg` instead of `x`, `y`
+    :param tree: :func:`kdtree` of starlist, not checked for changes of coordinates
+    :return: DataFrame with columns `id`, `neighbour_id`, `distance` (pixels or degrees), every pair in both
+             directions, sorted by `id` and `distance`
+    :rtype: pd.DataFrame
+    """
+    if tree is None:
+        tree = kdtree(starlist, sky)
+    pairs = tree.query_pairs(_tree_distance(radius, sky), output_type='ndarray')
+    first = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    second = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    distance = np.sqrt(((tree.data[first] - tree.data[second]) ** 2).sum(axis=1))
+    ids = starlist.index.values
+    ret = pd.DataFrame({'id': ids[first], 'neighbour_id': ids[second], 'distance': _distance(distance, sky)},
+                       columns=['id', 'neighbour_id', 'distance'])
+    return ret.sort_values(['id', 'distance'], kind='mergesort').reset_index(drop=True)
+
+
+def isolated(starlist, radius, dmag=None, sky=False, tree=None):
+    """
+    Mask of stars without neighbours closer than radius
+
+    :param StarList starlist: stars
+    :param radius: distance in pixels, or angle (`astropy.units.Quantity` or degrees) if `sky`
+    :param float dmag: if provided, neighbours fainter than `mag + dmag` of star are ignored
+    :param bool sky: use `ra_deg`, `dec_deg` instead of `x`, `y`
+    :param tree: :func:`kdtree` of starlist, not checked for changes of coordinates
+    :rtype: pd.Series
+    """
+    if tree is None:
+        tree = kdtree(starlist, sky)
+    pairs = tree.query_pairs(_tree_distance(radius, sky), output_type='ndarray')
+    first = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    second = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    if dmag is not None:
+        mag = starlist['mag'].values
+        disturbing = mag[second] < mag[first] + dmag
+        first = first[disturbing]
+    crowded = np.zeros(len(starlist), dtype=bool)
+    crowded[first] = True
+    return pd.Series(~crowded, index=starlist.index, name='isolated')
+
+
+def nearest(starlist, other, max_distance=None, sky=False, tree=None):
+    """
+    Nearest star of other list for every star, e.g. for matching lists of two frames
+
+    :param StarList starlist: stars
+    :param StarList other: stars to search in
+    :param max_distance: if provided, stars without other star closer than `max_distance` get `nearest_id` -1
+                         and NaN `distance`
+    :param bool sky: use `ra_deg`, `dec_deg` instead of `x`, `y`
+    :param tree: :func:`kdtree` of other, not checked for changes of coordinates
+    :return: DataFrame indexed as starlist, with columns `nearest_id` and `distance` (pixels or degrees)
+    :rtype: pd.DataFrame
+    """
+    if tree is None:
+        tree = kdtree(other, sky)
+    bound = np.inf if max_distance is None else _tree_distance(max_distance, sky)
+    distance, n = tree.query(_points(starlist, sky), distance_upper_bound=bound)
+    found = n < tree.n
+    nearest_id = np.full(len(starlist), -1, dtype=other.index.dtype if len(other) else np.int64)
+    nearest_id[found] = other.index.values[n[found]]
+    distance = np.where(found, _distance(distance, sky), np.nan)
+    return pd.DataFrame({'nearest_id': nearest_id, 'distance': distance},
+                        index=starlist.index, columns=['nearest_id', 'distance'])
+
+
+def within(starlist, box, tree=None):
+    """
+    Stars inside rectangle (edges included)
+
+    :param StarList starlist: stars
+    :param box: (xmin, xmax, ymin, ymax)
+    :param tree: :func:`kdtree` of starlist, not checked for changes of coordinates
+    :rtype: StarList
+    """
+    xmin, xmax, ymin, ymax = box
+    if tree is None:
+        tree = kdtree(starlist)
+    center = [(xmin + xmax) / 2.0, (ymin + ymax) / 2.0]
+    candidates = np.array(sorted(tree.query_ball_point(center, max(xmax - xmin, ymax - ymin) / 2.0, p=np.inf)),
+                          dtype=np.intp)
+    points = tree.data[candidates]
+    inside = (points[:, 0] >= xmin) & (points[:, 0] <= xmax) & (points[:, 1] >= ymin) & (points[:, 1] <= ymax)
+    return starlist.iloc[candidates[inside]]
+
+
+def _coords(starlist, sky):
+    # coordinate columns as contiguous array, hashed to detect changes
+    columns = ['ra_deg', 'dec_deg'] if sky else ['x', 'y']
+    return np.ascontiguousarray(np.column_stack([starlist[c].values for c in columns]), dtype=float)
+
+
+def _points(starlist, sky, coords=None):
+    if coords is None:
+        coords = _coords(starlist, sky)
+    if not sky:
+        return coords
+    ra = np.radians(coords[:, 0])
+    dec = np.radians(coords[:, 1])
+    return np.ascontiguousarray(np.column_stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)]))
+
+
+def _tree_distance(distance, sky):
+    # pixels, or chord on unit sphere for angle
+    if not sky:
+        return distance
+    angle = u.Quantity(distance, u.deg).to_value(u.rad)
+    return 2 * np.sin(angle / 2)
+
+
+def _distance(tree_distance, sky):
+    # pixels, or degrees for chord on unit sphere
+    if not sky:
+        return tree_distance
+    return np.degrees(2 * np.arcsin(np.minimum(tree_distance, 2.0) / 2))
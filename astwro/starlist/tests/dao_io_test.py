@@ -3,6 +3,9 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os.path as path
+from io import StringIO
+import numpy as np
+import pandas as pd
 import astwro.starlist as sl
 import astwro.sampledata as data
 from astwro.utils import tmpdir
@@ -70,3 +73,96 @@ def test_convert_ap_to_als():
     assert s1.round(4)[cols_to_compare].equals(s2.round(4)[cols_to_compare])
 
 
+
+
+def _write_table_by_cells(s, daotype):
+    # reference: formatting cell by cell
+    out = ''
+    columns = [c for c in daotype.columns if c in s.columns]
+    for _, row in s[columns].iterrows():
+        for col, val in zip(columns, row):
+            coltype = sl.daofiles._get_col_type(daotype.extension, col)
+            if pd.isnull(val):
+                val = coltype.NaN[0]
+            out += coltype.format.format(val)
+        out += '\n'
+    return out
+
+
+def test_write_byte_identical():
+    for f in [data.coo_file(), data.lst_file(), data.nei_file(), data.ap_file(), data.als_file()]:
+        s = sl.read_dao_file(f)
+        s.iloc[::7, 2] = np.nan
+        buf = StringIO()
+        sl.daofiles._write_table(s, buf, s.DAO_type)
+        assert buf.getvalue() == _write_table_by_cells(s, s.DAO_type)
+
+
+def test_read_columns():
+    s = sl.read_dao_file(data.ap_file())
+    p = sl.read_dao_file(data.ap_file(), columns=['x', 'y', 'mag', 'mag_err'])
+    assert list(p.columns) == ['id', 'x', 'y', 'mag', 'mag_err']
+    assert p.equals(s[['id', 'x', 'y', 'mag', 'mag_err']])
+
+
+def test_read_fast_and_generic_paths_agree():
+    for f in [data.coo_file(), data.lst_file(), data.nei_file(), data.ap_file(), data.als_file()]:
+        s = sl.read_dao_file(f)
+        s.iloc[::7, 2] = np.nan
+        buf = StringIO()
+        sl.write_dao_file(s, buf, s.DAO_type)
+        text = buf.getvalue().split('\n', 2)[2]  # skip header
+        rows = sl.daofiles._first_rows_sizes(text, 2)
+        width = sum(rows) if s.DAO_type == sl.DAO.AP_FILE else rows[0]
+        names = list(s.columns)
+        selected = list(range(len(names)))
+        fast = sl.daofiles._parse_numeric(text, width, names, selected, s.DAO_type)
+        generic = sl.daofiles._parse_generic(text, names, selected, s.DAO_type)
+        assert fast.equals(generic)
+        assert fast.iloc[::7, 2].isnull().all()  # NaN sentinels
+
+
+def test_iter_and_write_chunks():
+    d = tmpdir()
+    for f in [data.coo_file(), data.nei_file(), data.ap_file(), data.als_file()]:
+        s = sl.read_dao_file(f)
+        chunks = list(sl.iter_dao_file(f, chunksize=1000))
+        assert len(chunks) == (s.stars_number() + 999) // 1000
+        assert all(c.DAO_type == s.DAO_type and c.DAO_hdr == s.DAO_hdr for c in chunks)
+        assert pd.concat(chunks).equals(s)
+        f1 = path.join(d.path, 'whole' + s.DAO_type.extension)
+        f2 = path.join(d.path, 'chunks' + s.DAO_type.extension)
+        sl.write_dao_file(s, f1)
+        assert sl.write_dao_chunks(sl.iter_dao_file(f, chunksize=1000), f2) == s.stars_number()
+        with open(f1) as a, open(f2) as b:
+            assert a.read() == b.read()
+    p = next(sl.iter_dao_file(data.ap_file(), chunksize=10, columns=['mag']))
+    assert list(p.columns) == ['id', 'mag'] and p.stars_number() == 10
+
+
+def test_compact():
+    for f in [data.ap_file(), data.als_file(), data.nei_file()]:
+        full = sl.read_dao_file(f, compact=False)
+        s = sl.read_dao_file(f)
+        assert s.id.dtype == np.int32
+        assert s.x.dtype == np.float32
+        assert s.memory_usage(deep=True).sum() < full.memory_usage(deep=True).sum() / 1.5
+        b1, b2 = StringIO(), StringIO()
+        sl.write_dao_file(full, b1)
+        sl.write_dao_file(s, b2)
+        assert b1.getvalue() == b2.getvalue()
+    s = sl.read_dao_file(data.als_file(), compact=False)
+    s['ra_deg'] = np.linspace(10, 20, s.stars_number())
+    s['dec_deg'] = np.linspace(-5, 5, s.stars_number())
+    s.radec_hmsdms_from_deg()
+    s['flag'] = np.where(s.chi > 1, 'bad', 'ok')
+    c = s.compact()
+    assert 'ra' not in c.columns and 'ra' in s.columns
+    assert c.ra.equals(s.ra) and c['dec'].equals(s['dec'])
+    assert c.flag.dtype == 'category'
+    assert (c.flag == s.flag).all()
+    # values with more decimals than DAO format are not quantized
+    df = pd.DataFrame({'id': [1, 2], 'x': [123.4567891, 10.0], 'y': [1.25, 2.5]})
+    c = sl.as_starlist(df)
+    assert c.x.dtype == np.float64 and c.x[1] == 123.4567891
+    assert c.y.dtype == np.float32
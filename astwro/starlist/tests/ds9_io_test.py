@@ -18,7 +18,7 @@ def get_catalog(object):
         return None
 
 def test_read_write_ds9():
-    s1 = sl.read_dao_file(data.ap_file())
+    s1 = sl.read_dao_file(data.ap_file(), compact=False)  # ds9 regions are not compacted
     d = tmpdir()
     f2 = path.join(d.path, 'i.reg')
     sl.write_ds9_regions(s1, f2)
@@ -26,6 +26,27 @@ def test_read_write_ds9():
     assert s2[['id', 'x', 'y']].equals(s1[['id', 'x', 'y']])
     assert not s2.auto_id.any()
 
+def test_write_ds9_attributes():
+    s = sl.StarList({'id': [1, 2, 3, 4], 'x': [10.5, 20.25, 30.0, 40.125], 'y': [1.0, 2.0, 3.5, 4.0],
+                     'mag': [15.123, 16.5, 17.25, 18.0]})
+    s.index = s.id
+    out = StringIO()
+    sl.write_ds9_regions(s, out, exclude=s.index[[3]], indexes=[s.index[[1, 2]], s.index[[2]]],
+                         colors=['red', 'blue'], sizes=[12, None], labels=[None, 'PSF:{id:.0f} {mag:.1f}'])
+    assert out.getvalue().splitlines()[-4:] == [
+        'circle(10.5,1.0,8) # text="1" id=1',
+        'circle(20.25,2.0,12) # color=red text="2" id=2',
+        'circle(30.0,3.5,12) # color=blue text="PSF:3 17.2" id=3',
+        '-circle(40.125,4.0,8) # text="4" id=4',
+    ]
+    # compact StarList written as full one
+    full = StringIO()
+    compact = StringIO()
+    sl.write_ds9_regions(sl.read_dao_file(data.ap_file(), compact=False), full)
+    sl.write_ds9_regions(sl.read_dao_file(data.ap_file()), compact)
+    assert full.getvalue() == compact.getvalue()
+
+
 def test_read_noid_reg():
     reg = u"""
 # Region file format: DS9 version 4.1
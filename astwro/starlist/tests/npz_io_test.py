@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import numpy as np
+import astwro.starlist as sl
+import astwro.sampledata as data
+from astwro.utils import tmpdir
+
+
+def test_save_load():
+    d = tmpdir()
+    for f in [data.ap_file(), data.als_file(), data.lst_file()]:
+        s = sl.read_dao_file(f)
+        s.iloc[::5, 2] = np.nan
+        s['flag'] = '?'
+        s.loc[s.index[::3], 'flag'] = None
+        fn = os.path.join(d.path, 'list.npz')
+        s.save(fn)
+        l = sl.StarList.load(fn)
+        assert l.equals(s)
+        assert l.DAO_type is s.DAO_type
+        assert l.DAO_hdr == s.DAO_hdr
+        assert l.index.name == 'id'
+        p = sl.StarList.load(fn, columns=['x', 'y'])
+        assert list(p.columns) == ['id', 'x', 'y']
+
+
+def test_save_load_categorical():
+    d = tmpdir()
+    s = sl.read_dao_file(data.als_file())
+    s['flag'] = np.where(s.chi > 1, 'bad', 'ok')
+    s.loc[s.index[::3], 'flag'] = None
+    s.compact(inplace=True)
+    assert s.flag.dtype == 'category'
+    fn = os.path.join(d.path, 'list.npz')
+    s.save(fn)
+    assert sl.StarList.load(fn).equals(s)
+
+
+def test_sidecar():
+    d = tmpdir()
+    fn = os.path.join(d.path, 'i.als')
+    s = sl.read_dao_file(data.als_file())
+    sl.write_dao_file(s, fn)
+    s = sl.read_dao_file(fn)
+    a = sl.read_dao_file(fn, sidecar=True)
+    assert os.path.exists(fn + '.npz')
+    assert a.equals(s)
+    b = sl.read_dao_file(fn, sidecar=True, columns=['mag'])
+    assert list(b.columns) == ['id', 'mag']
+    assert b.DAO_type is sl.DAO.ALS_FILE
+    assert b.mag.dtype == np.float32
+    c = sl.read_dao_file(fn, sidecar=True, compact=False)
+    assert c.mag.dtype == np.float64
+    assert c.equals(sl.read_dao_file(fn, compact=False))
+    # source changed
+    sl.write_dao_file(s[:10], fn)
+    os.utime(fn, (0, 0))
+    assert sl.read_dao_file(fn, sidecar=True).stars_number() == 10
+    # sidecars directory
+    sidecars = os.path.join(d.path, 'sidecars')
+    sl.read_dao_file(fn, sidecar=sidecars)
+    assert os.listdir(sidecars) == [os.path.basename(sl.sidecar_file(fn, sidecars))]
@@ -0,0 +1,43 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import multiprocessing
+import numpy as np
+import pytest
+import astwro.starlist as sl
+import astwro.sampledata as data
+from astwro.utils import tmpdir
+
+
+def _worker_mag(args):
+    shared, id = args
+    s = shared.attach()
+    return s.loc[id, 'mag'], s.DAO_type.extension
+
+
+@pytest.mark.parametrize('use_file', [False, True])
+def test_share_attach(use_file):
+    s = sl.read_dao_file(data.als_file())
+    s['flag'] = np.where(s.chi > 1, 'bad', 'ok')
+    s.compact(inplace=True)
+    d = tmpdir()
+    file = os.path.join(d.path, 'stars.shm') if use_file else None
+    with s.share(file=file) as shared:
+        a = shared.attach()
+        assert a.equals(s)
+        assert a.DAO_type is sl.DAO.ALS_FILE
+        assert a.DAO_hdr == s.DAO_hdr
+        with pytest.raises(ValueError):
+            a.loc[a.index[0], 'x'] = 0.0
+        ids = list(s.index[:6])
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(_worker_mag, [(shared, i) for i in ids])
+        finally:
+            pool.close()
+            pool.join()
+        assert results == [(s.loc[i, 'mag'], '.als') for i in ids]
+    if use_file:
+        assert not os.path.exists(file)
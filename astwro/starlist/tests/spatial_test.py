@@ -0,0 +1,68 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import numpy as np
+import astropy.units as u
+import astwro.starlist as sl
+import astwro.sampledata as data
+
+
+def distances(s):
+    xy = s[['x', 'y']].values.astype(float)
+    d = np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(d, np.inf)
+    return d
+
+
+def test_neighbours_isolated():
+    s = sl.read_dao_file(data.ap_file())
+    d = distances(s)
+    pairs = s.neighbours(10)
+    assert len(pairs) == (d <= 10).sum()
+    assert (pairs.distance <= 10).all()
+    assert (s.isolated(10).values == ((d <= 10).sum(axis=1) == 0)).all()
+    mag = s.mag.values
+    disturbing = (d <= 10) & (mag[None, :] < mag[:, None] + 1.0)
+    assert (s.isolated(10, dmag=1.0).values == (disturbing.sum(axis=1) == 0)).all()
+
+
+def test_nearest_within():
+    s = sl.read_dao_file(data.ap_file())
+    other = s.sample(300, random_state=1).copy()
+    other['x'] += 0.3
+    n = s.nearest(other, max_distance=1)
+    matched = n[n.nearest_id != -1]
+    assert len(matched) == 300
+    assert (matched.index == matched.nearest_id).all()
+    assert n.distance.isnull().sum() == s.stars_number() - 300
+    w = s.within((100, 300, 200, 400))
+    inside = s[(s.x >= 100) & (s.x <= 300) & (s.y >= 200) & (s.y <= 400)]
+    assert sorted(w.id) == sorted(inside.id)
+
+
+def test_kdtree_cache():
+    s = sl.read_dao_file(data.ap_file())
+    tree = s.kdtree()
+    assert s.kdtree() is tree
+    s.loc[s.index[0], 'x'] = 5000.0
+    assert s.kdtree() is not tree
+    s['ra_deg'] = np.linspace(10, 10.5, s.stars_number())
+    s['dec_deg'] = 0.0
+    step = 0.5 / (s.stars_number() - 1)
+    pairs = s.neighbours(1.5 * step * u.deg, sky=True)
+    assert len(pairs) == 2 * (s.stars_number() - 1)
+    assert np.allclose(pairs.distance, step)
+
+
+def test_prebuilt_tree():
+    s = sl.read_dao_file(data.ap_file())
+    tree = s.kdtree()
+    assert s.neighbours(10, tree=tree).equals(s.neighbours(10))
+    assert s.within((100, 300, 200, 400), tree=tree).equals(s.within((100, 300, 200, 400)))
+    n = s.nearest(s, max_distance=1, tree=tree)
+    assert (n.nearest_id == n.index).all()
+    s['x'] += 1000.0
+    # prebuilt tree is used as is, without check
+    assert len(s.within((100, 300, 200, 400), tree=tree)) > 0
+    assert len(s.within((100, 300, 200, 400))) == 0
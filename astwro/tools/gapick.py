@@ -30,11 +30,6 @@ import time
 from datetime import timedelta
 from copy import deepcopy
 
-try:
-    from itertools import izip_longest as zip_longest
-except ImportError:
-    from itertools import zip_longest
-
 import numpy
 from bitarray import bitarray
 from scipy.stats import sigmaclip
@@ -47,6 +42,7 @@ import astwro.starlist as sl
 import astwro.pydaophot as dao
 import astwro.tools
 import astwro.utils as utils
+from astwro.exttools import RunnerPool, ResultCache
 from astwro.phot import PhotError
 
 _time_format = '%a %H:%M:%S'
@@ -115,165 +111,80 @@ def fitness_for_als(als):
     return (als.mag_err*w).sum()/w.sum(),  # fitness is tuple (val,)
 
 
-def eval_population(population, candidates, workers, show_progress, fine_tune):
-    if fine_tune:
-        return eval_population_fine_psf(population, candidates, workers, show_progress)
-    else:
-        return eval_population_simple(population, candidates, workers, show_progress)
-
-
-def eval_population_fine_psf(population, candidates, workers, show_progress):
-    # type: (list(bitarray), sl.StarList, list(dict), bool) -> list
+def eval_population(population, candidates, pool, show_progress, fine_tune):
+    # type: (list(bitarray), sl.StarList, RunnerPool, bool, bool) -> list
     # Evaluates fitness for all individual in population.
-
-    # This version uses sofisticated process from daophot_bialkow
-    # Uses daophots and allstars processes form `workers` running them in parallel.
+    # Uses daophots and allstars workers from `pool` running them in parallel.
     # :return: list fitnesses (1-element couples as `deap` lib likes)
 
+    fitness_for_individual = fitness_fine_psf if fine_tune else fitness_simple
     progress = None
     if show_progress:
-        progress = utils.progressbar(total=len(population), step=len(workers))
+        progress = utils.progressbar(total=len(population), step=1)
         progress.print_progress(0)
+    futures = [pool.submit(fitness_for_individual, individual, candidates) for individual in population]
     fitnesses = []
     f_max = None
-    # https://docs.python.org/3/library/itertools.html#itertools-recipes grouper()
-    # grouping population into chunks of size `parallel`
-    for chunk in zip_longest(*([iter(population)] * len(workers))):
-        active = [g is not None for g in chunk]  # all active, on errors some could be deactivated
-        # PSF
-        for individual, worker in zip(chunk, workers):
-            if individual:
-                pdf_s = select_stars(candidates, individual)
-                worker['daophot'].write_starlist(pdf_s, 'i.lst')
-                worker['daophot'].PSf(psf_stars='i.lst')  # add to queue only - batch mode
-                worker['daophot'].run(wait=False)  # parallel start all workers without waiting
-        # wait for PSF and start ALLSTAR nei
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()  # now wait before using results
-                active[i] = worker['daophot'].PSf_result.converged  # PSF is not always successful
-                if active[i]:
-                    worker['allstar'].ALlstar(stars='i.nei')  # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-        # second PSF
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                if worker['allstar'].ALlstars_result.success:
-                    worker['daophot'].SUbstar(subtract='i.als', leave_in='i.lst')
-                    worker['daophot'].run()  # quick run
-                    worker['daophot'].ATtach('is')
-                    worker['daophot'].PSf(photometry='i.als', psf_stars='i.lst')
-                    worker['daophot'].run(wait=False)
-                else:
-                    active[i] = False
-        # second allstar
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()
-                if worker['daophot'].PSf_result.success:
-                    worker['allstar'].ALlstar(stars='i.nei')  # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-                else:
-                    active[i] = False
-        # third PSF
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                if worker['allstar'].ALlstars_result.success:
-                    worker['daophot'].SUbstar(subtract='i.als', leave_in='i.lst')
-                    worker['daophot'].run()  # quick run
-                    worker['daophot'].ATtach('is')
-                    worker['daophot'].PSf(photometry='i.als', psf_stars='i.lst')
-                    worker['daophot'].run(wait=False)
-                else:
-                    active[i] = False
-        # final allstar
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()
-                if worker['daophot'].PSf_result.success:
-                    worker['allstar'].ALlstar(stars='als.ap')  # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-                else:
-                    active[i] = False
-
-        # wait for allstar for workers and process results
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                all_s = worker['allstar'].ALlstars_result.als_stars
-                f = fitness_for_als(all_s)
-                fitnesses.append(f)  # fitness is tuple (val,)
-                f_max = f if f_max is None or f_max[0] < f[0] else f_max
-            #                f_max = f[0] if f_max is None else max(f_max, f[0])
-            else:
-                fitnesses.append(None)
-        # cut fitnesses if longer than population
-        # (finesses mod parallel == 0, some None at the end can appear if population mod parallel != 0)
-        fitnesses = fitnesses[:len(population)]
-        # fill gaps in fitnesses with maximum of rest of population
-        for i, f in enumerate(fitnesses):
-            if f is None:
-                fitnesses[i] = f_max
+    for future in futures:
+        try:
+            f = future.result()
+        except Exception as e:
+            logging.warning('Fitness evaluation failed: {}'.format(e))
+            f = None
+        if f is not None:
+            f_max = f if f_max is None or f_max[0] < f[0] else f_max
+        fitnesses.append(f)
         if progress:
             progress.print_progress()
-
+    # fill gaps in fitnesses with maximum of rest of population
+    for i, f in enumerate(fitnesses):
+        if f is None:
+            fitnesses[i] = f_max
     return fitnesses
 
 
-def eval_population_simple(population, candidates, workers, show_progress):
-    # type: (list(bitarray), sl.StarList, list(dict), bool) -> list
-    # Evaluates fitness for all individual in population.
-    # Uses daophots and allstars processes form `workers` running them in parallel.
-    # :return: list fitnesses (1-element couples as `deap` lib likes)
-
-    progress = None
-    if show_progress:
-        progress = utils.progressbar(total=len(population), step=len(workers))
-        progress.print_progress(0)
-    fitnesses = []
-    f_max = None
-    # https://docs.python.org/3/library/itertools.html#itertools-recipes grouper()
-    # grouping population into chunks of size `parallel`
-    for chunk in zip_longest(*([iter(population)] * len(workers))):
-        active = [g is not None for g in chunk]  # all active, on errors some could be deactivated
-        # PSF
-        for individual, worker in zip(chunk, workers):
-            if individual:
-                pdf_s = select_stars(candidates, individual)
-                worker['daophot'].PSf(psf_stars=pdf_s)  # add to queue only - batch mode
-                worker['daophot'].run(wait=False)  # parallel start all workers without waiting
-        # wait for PSF and start ALLSTAR
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()  # now wait before using results
-                active[i] = worker['daophot'].PSf_result.converged  # PSF is not always successful
-                if active[i]:
-                    worker['allstar'].ALlstar(stars='als.ap')  # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-        # wait for allstar for workers and process results
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                all_s = worker['allstar'].ALlstars_result.als_stars
-                f = fitness_for_als(all_s)
-                fitnesses.append(f)  # fitness is tuple (val,)
-                f_max = f if f_max is None or f_max[0] < f[0] else f_max
-            #                f_max = max(f_max, f)
-            else:
-                fitnesses.append(None)
-        # cut fitnesses if longer than population
-        # (finesses mod parallel == 0, some None at the end can appear if population mod parallel != 0)
-        fitnesses = fitnesses[:len(population)]
-        # fill gaps in fitnesses by maximum of rest of population
-        for i, f in enumerate(fitnesses):
-            if f is None:
-                fitnesses[i] = f_max
-        if progress:
-            progress.print_progress()
+def fitness_fine_psf(worker, individual, candidates):
+    # type: (dict, bitarray, sl.StarList) -> (float,)
+    # Evaluates fitness of individual on worker, None if PSF or ALLSTAR fails
 
-    return fitnesses
+    # This version uses sofisticated process from daophot_bialkow
+    daophot, allstar = worker['daophot'], worker['allstar']
+    pdf_s = select_stars(candidates, individual)
+    daophot.write_starlist(pdf_s, 'i.lst')
+    daophot.PSf(psf_stars='i.lst')  # add to queue only - batch mode
+    daophot.run()
+    if not daophot.PSf_result.converged:  # PSF is not always successful
+        return None
+    allstar.ALlstar(stars='i.nei')
+    allstar.run()
+    # second and third PSF, then allstar on all stars
+    for stars in ['i.nei', 'als.ap']:
+        if not allstar.ALlstars_result.success:
+            return None
+        daophot.SUbstar(subtract='i.als', leave_in='i.lst')
+        daophot.run()  # quick run
+        daophot.ATtach('is')
+        daophot.PSf(photometry='i.als', psf_stars='i.lst')
+        daophot.run()
+        if not daophot.PSf_result.success:
+            return None
+        allstar.ALlstar(stars=stars)
+        allstar.run()
+    return fitness_for_als(allstar.ALlstars_result.als_stars)
+
+
+def fitness_simple(worker, individual, candidates):
+    # type: (dict, bitarray, sl.StarList) -> (float,)
+    # Evaluates fitness of individual on worker, None if PSF fails
+    daophot, allstar = worker['daophot'], worker['allstar']
+    pdf_s = select_stars(candidates, individual)
+    daophot.PSf(psf_stars=pdf_s)  # add to queue only - batch mode
+    daophot.run()
+    if not daophot.PSf_result.converged:  # PSF is not always successful
+        return None
+    allstar.ALlstar(stars='als.ap')
+    allstar.run()
+    return fitness_for_als(allstar.ALlstars_result.als_stars)
 
 
 def _prepare_output_dir(outdir, overwrite, srcdir, arg):
@@ -520,109 +431,117 @@ def __do(arg):
     stats.register('max', numpy.max)
 
     # Initiate workers. Each worker has Daophot and Allstar objects sharing runner directory,
-    # working in batch mode.
-    workers = []
+    # working in batch mode. Daophot process is kept alive with image attached.
     workers_logger = logging.getLogger('worker')
     workers_logger.setLevel('ERROR')  # prevent workers flood output with logrecords
-    for i in range(arg.parallel):
-        d = dp.clone()  # clone previously used daophot
+
+    cache = ResultCache() if arg.cache else None
+
+    def make_worker(d):  # d is clone of previously used daophot
         d.batch_mode = True
+        d.preserve_process = True
         a = dao.Allstar(dir=d.dir, image=d.image, batch=True, options={'MA': 100})
+        a.cache = cache
+        d.timeout = a.timeout = arg.timeout
         d.logger = workers_logger
         a.logger = workers_logger
-        workers.append({'daophot': d, 'allstar': a})
-
-    # Setup initial population, HoF and logbook and  or load it from checkpoint when continuing previous calculation
-    start_gen = 0
-
-    #    if arg.checkpoint:   ## Not implemented
-    if False:
-        with open(os.path.expanduser(arg.checkpoint), "rb") as f:
-            checkpoint = pickle.load(f)
-        pop = checkpoint['population']
-        start_gen = checkpoint['generation']
-        hof = checkpoint['halloffame']
-        logbook = checkpoint['logbook']
-        logging.info('Restoring genetic algorithm on {} of {} generations'.format(start_gen, arg.ga_max_iter))
-    else:
-        hof = tools.HallOfFame(maxsize=10)
-
-        logbook = tools.Logbook()
-        logbook.header = 'gen', 'fitness', 'size'
-        logbook.chapters['fitness'].header = 'min', 'avg', 'max', 'std'
-        logbook.chapters['size'].header = 'min', 'avg', 'max'
-
-        pop = toolbox.population(n=arg.ga_pop)
-        logging.info('Starting genetic algorithm for {} generations at {}'.format(
-            arg.ga_max_iter,
-            time.strftime(_time_format, time.localtime())
-        ))
-        logging.info('{} parallel threads, ETA will be calculated after generation 1'.format(arg.parallel))
-
-    # Calculate fitnesses of initial population
-    fitnesses = eval_population(pop, candidates, workers, show_progress=not arg.no_progress, fine_tune=arg.fine)
-    for ind, fit in zip(pop, fitnesses):
-        ind.fitness.values = fit
-
-    record = stats.compile(pop)
-    logbook.record(gen=0, spectrum=calc_spectrum(pop), **record)
-    clogger.info('{}\t ETA: [... to be determined]'.format(logbook.stream))
-
-    evolution_start_time = time.time()
-
-    # Begin the evolution
-    for g in range(start_gen + 1, arg.ga_max_iter):
-        #  New Generation
-        #  select the next generation individuals
-        offspring = toolbox.select(pop, len(pop))
-        # Clone the selected individuals
-        offspring = list(map(toolbox.clone, offspring))
-        # Apply crossover and mutation on the offspring
-        for child1, child2 in zip(offspring[::2], offspring[1::2]):
-            if random.random() < arg.ga_cross_prob:
-                toolbox.mate(child1, child2)
-                del child1.fitness.values
-                del child2.fitness.values
-        for mutant in offspring:
-            if random.random() < arg.ga_mut_prob:
-                toolbox.mutate(mutant)
-                del mutant.fitness.values
-
-        # calculate fitnesses of new individuals
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = eval_population(invalid_ind, candidates, workers, show_progress=not arg.no_progress,
-                                    fine_tune=arg.fine)
-        for ind, fit in zip(invalid_ind, fitnesses):
+        return {'daophot': d, 'allstar': a}
+
+    pool = RunnerPool(dp, size=arg.parallel, worker_factory=make_worker, retries=1)
+    try:  # workers and their living processes stopped also on errors and interrupts
+        # Setup initial population, HoF and logbook and  or load it from checkpoint when continuing previous calculation
+        start_gen = 0
+
+        #    if arg.checkpoint:   ## Not implemented
+        if False:
+            with open(os.path.expanduser(arg.checkpoint), "rb") as f:
+                checkpoint = pickle.load(f)
+            pop = checkpoint['population']
+            start_gen = checkpoint['generation']
+            hof = checkpoint['halloffame']
+            logbook = checkpoint['logbook']
+            logging.info('Restoring genetic algorithm on {} of {} generations'.format(start_gen, arg.ga_max_iter))
+        else:
+            hof = tools.HallOfFame(maxsize=10)
+
+            logbook = tools.Logbook()
+            logbook.header = 'gen', 'fitness', 'size'
+            logbook.chapters['fitness'].header = 'min', 'avg', 'max', 'std'
+            logbook.chapters['size'].header = 'min', 'avg', 'max'
+
+            pop = toolbox.population(n=arg.ga_pop)
+            logging.info('Starting genetic algorithm for {} generations at {}'.format(
+                arg.ga_max_iter,
+                time.strftime(_time_format, time.localtime())
+            ))
+            logging.info('{} parallel threads, ETA will be calculated after generation 1'.format(pool.size))
+
+        # Calculate fitnesses of initial population
+        fitnesses = eval_population(pop, candidates, pool, show_progress=not arg.no_progress, fine_tune=arg.fine)
+        for ind, fit in zip(pop, fitnesses):
             ind.fitness.values = fit
-        # New population from offspring
-        pop[:] = offspring
 
-        # Stats
-        # hof.update(pop)  # not implemented yet, __deapcopy__ of the Individual should work first
-        ETA = time.strftime(_time_format, time.localtime(
-            evolution_start_time + (time.time() - evolution_start_time) * arg.ga_max_iter / g))
         record = stats.compile(pop)
-        logbook.record(gen=g, spectrum=calc_spectrum(pop), **record)
-        clogger.info('{}\t ETA: {}'.format(logbook.stream, ETA))
-
-        # For every generation create lst file and ds9 reg file of best and point symlinks to last generation
-        if result_dir:
-            best_ind = tools.selBest(pop, 1)[0]
-            best_stars = select_stars(candidates, best_ind)
-            lst_file.next_file(g)
-            reg_file.next_file(g)
-            gen_file.next_file(g)
-            sl.write_dao_file(best_stars, lst_file.file, sl.DAO.LST_FILE)
-            sl.write_ds9_regions(best_stars, reg_file.file)
-            for ind in pop:
-                gen_file.file.write(ind.to01() + '\n')
-            with open(os.path.join(result_dir, 'logbook.pkl'), 'wb') as f:
-                pickle.dump(logbook, f)
-            checkpoint = dict(population=pop, generation=g, halloffame=hof, logbook=logbook)
-            with open(os.path.join(result_dir, 'checkpoint.chk'), 'wb') as f:
-                pickle.dump(checkpoint, f)
-
-        # end of evolution loop
+        logbook.record(gen=0, spectrum=calc_spectrum(pop), **record)
+        clogger.info('{}\t ETA: [... to be determined]'.format(logbook.stream))
+
+        evolution_start_time = time.time()
+
+        # Begin the evolution
+        for g in range(start_gen + 1, arg.ga_max_iter):
+            #  New Generation
+            #  select the next generation individuals
+            offspring = toolbox.select(pop, len(pop))
+            # Clone the selected individuals
+            offspring = list(map(toolbox.clone, offspring))
+            # Apply crossover and mutation on the offspring
+            for child1, child2 in zip(offspring[::2], offspring[1::2]):
+                if random.random() < arg.ga_cross_prob:
+                    toolbox.mate(child1, child2)
+                    del child1.fitness.values
+                    del child2.fitness.values
+            for mutant in offspring:
+                if random.random() < arg.ga_mut_prob:
+                    toolbox.mutate(mutant)
+                    del mutant.fitness.values
+
+            # calculate fitnesses of new individuals
+            invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+            fitnesses = eval_population(invalid_ind, candidates, pool, show_progress=not arg.no_progress,
+                                        fine_tune=arg.fine)
+            for ind, fit in zip(invalid_ind, fitnesses):
+                ind.fitness.values = fit
+            # New population from offspring
+            pop[:] = offspring
+
+            # Stats
+            # hof.update(pop)  # not implemented yet, __deapcopy__ of the Individual should work first
+            ETA = time.strftime(_time_format, time.localtime(
+                evolution_start_time + (time.time() - evolution_start_time) * arg.ga_max_iter / g))
+            record = stats.compile(pop)
+            logbook.record(gen=g, spectrum=calc_spectrum(pop), **record)
+            clogger.info('{}\t ETA: {}'.format(logbook.stream, ETA))
+
+            # For every generation create lst file and ds9 reg file of best and point symlinks to last generation
+            if result_dir:
+                best_ind = tools.selBest(pop, 1)[0]
+                best_stars = select_stars(candidates, best_ind)
+                lst_file.next_file(g)
+                reg_file.next_file(g)
+                gen_file.next_file(g)
+                sl.write_dao_file(best_stars, lst_file.file, sl.DAO.LST_FILE)
+                sl.write_ds9_regions(best_stars, reg_file.file)
+                for ind in pop:
+                    gen_file.file.write(ind.to01() + '\n')
+                with open(os.path.join(result_dir, 'logbook.pkl'), 'wb') as f:
+                    pickle.dump(logbook, f)
+                checkpoint = dict(population=pop, generation=g, halloffame=hof, logbook=logbook)
+                with open(os.path.join(result_dir, 'checkpoint.chk'), 'wb') as f:
+                    pickle.dump(checkpoint, f)
+
+            # end of evolution loop
+    finally:
+        pool.close()
 
     if result_dir:
         lst_file.close()
@@ -749,9 +668,16 @@ def __arg_parser():
     g_ga.add_argument('--ga-mut-str', metavar='x', default=0.05, type=float,
                       help='mutation strength of GA - probability of every bit flip in mutant (default: 0.05)')
     g_cnt = parser.add_argument_group('gapick run control parameters')
-    g_cnt.add_argument('-p', '--parallel', metavar='n', type=int, default=8,
+    g_cnt.add_argument('-p', '--parallel', metavar='n', type=int, default=None,
                        help='how many parallel processes can be forked; '
-                            'n=1 avoids parallelism (default: 8)')
+                            'n=1 avoids parallelism (default: number of CPUs)')
+    g_cnt.add_argument('--cache', action='store_true',
+                       help='reuse allstar results for already evaluated PSF star sets from on-disk cache, '
+                            'also between gapick runs (location and size in [cache] section of astwro.cfg)')
+    g_cnt.add_argument('--timeout', metavar='sec', type=float, default=None,
+                       help='time limit of single daophot or allstar run, hung process is killed and evaluation '
+                            'repeated once on fresh worker, then the individual is considered the worst one '
+                            '(default: no limit)')
     g_cnt.add_argument('-d', '--out-dir', metavar='output_dir', type=str, default='RESULTS',
                        help='output directory; directory will be created and result files will be stored there;'
                             ' directory should not exist or --overwrite flag should be set'
@@ -23,37 +23,54 @@ def __do(arg):
     if arg.output_format:
         arg.output_format = arg.output_format.upper()
 
+    # without sorting dao files are converted chunk by chunk, in constant memory
+    streaming = arg.sort is None and arg.input_format != 'DS9' and arg.output_format != 'DS9'
+
     if arg.input_format == 'DS9':
-        s = sl.read_ds9_regions(i)
+        chunks = [sl.read_ds9_regions(i)]
     else:
         daotype = None
         if arg.input_format == 'COO':
             daotype = sl.DAO.COO_FILE
         elif arg.input_format == 'SHORT':
             daotype = sl.DAO.SHORT_FILE
-        s = sl.read_dao_file(i, dao_type=daotype)
+        if streaming:
+            chunks = sl.iter_dao_file(i, dao_type=daotype)
+        else:
+            chunks = [sl.read_dao_file(i, dao_type=daotype)]
 
     if arg.verbose:
-        print ('Columns of input file: {}'.format(s.columns), file=stderr)
+        if streaming:
+            chunks = __print_columns(chunks)
+        else:
+            print ('Columns of input file: {}'.format(chunks[0].columns), file=stderr)
 
     if arg.sort is not None:
+        s = chunks[0]
         s.sort_values(s.columns[arg.sort], ascending=not arg.descending, inplace=True)
         if arg.verbose:
             print ('Sorting by {}'.format(s.columns[arg.sort]), file=stderr)
 
     if arg.output_format == 'DS9':
-        sl.write_ds9_regions(s, o)
+        sl.write_ds9_regions(chunks[0], o)
     else:
         daotype = sl.DAO.UNKNOWN_FILE
         if arg.output_format == 'COO':
             daotype = sl.DAO.COO_FILE
         elif arg.output_format == 'SHORT':
             daotype = sl.DAO.SHORT_FILE
-        sl.write_dao_file(s, o, dao_type=daotype)
+        sl.write_dao_chunks(chunks, o, dao_type=daotype)
 
     return sl
 
 
+def __print_columns(chunks):
+    for n, s in enumerate(chunks):
+        if n == 0:
+            print ('Columns of input file: {}'.format(s.columns), file=stderr)
+        yield s
+
+
 def __arg_parser():
     import argparse
     parser = argparse.ArgumentParser(
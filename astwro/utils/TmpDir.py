@@ -2,10 +2,19 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import os
+import errno
 import shutil
 from tempfile import mkdtemp
 from copy import deepcopy
 from os import PathLike
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+FICLONE = 0x40049409  # linux ioctl: reflink - copy-on-write clone of file (btrfs, xfs, ...)
+
 
 class TmpDir(PathLike):
     """
@@ -13,17 +22,26 @@ class TmpDir(PathLike):
     """
     path = None
     dir_is_tmp = True
+    clone_link_min_size = 2**20
+    """Files of that size or larger are hardlinked by :meth:`clone` if reflink is not supported,
+       ``None`` disables hardlinks"""
     _prefix = ''
     _base = None
+    _min_free = 0
 
-    def __init__(self, use_existing=None, prefix='astwro_tmp_', base_dir=None):
+    def __init__(self, use_existing=None, prefix='astwro_tmp_', base_dir=None, min_free=0):
         """
         :param str use_existing:    If provided, instance will point to that directory and not delete it on destruct
         :param str prefix:          Prefix for temporary dir
         :param str base_dir:        Where to crate tem dir, in None system default is used
+        :param int min_free:        Bytes which have to be available in base_dir (e.g. RAM backed /dev/shm),
+                                    if there is less space, or base_dir is not writable, system default is used
         """
         self._prefix = prefix
         self._base = base_dir
+        self._min_free = min_free
+        if base_dir is not None and not self._has_space(base_dir, min_free):
+            base_dir = None
         if use_existing is None:
             self.path = mkdtemp(prefix=prefix, dir=base_dir)
             self.dir_is_tmp = True
@@ -32,6 +50,15 @@ class TmpDir(PathLike):
             self.dir_is_tmp = False
 
     def clone(self):
+        """
+        Returns copy of TmpDir
+
+        For temporary directory, new temp dir is created and content is cloned. Each file is
+        reflinked (copy-on-write, if filesystem supports it), or hardlinked if its size is at least
+        :attr:`clone_link_min_size`, or copied. Symlinks are copied as symlinks.
+        Hardlinked files must not be modified in place: remove file before writing new content
+        (runners do that for output files).
+        """
         return deepcopy(self)
 
     def __del__(self):
@@ -54,9 +81,10 @@ class TmpDir(PathLike):
         new = cls.__new__(cls)
         memo[id(self)] = new
         if self.dir_is_tmp:
-            new.__init__(prefix=self._prefix, base_dir=self._base)
+            new.__init__(prefix=self._prefix, base_dir=self._base, min_free=self._min_free + self._clone_size())
             shutil.rmtree(new.path)
-            shutil.copytree(self.path, new.path, symlinks=True)
+            shutil.copytree(self.path, new.path, symlinks=True,
+                            copy_function=_CloneFile(self.clone_link_min_size))
         else:
             new.__init__(use_existing=self.path)
         return new
@@ -65,6 +93,26 @@ class TmpDir(PathLike):
         """Implements ``os.PathLike interface``"""
         return str(self)
 
+    @staticmethod
+    def _has_space(dir, size):
+        """Whether dir is writable and its filesystem has at least size bytes available"""
+        try:
+            st = os.statvfs(dir)
+        except (OSError, AttributeError):  # not exists or windows
+            return False
+        return os.access(dir, os.W_OK) and st.f_bavail * st.f_frsize >= size
+
+    def _clone_size(self):
+        """Estimated space needed by clone: size of files which will be copied, not linked"""
+        size = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                s = os.path.getsize(path)
+                if self.clone_link_min_size is None or s < self.clone_link_min_size:
+                    size += s
+        return size
+
     def _rm_dir(self):
         """Deletes working dir with all content."""
         if self.dir_is_tmp:
@@ -72,3 +120,37 @@ class TmpDir(PathLike):
                 shutil.rmtree(self.path)
             except OSError:
                 pass
+
+
+class _CloneFile(object):
+    """copy_function for copytree: reflink, hardlink of large files or copy"""
+
+    def __init__(self, link_min_size):
+        self.link_min_size = link_min_size
+        self.reflink = fcntl is not None
+
+    def __call__(self, src, dst):
+        if self.reflink and self._reflink(src, dst):
+            return dst
+        if self.link_min_size is not None and os.path.getsize(src) >= self.link_min_size:
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass
+        return shutil.copy2(src, dst)
+
+    def _reflink(self, src, dst):
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                self.reflink = False  # not supported by filesystem, don't try any more
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            return False
+        shutil.copystat(src, dst)
+        return True
@@ -3,15 +3,16 @@ from .CycleFile import CycleFile
 from .ProgressBar import ProgressBar
 from .fits_list import make_fits_table
 
-def tmpdir(use_existing=None, prefix='astwro_tmp_', base_dir=None):
+def tmpdir(use_existing=None, prefix='astwro_tmp_', base_dir=None, min_free=0):
     """
     Creates instance of TmpDir which creates and keeps lifetime of temporary directory
     :param str use_existing:    If provided, instance will point to that directory and not delete it on destruct
     :param str prefix:          Prefix for temporary dir
     :param str base_dir:        Where to crate tem dir, in None system default is used
+    :param int min_free:        Bytes required available in base_dir, if less system default is used
     :rtype: TmpDir
     """
-    return TmpDir(use_existing, prefix, base_dir)
+    return TmpDir(use_existing, prefix, base_dir, min_free)
 
 
 def cyclefile(path, basename, extension='', create_symlinks=True, symlink_suffix='_last', auto_close=True):
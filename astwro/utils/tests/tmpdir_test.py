@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+
+import os
+from astwro.utils import tmpdir
+from astwro.exttools import Runner
+
+
+def _make_dir():
+    d = tmpdir()
+    with open(os.path.join(d.path, 'big.fits'), 'wb') as f:
+        f.write(b'b' * 2**20)
+    with open(os.path.join(d.path, 'small.opt'), 'w') as f:
+        f.write('FI=3.0\n')
+    os.symlink('/nonexisting/img.fits', os.path.join(d.path, 'i.fits'))
+    return d
+
+
+def test_clone_content():
+    d = _make_dir()
+    c = d.clone()
+    assert c.path != d.path
+    assert sorted(os.listdir(c.path)) == ['big.fits', 'i.fits', 'small.opt']
+    assert os.readlink(os.path.join(c.path, 'i.fits')) == '/nonexisting/img.fits'
+    with open(os.path.join(c.path, 'big.fits'), 'rb') as f:
+        assert f.read() == b'b' * 2**20
+    # small files are never hardlinked
+    assert os.stat(os.path.join(c.path, 'small.opt')).st_ino != os.stat(os.path.join(d.path, 'small.opt')).st_ino
+
+
+def test_clone_write_does_not_change_source():
+    d = _make_dir()
+    r = Runner(dir=d)
+    c = r.clone()
+    src = os.path.join(d.path, 'new.fits')
+    with open(src, 'wb') as f:
+        f.write(b'n')
+    c.copy_to_runner_dir(src, 'big.fits')
+    with open(os.path.join(d.path, 'big.fits'), 'rb') as f:
+        assert f.read() == b'b' * 2**20
+    with open(c.file_from_runner_dir('big.fits'), 'rb') as f:
+        assert f.read() == b'n'
+
+
+def test_base_dir_capacity_fallback():
+    base = tmpdir()
+    assert os.path.dirname(tmpdir(base_dir=base.path, min_free=1).path) == base.path
+    assert os.path.dirname(tmpdir(base_dir=base.path, min_free=2**62).path) != base.path
+    assert os.path.dirname(tmpdir(base_dir='/nonexisting/dir').path) != '/nonexisting/dir'